@@ -0,0 +1,51 @@
+"""Compare maintainer queries in a cold nix-instantiate and in a warm nix repl.
+
+Needs nix and a nixpkgs checkout. Run from the repository root with:
+python -m benchmarks.bench_nix_eval /path/to/nixpkgs [package ...]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from nixpkgs_merge_bot.nix.evaluator import NixEvaluator
+from nixpkgs_merge_bot.nix.nix_utils import (
+    PACKAGE_MAINTAINERS_EXPR,
+    evaluate_maintainers,
+    warm_evaluate_maintainers,
+)
+
+QUERIES = 5
+
+
+def main() -> None:
+    nixpkgs = Path(sys.argv[1])
+    names = sys.argv[2:] or ["hello", "nixos-anywhere", "ripgrep"]
+    evaluator = NixEvaluator({"packageMaintainers": PACKAGE_MAINTAINERS_EXPR})
+    try:
+        cold = []
+        for _ in range(QUERIES):
+            started = time.monotonic()
+            expected = evaluate_maintainers(nixpkgs, names)
+            cold.append(time.monotonic() - started)
+        warm = []
+        for _ in range(QUERIES):
+            started = time.monotonic()
+            assert warm_evaluate_maintainers(evaluator, nixpkgs, names) == expected
+            warm.append(time.monotonic() - started)
+    finally:
+        evaluator.close()
+    print(f"{len(names)} packages, {QUERIES} queries")
+    print(
+        f"nix-instantiate: median {sorted(cold)[QUERIES // 2] * 1e3:8.1f} ms, "
+        f"first {cold[0] * 1e3:8.1f} ms"
+    )
+    # the first warm query starts the repl and imports nixpkgs
+    print(
+        f"nix repl:        median {sorted(warm)[QUERIES // 2] * 1e3:8.1f} ms, "
+        f"first {warm[0] * 1e3:8.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compare webhook signature checks on large pull_request payloads.
+
+Run from the repository root with: python -m benchmarks.bench_signature
+"""
+
+import functools
+import hashlib
+import hmac
+import json
+import timeit
+from email.message import Message
+from pathlib import Path
+
+from nixpkgs_merge_bot.webhook.secret import WebhookSecret
+
+ROOT = Path(__file__).parent.parent
+TEST_DATA = ROOT / "tests" / "data"
+SECRET_PATH = TEST_DATA / "webhook-secret.txt"
+
+
+def payload(size: int) -> bytes:
+    event = json.loads((TEST_DATA / "pull_request.json").read_text())
+    # pull request descriptions are the bulk of large deliveries
+    event["body"] = "x" * size
+    return json.dumps(event).encode("utf-8")
+
+
+def per_body_sha1(key: bytes, body: bytes, signature: str) -> bool:
+    """What the bot did before: key a new HMAC-SHA1 for every delivery."""
+    local_signature = hmac.new(key, msg=body, digestmod=hashlib.sha1)
+    return hmac.compare_digest(local_signature.hexdigest(), signature)
+
+
+def main() -> None:
+    key = SECRET_PATH.read_text().strip().encode("utf-8")
+    secret = WebhookSecret(SECRET_PATH)
+    for size in (16 * 1024, 256 * 1024, 4 * 1024 * 1024):
+        body = payload(size)
+        sha1 = hmac.new(key, body, hashlib.sha1).hexdigest()
+        sha256 = hmac.new(key, body, hashlib.sha256).hexdigest()
+        headers = Message()
+        headers["X-Hub-Signature-256"] = f"sha256={sha256}"
+        number = max(10, 50_000_000 // len(body))
+
+        assert per_body_sha1(key, body, sha1)
+        assert secret.validate_signature(body, headers)
+        old = timeit.timeit(
+            functools.partial(per_body_sha1, key, body, sha1), number=number
+        )
+        new = timeit.timeit(
+            functools.partial(secret.validate_signature, body, headers), number=number
+        )
+        print(
+            f"{len(body) / 1024:8.0f} KiB: "
+            f"sha1 per body {old / number * 1e6:9.1f} us, "
+            f"pre-keyed sha256 {new / number * 1e6:9.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
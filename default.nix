@@ -1,11 +1,13 @@
 {
   buildPythonApplication,
+  cryptography,
   openssl,
   lib,
   pytest,
   pytest-mock,
   setuptools,
   git,
+  nix,
   stdenv,
 }:
 
@@ -16,19 +18,22 @@ buildPythonApplication {
   makeWrapperArgs = [
     "--prefix PATH : ${
       lib.makeBinPath [
-        openssl
         git
       ]
     }"
   ];
   nativeBuildInputs = [ setuptools ];
+  dependencies = [ cryptography ];
   nativeCheckInputs = [
     pytest-mock
     pytest
     openssl
     git
+    nix
   ];
   checkPhase = ''
+    # lets the nix integration tests evaluate without a daemon
+    export HOME=$TMPDIR NIX_STATE_DIR=$TMPDIR/nix-state
     pytest ./tests
   '';
   meta = with lib; {
@@ -83,6 +83,13 @@ in
         "/run/nixpkgs-merge-bot.sock"
       ];
     };
+    # keep connections to the bot open between webhook deliveries
+    services.nginx.upstreams.nixpkgs-merge-bot = {
+      servers."unix:/run/nixpkgs-merge-bot.sock" = { };
+      extraConfig = ''
+        keepalive 8;
+      '';
+    };
     services.nginx.virtualHosts.${cfg.hostname} =
       let
         ips = builtins.fromJSON (builtins.readFile ./github-webhook-ips.json);
@@ -91,10 +98,12 @@ in
         enableACME = true;
         forceSSL = true;
         locations."/" = {
-          proxyPass = "http://unix:/run/nixpkgs-merge-bot.sock";
-          proxyWebsockets = true;
+          proxyPass = "http://nixpkgs-merge-bot";
           recommendedProxySettings = true;
           extraConfig = ''
+            # required for upstream keep-alive
+            proxy_http_version 1.1;
+            proxy_set_header Connection "";
             ${lib.concatMapStringsSep "\n" (ip: "allow ${ip};") ips}
             allow 127.0.0.1;
             allow ::1;
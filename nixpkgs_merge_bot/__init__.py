@@ -1,7 +1,6 @@
 import argparse
 import logging
 import os
-import sqlite3
 from pathlib import Path
 
 from .custom_logger import setup_logging
@@ -64,6 +63,116 @@ def parse_args() -> Settings:
         default="nixpkgs-committers",
         help="Committer Team Slug, default: nixpkgs-committers",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of webhook deliveries processed in parallel. Default is 4.",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=float,
+        default=60,
+        help="Seconds an idle keep-alive connection is kept open. Default is 60.",
+    )
+    parser.add_argument(
+        "--keepalive-max-requests",
+        type=int,
+        default=100,
+        help="Number of requests served per connection before it is closed. Default is 100.",
+    )
+    parser.add_argument(
+        "--fast-ack",
+        action="store_true",
+        help="Answer deliveries with 202 once they are queued on disk and process them in the background",
+    )
+    parser.add_argument(
+        "--job-queue-size",
+        type=int,
+        default=1000,
+        help="Maximum number of queued deliveries in --fast-ack mode. Default is 1000.",
+    )
+    parser.add_argument(
+        "--local-git",
+        action="store_true",
+        help="Inspect pull requests in the local nixpkgs clone instead of through the GitHub API",
+    )
+    parser.add_argument(
+        "--fetch-interval",
+        type=float,
+        default=60,
+        help="Seconds during which the nixpkgs repo is not fetched again. Default is 60.",
+    )
+    parser.add_argument(
+        "--max-worktrees",
+        type=int,
+        default=4,
+        help="Number of unused nixpkgs checkouts kept for reuse. Default is 4.",
+    )
+    parser.add_argument(
+        "--warm-eval",
+        action="store_true",
+        help="Evaluate maintainers in a long-running nix repl instead of a nix-instantiate per query",
+    )
+    parser.add_argument(
+        "--eval-timeout",
+        type=float,
+        default=600,
+        help="Seconds after which a query to the nix repl of --warm-eval is aborted. Default is 600.",
+    )
+    parser.add_argument(
+        "--eval-max-memory-mb",
+        type=int,
+        default=4096,
+        help="Memory after which the nix repl of --warm-eval is restarted. Default is 4096.",
+    )
+    parser.add_argument(
+        "--pending-merge-ttl",
+        type=float,
+        default=24 * 60 * 60,
+        help="Seconds after which a merge waiting for check runs is given up. Default is one day.",
+    )
+    parser.add_argument(
+        "--check-run-window",
+        type=float,
+        default=30,
+        help="Seconds without completed check runs after which pending merges of a commit are retried. Default is 30.",
+    )
+    parser.add_argument(
+        "--check-run-max-delay",
+        type=float,
+        default=300,
+        help="Seconds after the first completed check run after which pending merges are retried at the latest. Default is 300.",
+    )
+    parser.add_argument(
+        "--check-state-ttl",
+        type=float,
+        default=7 * 24 * 60 * 60,
+        help="Seconds the check runs of a commit are remembered. Default is one week.",
+    )
+    parser.add_argument(
+        "--graphql-snapshot",
+        action="store_true",
+        help="Read everything a merge decision needs about a pull request with GraphQL",
+    )
+    parser.add_argument(
+        "--command-concurrency",
+        type=int,
+        default=4,
+        help="Lookups a merge command makes at the same time at most. Default is 4.",
+    )
+    parser.add_argument(
+        "--delivery-ttl",
+        type=float,
+        default=3 * 24 * 60 * 60,
+        help="Seconds during which a redelivered webhook is answered without processing it again. Default is three days.",
+    )
+    parser.add_argument(
+        "--delivery-cache-size",
+        type=int,
+        default=10000,
+        help="Webhook delivery ids kept in memory in addition to the database. Default is 10000.",
+    )
     parser.add_argument("--debug", action="store_true", help="enable debug logging")
     args = parser.parse_args()
     return Settings(
@@ -78,18 +187,30 @@ def parse_args() -> Settings:
         repo_path=args.repo_path,
         committer_team_slug=args.committer_team_slug,
         max_file_size_mb=args.max_file_size_mb,
+        workers=args.workers,
+        keepalive_timeout=args.keepalive_timeout,
+        keepalive_max_requests=args.keepalive_max_requests,
+        fast_ack=args.fast_ack,
+        job_queue_size=args.job_queue_size,
+        local_git=args.local_git,
+        fetch_interval=args.fetch_interval,
+        max_worktrees=args.max_worktrees,
+        warm_eval=args.warm_eval,
+        eval_timeout=args.eval_timeout,
+        eval_max_memory_mb=args.eval_max_memory_mb,
+        pending_merge_ttl=args.pending_merge_ttl,
+        check_run_window=args.check_run_window,
+        check_run_max_delay=args.check_run_max_delay,
+        check_state_ttl=args.check_state_ttl,
+        graphql_snapshot=args.graphql_snapshot,
+        command_concurrency=args.command_concurrency,
+        delivery_ttl=args.delivery_ttl,
+        delivery_cache_size=args.delivery_cache_size,
     )
 
 
 def main() -> None:
     settings = parse_args()
-    con = sqlite3.connect(f"{settings.database_path}/nixpkgs_merge_bot.db")
-    cur = con.cursor()
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS prs_to_merge(repo_owner,repo_name,user_github_id,issue_number,sha)"
-    )
-    con.close()
-
     start_server(settings)
 
 
@@ -0,0 +1,239 @@
+import logging
+import time
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from .database import Database, get_database
+from .memoize import memoized
+from .metrics import METRICS
+from .settings import Settings
+
+log = logging.getLogger(__name__)
+
+# expired rows are removed after this many writes
+PRUNE_INTERVAL = 1000
+
+STATUS_RANK = """CASE {} WHEN 'completed' THEN 2 WHEN 'in_progress' THEN 1 ELSE 0 END"""
+
+
+class CheckStates:
+    """State of the check runs of commits, kept current by webhooks.
+
+    The check runs of a commit are listed through the API once ("seeded");
+    after that check_run deliveries update them. Deliveries may arrive out of
+    order, so a run only goes back to an earlier status when it was started
+    again. Commits whose state may have missed a delivery are seeded again.
+    """
+
+    def __init__(
+        self, db: Database, ttl: float, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.db = db
+        self._writes = 0
+        self.seeds = 0
+        self.invalidations = 0
+        self.db.create(
+            """CREATE TABLE IF NOT EXISTS check_runs(
+                repo_owner TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                head_sha TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                check_suite_id INTEGER,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                conclusion TEXT,
+                started_at TEXT NOT NULL,
+                app_id INTEGER NOT NULL,
+                app_name TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (repo_owner, repo_name, head_sha, id)
+            )""",
+            "CREATE INDEX IF NOT EXISTS check_runs_updated_at ON check_runs(updated_at)",
+            """CREATE TABLE IF NOT EXISTS check_runs_seeded(
+                repo_owner TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                head_sha TEXT NOT NULL,
+                seeded_at REAL NOT NULL,
+                PRIMARY KEY (repo_owner, repo_name, head_sha)
+            )""",
+        )
+
+    def record(
+        self, owner: str, repo: str, head_sha: str, check_run: dict[str, Any]
+    ) -> None:
+        """Store a check run as delivered by a webhook or listed by the API."""
+        with self.db.lock:
+            self._record(owner, repo, head_sha, check_run)
+            self._writes += 1
+            if self._writes % PRUNE_INTERVAL == 0:
+                self._prune()
+
+    def _record(
+        self, owner: str, repo: str, head_sha: str, check_run: dict[str, Any]
+    ) -> None:
+        self.db.con.execute(
+            f"""INSERT INTO check_runs(
+                repo_owner, repo_name, head_sha, id, check_suite_id, name, status,
+                conclusion, started_at, app_id, app_name, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(repo_owner, repo_name, head_sha, id) DO UPDATE SET
+                check_suite_id = excluded.check_suite_id,
+                name = excluded.name,
+                status = excluded.status,
+                conclusion = excluded.conclusion,
+                started_at = excluded.started_at,
+                updated_at = excluded.updated_at
+            WHERE excluded.started_at > check_runs.started_at
+                OR (
+                    excluded.started_at = check_runs.started_at
+                    AND {STATUS_RANK.format("excluded.status")}
+                        >= {STATUS_RANK.format("check_runs.status")}
+                )""",  # noqa: S608
+            (
+                owner,
+                repo,
+                head_sha,
+                check_run["id"],
+                (check_run.get("check_suite") or {}).get("id"),
+                check_run["name"],
+                check_run["status"],
+                check_run["conclusion"],
+                check_run.get("started_at") or "",
+                check_run["app"]["id"],
+                check_run["app"]["name"],
+                self.clock(),
+            ),
+        )
+
+    def seeded(self, owner: str, repo: str, head_sha: str) -> bool:
+        with self.db.lock:
+            return (
+                self.db.con.execute(
+                    "SELECT 1 FROM check_runs_seeded WHERE repo_owner = ? AND repo_name = ? AND head_sha = ?",
+                    (owner, repo, head_sha),
+                ).fetchone()
+                is not None
+            )
+
+    def seed(
+        self,
+        owner: str,
+        repo: str,
+        head_sha: str,
+        check_runs: Iterable[dict[str, Any]],
+    ) -> None:
+        """Replace the check runs of a commit with those listed by the API.
+
+        The listing only has the latest attempt of each run, so runs that were
+        superseded by a re-run are dropped. Runs delivered while it was being
+        fetched are kept.
+        """
+        listed_at = self.clock()
+        # the listing may take several requests, do them before locking
+        check_runs = list(check_runs)
+        with self.db.transaction() as con:
+            con.execute(
+                """DELETE FROM check_runs
+                WHERE repo_owner = ? AND repo_name = ? AND head_sha = ?
+                AND updated_at < ?""",
+                (owner, repo, head_sha, listed_at),
+            )
+            for check_run in check_runs:
+                self._record(owner, repo, head_sha, check_run)
+            con.execute(
+                "INSERT OR REPLACE INTO check_runs_seeded(repo_owner, repo_name, head_sha, seeded_at) VALUES (?, ?, ?, ?)",
+                (owner, repo, head_sha, self.clock()),
+            )
+            self.seeds += 1
+
+    def invalidate(self, owner: str, repo: str, head_sha: str) -> None:
+        """Seed the commit again before its check runs are used next time."""
+        with self.db.lock:
+            deleted = self.db.con.execute(
+                "DELETE FROM check_runs_seeded WHERE repo_owner = ? AND repo_name = ? AND head_sha = ?",
+                (owner, repo, head_sha),
+            ).rowcount
+            self.invalidations += deleted
+
+    def suite_completed(
+        self, owner: str, repo: str, head_sha: str, check_suite: dict[str, Any]
+    ) -> bool:
+        """Check the runs of a completed suite; False if deliveries were missed."""
+        with self.db.lock:
+            total, completed = self.db.con.execute(
+                """SELECT COUNT(*), COUNT(*) FILTER (WHERE status = 'completed')
+                FROM check_runs
+                WHERE repo_owner = ? AND repo_name = ? AND head_sha = ?
+                AND check_suite_id = ?""",
+                (owner, repo, head_sha, check_suite["id"]),
+            ).fetchone()
+        if completed == total and total >= check_suite.get(
+            "latest_check_runs_count", 0
+        ):
+            return True
+        log.info(
+            f"Check suite {check_suite['id']} of {head_sha} completed with {completed}/{total} known runs completed"
+        )
+        self.invalidate(owner, repo, head_sha)
+        return False
+
+    def check_runs(self, owner: str, repo: str, head_sha: str) -> list[dict[str, Any]]:
+        """The latest attempt of each check run of a commit."""
+        with self.db.lock:
+            rows = self.db.con.execute(
+                """SELECT id, name, status, conclusion, app_id, app_name FROM (
+                    SELECT *, ROW_NUMBER() OVER (
+                        PARTITION BY app_id, name ORDER BY started_at DESC, id DESC
+                    ) AS attempt
+                    FROM check_runs
+                    WHERE repo_owner = ? AND repo_name = ? AND head_sha = ?
+                )
+                WHERE attempt = 1
+                ORDER BY id""",
+                (owner, repo, head_sha),
+            ).fetchall()
+        return [
+            {
+                "id": id_,
+                "name": name,
+                "status": status,
+                "conclusion": conclusion,
+                "app": {"id": app_id, "name": app_name},
+            }
+            for id_, name, status, conclusion, app_id, app_name in rows
+        ]
+
+    def _prune(self) -> None:
+        cutoff = self.clock() - self.ttl
+        self.db.con.execute(
+            "DELETE FROM check_runs_seeded WHERE seeded_at < ?", (cutoff,)
+        )
+        # a seeded commit must not lose runs that were not updated in a while
+        self.db.con.execute(
+            """DELETE FROM check_runs WHERE updated_at < ? AND NOT EXISTS (
+                SELECT 1 FROM check_runs_seeded s
+                WHERE s.repo_owner = check_runs.repo_owner
+                AND s.repo_name = check_runs.repo_name
+                AND s.head_sha = check_runs.head_sha
+            )""",
+            (cutoff,),
+        )
+
+    def stats(self) -> dict[str, int]:
+        with self.db.lock:
+            return {
+                "check_runs": self.db.con.execute(
+                    "SELECT COUNT(*) FROM check_runs"
+                ).fetchone()[0],
+                "seeds": self.seeds,
+                "invalidations": self.invalidations,
+            }
+
+
+@memoized(lambda settings: settings.database_file)
+def get_check_states(settings: Settings) -> CheckStates:
+    states = CheckStates(get_database(settings), settings.check_state_ttl)
+    METRICS.gauge("check_states", states.stats)
+    return states
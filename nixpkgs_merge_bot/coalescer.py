@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Burst:
+    first: float
+    deadline: float
+    events: int = 1
+
+
+class Coalescer:
+    """Runs `action` once per burst of events with the same key.
+
+    The action runs `window` seconds after the last event of a burst, but no
+    later than `max_delay` seconds after its first one.
+    """
+
+    def __init__(
+        self,
+        action: Callable[[str, int], None],
+        window: float,
+        max_delay: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.action = action
+        self.window = window
+        self.max_delay = max_delay
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._bursts: dict[str, Burst] = {}
+        self._thread: threading.Thread | None = None
+        self.events = 0
+        self.runs = 0
+
+    def add(self, key: str) -> None:
+        with self._cond:
+            self.events += 1
+            now = self.clock()
+            burst = self._bursts.get(key)
+            if burst is None:
+                self._bursts[key] = Burst(now, now + self.window)
+            else:
+                burst.events += 1
+                burst.deadline = min(now + self.window, burst.first + self.max_delay)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="coalescer", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+
+    def run_due(self) -> float | None:
+        """Run the actions of finished bursts; returns when the next one is due."""
+        with self._cond:
+            now = self.clock()
+            due = [
+                (key, burst)
+                for key, burst in self._bursts.items()
+                if burst.deadline <= now
+            ]
+            for key, _ in due:
+                del self._bursts[key]
+            next_deadline = min(
+                (burst.deadline for burst in self._bursts.values()), default=None
+            )
+        for key, burst in due:
+            log.debug(f"Running {key} after {burst.events} events")
+            try:
+                self.action(key, burst.events)
+            except Exception:
+                log.exception(f"Coalesced action for {key} failed")
+            with self._cond:
+                self.runs += 1
+        return next_deadline
+
+    def _run(self) -> None:
+        while True:
+            next_deadline = self.run_due()
+            with self._cond:
+                if next_deadline is not None:
+                    self._cond.wait(max(0, next_deadline - self.clock()))
+                elif not self._bursts:
+                    self._cond.wait()
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {
+                "waiting": len(self._bursts),
+                "events": self.events,
+                "runs": self.runs,
+            }
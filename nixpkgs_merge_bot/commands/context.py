@@ -0,0 +1,251 @@
+import logging
+import subprocess
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any, Generic, TypeVar
+from urllib.parse import urlparse
+
+from nixpkgs_merge_bot.check_states import get_check_states
+from nixpkgs_merge_bot.fan_out import FanOut
+from nixpkgs_merge_bot.git import changed_files, fetch_pull_request, get_blob_sizes
+from nixpkgs_merge_bot.github.committers import get_team_cache
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.github.pull_request import PullRequest
+from nixpkgs_merge_bot.github.snapshot import PullRequestSnapshot
+from nixpkgs_merge_bot.metrics import METRICS
+from nixpkgs_merge_bot.nix.nix_utils import (
+    PackageMaintainers,
+    get_package_maintainers,
+    package_name,
+)
+from nixpkgs_merge_bot.settings import Settings
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SharedIterator(Generic[T]):
+    """Iterable over an iterator that can be iterated more than once.
+
+    Items are pulled from the underlying iterator only as far as some caller
+    has looked, so pages that nobody needs are never fetched.
+    """
+
+    def __init__(self, iterator: Iterator[T]) -> None:
+        self._iterator = iterator
+        self._items: list[T] = []
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[T]:
+        i = 0
+        while True:
+            with self._lock:
+                if i >= len(self._items) and not self._exhausted:
+                    try:
+                        self._items.append(next(self._iterator))
+                    except StopIteration:
+                        self._exhausted = True
+                if i >= len(self._items):
+                    return
+                item = self._items[i]
+            yield item
+            i += 1
+
+
+class CommandContext:
+    """GitHub reads of a single command.
+
+    Every merging strategy looks at the same pull request, so each read is
+    done once and its decoded body shared for the rest of the command. Reads
+    may come from several threads of `fan_out`.
+    """
+
+    def __init__(self, client: GithubClient, settings: Settings) -> None:
+        self.client = client
+        self.settings = settings
+        self.fan_out = FanOut(settings.command_concurrency, name="command")
+        self._local_git_failed = False
+        self._maintainers: dict[tuple[str, str], dict[str, PackageMaintainers]] = {}
+        self._maintainers_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._reads: dict[tuple[Any, ...], Any] = {}
+        # held while a read is in flight, so concurrent callers wait for it
+        self._read_locks: dict[tuple[Any, ...], threading.Lock] = {}
+        # by head sha
+        self._snapshots: dict[str, PullRequestSnapshot] = {}
+        self.calls = 0
+        self.saved = 0
+
+    def _read(self, key: tuple[Any, ...], fetch: Callable[[], Any]) -> Any:
+        with self._lock:
+            read_lock = self._read_locks.setdefault(key, threading.Lock())
+        with read_lock:
+            with self._lock:
+                if key in self._reads:
+                    self.saved += 1
+                    return self._reads[key]
+                self.calls += 1
+            value = fetch()
+            with self._lock:
+                self._reads[key] = value
+            return value
+
+    def _count(self, calls: int = 0, saved: int = 0) -> None:
+        with self._lock:
+            self.calls += calls
+            self.saved += saved
+
+    def pull_request(self, owner: str, repo: str, pr_number: int) -> Any:
+        return self._read(
+            ("pull_request", owner, repo, pr_number),
+            lambda: self.client.pull_request(owner, repo, pr_number).json(),
+        )
+
+    def snapshot(self, owner: str, repo: str, pr_number: int) -> PullRequestSnapshot:
+        snapshot = self._read(
+            ("snapshot", owner, repo, pr_number),
+            lambda: self.client.pull_request_snapshot(
+                owner, repo, pr_number, self.settings.committer_team_slug
+            ),
+        )
+        self._snapshots[snapshot.pull_request.head_sha] = snapshot
+        return snapshot
+
+    def load_pull_request(self, owner: str, repo: str, pr_number: int) -> PullRequest:
+        if self.settings.graphql_snapshot:
+            return self.snapshot(owner, repo, pr_number).pull_request
+        return PullRequest.from_json(self.pull_request(owner, repo, pr_number))
+
+    def pull_request_files(
+        self, owner: str, repo: str, pr_number: int
+    ) -> Iterable[dict[str, Any]]:
+        return self._read(
+            ("pull_request_files", owner, repo, pr_number),
+            lambda: SharedIterator(
+                self.client.iter_pull_request_files(owner, repo, pr_number)
+            ),
+        )
+
+    def changed_files(self, pull_request: PullRequest) -> Iterable[dict[str, Any]]:
+        """Files of the pull request, from the local clone if enabled."""
+        snapshot = self._snapshots.get(pull_request.head_sha)
+        if snapshot is not None:
+            return snapshot.files
+        if self.settings.local_git and not self._local_git_failed:
+            try:
+                return self._read(
+                    ("changed_files", pull_request.number, pull_request.head_sha),
+                    lambda: self._local_changed_files(pull_request),
+                )
+            except (OSError, subprocess.CalledProcessError):
+                log.exception(
+                    f"{pull_request.number}: cannot inspect the pull request locally, asking GitHub"
+                )
+                self._local_git_failed = True
+        return self.pull_request_files(
+            pull_request.repo_owner, pull_request.repo_name, pull_request.number
+        )
+
+    def _local_changed_files(self, pull_request: PullRequest) -> list[dict[str, Any]]:
+        repo_path = self.settings.repo_path
+        fetch_pull_request(repo_path, pull_request.number, pull_request.ref)
+        files: list[dict[str, Any]] = []
+        blob_sizes = get_blob_sizes(repo_path)
+        for file in changed_files(
+            repo_path, f"refs/remotes/origin/{pull_request.ref}", pull_request.head_sha
+        ):
+            # removed files have no size in the pull request
+            size = blob_sizes.size(pull_request.head_sha, file["filename"])
+            files.append({**file, "size": size or 0})
+        return files
+
+    def file_size(self, pull_request: PullRequest, file: dict[str, Any]) -> int:
+        if "size" in file:
+            return file["size"]
+        file_contents_url = urlparse(file["contents_url"])
+        return self.file_content(
+            pull_request.repo_owner,
+            pull_request.repo_name,
+            file["filename"],
+            file_contents_url.query,
+        )["size"]
+
+    def file_content(
+        self, owner: str, repo: str, filepath: str, ref_query_param: str
+    ) -> dict[str, Any]:
+        return self._read(
+            ("file_content", owner, repo, filepath, ref_query_param),
+            lambda: self.client.get_request_file_content(
+                owner, repo, filepath, ref_query_param
+            ).json(),
+        )
+
+    def check_runs(self, owner: str, repo: str, ref: str) -> Iterable[dict[str, Any]]:
+        """Check runs of commit `ref`, listed through the API only once.
+
+        check_run deliveries keep the local state current afterwards.
+        """
+        states = get_check_states(self.settings)
+        snapshot = self._snapshots.get(ref)
+        if states.seeded(owner, repo, ref):
+            self._count(saved=1)
+        elif snapshot is not None and snapshot.check_runs is not None:
+            self._count(saved=1)
+            states.seed(owner, repo, ref, snapshot.check_runs)
+        else:
+            self._count(calls=1)
+            states.seed(
+                owner,
+                repo,
+                ref,
+                self.client.iter_check_runs_for_commit(owner, repo, ref),
+            )
+        return states.check_runs(owner, repo, ref)
+
+    def is_team_member(
+        self, org: str, team_slug: str, login: str, user_id: int
+    ) -> bool:
+        for snapshot in list(self._snapshots.values()):
+            if (
+                snapshot.author_in_team is not None
+                and snapshot.pull_request.user_id == user_id
+                and snapshot.pull_request.repo_owner == org
+                and team_slug == self.settings.committer_team_slug
+            ):
+                self._count(saved=1)
+                return snapshot.author_in_team
+        return self._read(
+            ("team_member", org, team_slug, login, user_id),
+            lambda: get_team_cache(org, team_slug).is_member(
+                self.client, login, user_id
+            ),
+        )
+
+    def package_maintainers(
+        self, pull_request: PullRequest
+    ) -> dict[str, PackageMaintainers]:
+        """Maintainers of all packages the pull request touches, evaluated at once."""
+        key = (pull_request.ref, pull_request.head_sha)
+        with self._maintainers_lock:
+            if key not in self._maintainers:
+                self._maintainers[key] = get_package_maintainers(
+                    self.settings,
+                    {
+                        package_name(Path(file["filename"]))
+                        for file in self.changed_files(pull_request)
+                    },
+                    pull_request.ref,
+                )
+            return self._maintainers[key]
+
+    def close(self) -> None:
+        """Drop prefetches that did not start and wait for the running ones."""
+        self.fan_out.shutdown()
+
+    def report(self, name: str) -> None:
+        log.debug(f"{name}: {self.calls} GitHub reads, {self.saved} saved")
+        METRICS.inc("command_github_reads", self.calls)
+        METRICS.inc("command_github_reads_saved", self.saved)
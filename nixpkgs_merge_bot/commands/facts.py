@@ -0,0 +1,193 @@
+import functools
+import logging
+import threading
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import Any, Generic, TypeVar, overload
+
+from nixpkgs_merge_bot.github.issue import IssueComment
+from nixpkgs_merge_bot.github.pull_request import PullRequest
+from nixpkgs_merge_bot.nix.nix_utils import (
+    PackageMaintainers,
+    is_maintainer,
+    package_name,
+)
+
+from .context import CommandContext
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ALLOWED_BRANCHES = ("staging", "staging-next", "master")
+
+
+class Fact(Generic[T]):
+    """A fact computed on first use and then kept for the rest of the command."""
+
+    def __init__(self, compute: Callable[["Facts"], T]) -> None:
+        self.compute = compute
+        self.name = compute.__name__
+        self.__doc__ = compute.__doc__
+
+    @overload
+    def __get__(self, instance: None, owner: type) -> "Fact[T]": ...
+
+    @overload
+    def __get__(self, instance: "Facts", owner: type) -> T: ...
+
+    def __get__(self, instance: "Facts | None", owner: type) -> "Fact[T] | T":
+        if instance is None:
+            return self
+        return instance.get(self)
+
+
+class Facts:
+    """What the merging strategies know about the pull request of one command.
+
+    Strategies ask for the facts they need instead of checking the pull request
+    themselves, so a check that several strategies share is only done once.
+    """
+
+    def __init__(
+        self,
+        context: CommandContext,
+        pull_request: PullRequest,
+        issue_comment: IssueComment,
+    ) -> None:
+        self.context = context
+        self.settings = context.settings
+        self.pull_request = pull_request
+        self.issue_comment = issue_comment
+        # names of the facts in the order they were computed
+        self.computed: list[str] = []
+        self._lock = threading.Lock()
+        self._values: dict[str, Any] = {}
+        # held while a fact is computed, so other threads wait for it
+        self._fact_locks: dict[str, threading.Lock] = {}
+        self._prefetched: set[str] = set()
+        self._file_sizes: dict[str, int] = {}
+
+    def get(self, fact: Fact[T]) -> T:
+        name = fact.name
+        with self._lock:
+            if name in self._values:
+                return self._values[name]
+            fact_lock = self._fact_locks.setdefault(name, threading.Lock())
+        with fact_lock:
+            with self._lock:
+                if name in self._values:
+                    return self._values[name]
+                self.computed.append(name)
+            # errors are not kept, the next use computes the fact again
+            value = fact.compute(self)
+            with self._lock:
+                self._values[name] = value
+            return value
+
+    def prefetch(self, names: Iterable[str]) -> None:
+        """Start computing facts in the background of the command."""
+        with self._lock:
+            names = [name for name in names if name not in self._prefetched]
+            self._prefetched.update(names)
+        for name in names:
+            self.context.fan_out.submit(functools.partial(getattr, self, name))
+
+    def file_size(self, file: dict[str, Any]) -> int:
+        filename = file["filename"]
+        if filename not in self._file_sizes:
+            self._file_sizes[filename] = self.context.file_size(self.pull_request, file)
+        return self._file_sizes[filename]
+
+    @Fact
+    def files(self) -> Iterable[dict[str, Any]]:
+        return self.context.changed_files(self.pull_request)
+
+    @Fact
+    def target_branch_allowed(self) -> bool:
+        return self.pull_request.ref in ALLOWED_BRANCHES
+
+    @Fact
+    def technical_limits(self) -> list[str]:
+        """Reasons the pull request cannot be merged by the bot at all."""
+        pull_request = self.pull_request
+        decline_reasons = []
+        log.info(
+            f"{pull_request.number}: Checking mergeability of {pull_request.number} with sha {pull_request.head_sha}"
+        )
+
+        if pull_request.state != "open":
+            message = f"pr is not open, state is {pull_request.state}"
+            decline_reasons.append(message)
+            log.info(f"{pull_request.number}: {message}")
+
+        if not self.target_branch_allowed:
+            message = f"pr is not targeted to any of the allowed branches: {', '.join(ALLOWED_BRANCHES)}"
+            decline_reasons.append(message)
+            log.info(f"{pull_request.number}: {message}")
+
+        # files are listed page by page, stop at the first one that rules the
+        # pull request out instead of fetching the rest of a treewide change
+        by_name = []
+        outside = None
+        for file in self.files:
+            if not file["filename"].startswith("pkgs/by-name/"):
+                outside = file["filename"]
+                break
+            by_name.append(file)
+        sizes = self.context.fan_out.map(self.file_size, by_name)
+        too_large = [
+            file["filename"]
+            for file, size in zip(by_name, sizes, strict=True)
+            if size > self.settings.max_file_size_bytes
+        ]
+        if too_large:
+            message = f"{too_large[0]} exceeds the maximum allowed file size of {self.settings.max_file_size_mb} MB"
+            decline_reasons.append(message)
+            log.info(f"{pull_request.number}: {message}")
+        elif outside is not None:
+            message = f"{outside} is not in pkgs/by-name/"
+            decline_reasons.append(message)
+            log.info(f"{pull_request.number}: {message}")
+        return decline_reasons
+
+    @Fact
+    def package_maintainers(self) -> dict[str, PackageMaintainers]:
+        return self.context.package_maintainers(self.pull_request)
+
+    @Fact
+    def unmaintained_files(self) -> list[tuple[str, PackageMaintainers]]:
+        """Files whose package the commenter does not provably maintain."""
+        packages = self.package_maintainers
+        unmaintained = []
+        for file in self.files:
+            package = packages[package_name(Path(file["filename"]))]
+            if package.error is not None or not is_maintainer(
+                self.issue_comment.commenter_id, package.maintainers
+            ):
+                unmaintained.append((file["filename"], package))
+        return unmaintained
+
+    @Fact
+    def check_runs(self) -> list[dict[str, Any]]:
+        return list(
+            self.context.check_runs(
+                self.pull_request.repo_owner,
+                self.pull_request.repo_name,
+                self.pull_request.head_sha,
+            )
+        )
+
+    @Fact
+    def author_is_committer(self) -> bool:
+        return self.context.is_team_member(
+            self.pull_request.repo_owner,
+            self.settings.committer_team_slug,
+            self.pull_request.user_login,
+            self.pull_request.user_id,
+        )
+
+
+FACTS = frozenset(
+    name for name, value in vars(Facts).items() if isinstance(value, Fact)
+)
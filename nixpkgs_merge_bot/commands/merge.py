@@ -1,16 +1,16 @@
 import logging
 from dataclasses import dataclass
 
-from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.commands.context import CommandContext
+from nixpkgs_merge_bot.commands.facts import Facts
 from nixpkgs_merge_bot.github.github_client import (
-    GithubClient,
     GithubClientError,
     get_github_client,
 )
 from nixpkgs_merge_bot.github.issue import IssueComment
-from nixpkgs_merge_bot.github.pull_request import PullRequest
 from nixpkgs_merge_bot.merging_strategies.committer_pr import CommitterPR
 from nixpkgs_merge_bot.merging_strategies.maintainer_update import MaintainerUpdate
+from nixpkgs_merge_bot.pending_merges import get_pending_merges
 from nixpkgs_merge_bot.settings import Settings
 from nixpkgs_merge_bot.webhook.http_response import HttpResponse
 from nixpkgs_merge_bot.webhook.utils.issue_response import issue_response
@@ -26,16 +26,12 @@ class CheckRunResult:
     messages: list[str]
 
 
-def process_pull_request_status(
-    client: GithubClient, pull_request: PullRequest
-) -> CheckRunResult:
+def process_pull_request_status(facts: Facts) -> CheckRunResult:
+    pull_request = facts.pull_request
     check_run_result = CheckRunResult(True, False, False, [])
 
     log.debug(f"{pull_request.number}: Getting check suites for commit")
-    check_runs_for_commit = client.get_check_runs_for_commit(
-        pull_request.repo_owner, pull_request.repo_name, pull_request.head_sha
-    )
-    for check_run in check_runs_for_commit.json()["check_runs"]:
+    for check_run in facts.check_runs:
         log.debug(
             f"{pull_request.number}: {check_run['name']} conclusion: {check_run['conclusion']} and status: {check_run['status']}"
         )
@@ -76,20 +72,31 @@ def merge_command(issue_comment: IssueComment, settings: Settings) -> HttpRespon
         f"{issue_comment.issue_number}: We have been called with the merge command"
     )
     log.debug(f"{issue_comment.issue_number}: Getting GitHub client")
-    client = get_github_client(settings)
-    pull_request = PullRequest.from_json(
-        client.pull_request(
-            issue_comment.repo_owner,
-            issue_comment.repo_name,
-            issue_comment.issue_number,
-        ).json()
+    context = CommandContext(get_github_client(settings), settings)
+    try:
+        return run_merge_command(issue_comment, settings, context)
+    finally:
+        context.close()
+        context.report(f"{issue_comment.issue_number}")
+
+
+def run_merge_command(
+    issue_comment: IssueComment, settings: Settings, context: CommandContext
+) -> HttpResponse:
+    client = context.client
+    pull_request = context.load_pull_request(
+        issue_comment.repo_owner,
+        issue_comment.repo_name,
+        issue_comment.issue_number,
     )
     # Setup for this comment is done we ensured that this is address to us and we have a command
 
     log.info(f"{issue_comment.issue_number}: Checking mergeability")
+    # shared by the strategies, so each check is done once per command
+    facts = Facts(context, pull_request, issue_comment)
     merge_strategies = [
-        MaintainerUpdate(client, settings),
-        CommitterPR(client, settings),
+        MaintainerUpdate(facts, settings),
+        CommitterPR(facts, settings),
     ]
     log.info(
         f"{issue_comment.issue_number}: {len(merge_strategies)} merge strategies configured"
@@ -109,6 +116,9 @@ def merge_command(issue_comment: IssueComment, settings: Settings) -> HttpRespon
             one_merge_strategy_passed = True
             decline_reasons = []
             break
+    log.debug(
+        f"{issue_comment.issue_number}: computed facts: {', '.join(facts.computed)}"
+    )
     for reason in decline_reasons:
         log.info(f"{issue_comment.issue_number}: {reason}")
 
@@ -117,15 +127,11 @@ def merge_command(issue_comment: IssueComment, settings: Settings) -> HttpRespon
             f"{issue_comment.issue_number}: A merge strategy passed we will notify the user with a rocket emoji"
         )
         client.create_issue_reaction(issue_comment.node_id)
-        check_suite_result = process_pull_request_status(client, pull_request)
+        check_suite_result = process_pull_request_status(facts)
         decline_reasons.extend(check_suite_result.messages)
         log.info(decline_reasons)
         if check_suite_result.pending:
-            db = Database(settings)
-            db.add(
-                pull_request.head_sha,
-                f"{issue_comment.issue_number!s};{issue_comment.commenter_id};{issue_comment.commenter_login};{issue_comment.comment_id}",
-            )
+            get_pending_merges(settings).add(issue_comment, pull_request.head_sha)
             msg = "One or more checks are still pending, I will retry this after they complete. Darwin checks can be ignored."
             log.info(f"{issue_comment.issue_number}: {msg}")
             client.create_issue_comment(
@@ -180,7 +186,7 @@ def merge_command(issue_comment: IssueComment, settings: Settings) -> HttpRespon
                 f"{issue_comment.issue_number}: OfBorg failed, we let the user know"
             )
             msg = f"@{issue_comment.commenter_login} merge not possible, check suite failed: \n"
-            decline_reasons = list(set(decline_reasons))
+            decline_reasons = list(dict.fromkeys(decline_reasons))
             for reason in decline_reasons:
                 msg += f"{reason}\n"
 
@@ -194,7 +200,7 @@ def merge_command(issue_comment: IssueComment, settings: Settings) -> HttpRespon
             return issue_response("not-permitted-check-run-failed")
         else:
             msg = f"@{issue_comment.commenter_login} merge not permitted. The check suite result is neither failed,success nor pending\n"
-            decline_reasons = list(set(decline_reasons))
+            decline_reasons = list(dict.fromkeys(decline_reasons))
             for reason in decline_reasons:
                 msg += f"{reason}\n"
             log.info(msg)
@@ -211,7 +217,7 @@ def merge_command(issue_comment: IssueComment, settings: Settings) -> HttpRespon
             f"{issue_comment.issue_number}: No merge stratgey passed, we let the user know"
         )
         msg = f"@{issue_comment.commenter_login} merge not permitted (#305350): \n"  # Link Issue to track failed merges
-        decline_reasons = list(set(decline_reasons))
+        decline_reasons = list(dict.fromkeys(decline_reasons))
         for reason in decline_reasons:
             msg += f"{reason}\n"
 
@@ -1,27 +1,45 @@
+import sqlite3
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 
+from .memoize import memoized
 from .settings import Settings
 
 
 class Database:
-    def __init__(self, settings: Settings) -> None:
-        self.db_store_path = Path(settings.database_path)
-        self.db_store_path.mkdir(parents=True, exist_ok=True)
-
-    def add(self, key: str, value: str) -> None:
-        path = self.db_store_path / key
-        path.mkdir(parents=True, exist_ok=True)
-        (path / value).touch()
-
-    def delete(self, key: str, value: str) -> None:
-        path = self.db_store_path / key / value
-        if path.exists():
-            path.unlink()
-
-    def get(self, key: str) -> list[str]:
-        path = self.db_store_path / key
-        values: list[str] = []
-        if not path.exists():
-            return values
-        values.extend(child.name for child in path.iterdir())
-        return values
+    """The connection to the bot's SQLite database, shared by all its stores.
+
+    Stores use `con` only while holding `lock`, so the statements of one
+    store never end up in another store's transaction.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.RLock()
+        self.con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.con.execute("BEGIN")
+            try:
+                yield self.con
+            except BaseException:
+                self.con.execute("ROLLBACK")
+                raise
+            self.con.execute("COMMIT")
+
+    def create(self, *statements: str) -> None:
+        """Run the CREATE statements of a store."""
+        with self.transaction() as con:
+            for statement in statements:
+                con.execute(statement)
+
+
+@memoized(lambda settings: settings.database_file)
+def get_database(settings: Settings) -> Database:
+    settings.database_file.parent.mkdir(parents=True, exist_ok=True)
+    return Database(settings.database_file)
@@ -0,0 +1,86 @@
+import functools
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Task(Generic[R]):
+    """A call that runs once, on whichever thread gets to it first."""
+
+    def __init__(self, fn: Callable[[], R]) -> None:
+        self.fn = fn
+        self._claim = threading.Lock()
+        self._done = threading.Event()
+        self._result: R | None = None
+        self._error: BaseException | None = None
+
+    def run(self) -> None:
+        if not self._claim.acquire(blocking=False):
+            return
+        try:
+            self._result = self.fn()
+        except BaseException as e:  # noqa: BLE001
+            self._error = e
+        finally:
+            self._done.set()
+
+    def wait(self) -> None:
+        # run it here if no worker started it yet
+        self.run()
+        self._done.wait()
+
+    def result(self) -> R:
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result  # type: ignore[return-value]
+
+
+class FanOut:
+    """Runs the independent lookups of one command on at most `limit` threads.
+
+    Results come back in the order the lookups were made and the error of the
+    first failed one is raised, however the threads were scheduled. A waiting
+    caller runs lookups no worker has started yet itself, so lookups can fan
+    out again without waiting for a free worker.
+    """
+
+    def __init__(self, limit: int, name: str = "fan-out") -> None:
+        self.limit = limit
+        self.name = name
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._closed = False
+        self.tasks = 0
+
+    def submit(self, fn: Callable[[], R]) -> Task[R]:
+        task = Task(fn)
+        with self._lock:
+            self.tasks += 1
+            if self.limit > 1 and not self._closed:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.limit, thread_name_prefix=self.name
+                    )
+                self._executor.submit(task.run)
+        return task
+
+    def map(self, fn: Callable[[T], R], items: Iterable[T]) -> list[R]:
+        tasks = [self.submit(functools.partial(fn, item)) for item in items]
+        # wait for all of them, so nothing runs on after an error is raised
+        for task in tasks:
+            task.wait()
+        return [task.result() for task in tasks]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._closed = True
+        if executor is not None:
+            # lookups that did not start are dropped, running ones finish
+            # before the command's context goes away
+            executor.shutdown(wait=True, cancel_futures=True)
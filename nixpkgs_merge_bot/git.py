@@ -1,9 +1,15 @@
 import logging
 import subprocess
+import threading
 from pathlib import Path
 
+from .memoize import memoized
+
 log = logging.getLogger(__name__)
 
+# concurrent fetches into the same repository fail on the ref locks
+FETCH_LOCK = threading.Lock()
+
 
 def clone(repo: str, folder: Path) -> None:
     if not Path(folder).exists():
@@ -15,10 +21,146 @@ def clone(repo: str, folder: Path) -> None:
 
 def fetch(folder: Path) -> None:
     log.info(f"Fetching {folder}")
-    subprocess.run(["git", "fetch"], cwd=folder, check=True)
+    with FETCH_LOCK:
+        subprocess.run(["git", "fetch", "--prune", "origin"], cwd=folder, check=True)
+
+
+# GitHub's names for the statuses of `git diff --name-status`
+FILE_STATUSES = {
+    "A": "added",
+    "C": "copied",
+    "D": "removed",
+    "M": "modified",
+    "R": "renamed",
+    "T": "changed",
+}
+
+
+def fetch_pull_request(folder: Path, pr_number: int, base_ref: str) -> None:
+    log.info(f"Fetching pull request {pr_number} and {base_ref} into {folder}")
+    with FETCH_LOCK:
+        subprocess.run(
+            [
+                "git",
+                "fetch",
+                "--no-tags",
+                "origin",
+                f"+refs/pull/{pr_number}/head:refs/remotes/origin/pr/{pr_number}",
+                f"+refs/heads/{base_ref}:refs/remotes/origin/{base_ref}",
+            ],
+            cwd=folder,
+            check=True,
+        )
+
+
+def changed_files(folder: Path, base: str, head: str) -> list[dict[str, str]]:
+    """Files changed by `head` since it branched off `base`, like GitHub lists them."""
+    proc = subprocess.run(
+        ["git", "diff", "--name-status", "-z", "--find-renames", f"{base}...{head}"],
+        cwd=folder,
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    fields = proc.stdout.decode("utf-8").split("\0")
+    files = []
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i][0]
+        if status in ("R", "C"):
+            # followed by the old and the new name
+            previous_filename, filename = fields[i + 1], fields[i + 2]
+            files.append(
+                {
+                    "filename": filename,
+                    "previous_filename": previous_filename,
+                    "status": FILE_STATUSES[status],
+                }
+            )
+            i += 3
+        else:
+            files.append(
+                {"filename": fields[i + 1], "status": FILE_STATUSES.get(status, status)}
+            )
+            i += 2
+    return files
+
+
+def by_name_packages(folder: Path, rev: str) -> list[str]:
+    """Names of all packages in pkgs/by-name/ at `rev`."""
+    proc = subprocess.run(
+        ["git", "ls-tree", "-r", "-d", "--name-only", rev, "--", "pkgs/by-name/"],
+        cwd=folder,
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    # pkgs/by-name/<shard>/<package>, deeper directories belong to a package
+    return [
+        path.split("/")[3]
+        for path in proc.stdout.decode("utf-8").splitlines()
+        if path.count("/") == 3
+    ]
+
+
+def changed_paths(folder: Path, old: str, new: str, *paths: str) -> list[str]:
+    """Files below `paths` that differ between two revisions."""
+    proc = subprocess.run(
+        ["git", "diff", "--name-only", "--no-renames", old, new, "--", *paths],
+        cwd=folder,
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return proc.stdout.decode("utf-8").splitlines()
+
+
+class BlobSizes:
+    """Sizes of files at given revisions, from one long-running `git cat-file`."""
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._proc: subprocess.Popen[bytes] | None = None
+
+    def _process(self) -> subprocess.Popen[bytes]:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                ["git", "cat-file", "--batch-check"],
+                cwd=self.folder,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        return self._proc
+
+    def size(self, rev: str, path: str) -> int | None:
+        """Size of `path` at `rev`, None if it does not exist there."""
+        with self._lock:
+            proc = self._process()
+            assert proc.stdin is not None
+            assert proc.stdout is not None
+            try:
+                proc.stdin.write(f"{rev}:{path}\n".encode())
+                proc.stdin.flush()
+                line = proc.stdout.readline().decode("utf-8")
+            except OSError:
+                proc.kill()
+                raise
+        if not line:
+            msg = f"git cat-file in {self.folder} exited"
+            raise OSError(msg)
+        # "<object> <type> <size>" or "<object> missing"
+        parts = line.split()
+        if len(parts) != 3:
+            return None
+        return int(parts[2])
+
+    def close(self) -> None:
+        with self._lock:
+            if self._proc is not None:
+                if self._proc.stdin is not None:
+                    self._proc.stdin.close()
+                self._proc.wait()
+                self._proc = None
 
 
-def checkout_newest_master(folder: Path) -> None:
-    log.info(f"Checking out newest master: {folder}")
-    fetch(folder)
-    subprocess.run(["git", "reset", "--hard", "origin/master"], cwd=folder, check=True)
+@memoized(lambda folder: folder)
+def get_blob_sizes(folder: Path) -> BlobSizes:
+    return BlobSizes(folder)
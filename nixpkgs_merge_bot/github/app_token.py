@@ -0,0 +1,204 @@
+import base64
+import json
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+log = logging.getLogger(__name__)
+
+# seconds before its expiry a token is renewed
+REFRESH_MARGIN = 10 * 60
+RETRY_INTERVAL = 30
+
+
+def base64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("utf-8")
+
+
+def build_jwt_payload(app_id: int) -> dict[str, Any]:
+    jwt_iat_drift = 60
+    jwt_exp_delta = 600
+    now = int(time.time())
+    iat = now - jwt_iat_drift
+    return {"iat": iat, "exp": iat + jwt_exp_delta, "iss": str(app_id)}
+
+
+def load_private_key(pem: bytes) -> rsa.RSAPrivateKey:
+    """Load the app's unencrypted RSA private key, PKCS#1 or PKCS#8."""
+    try:
+        key = serialization.load_pem_private_key(pem, password=None)
+    except TypeError as e:
+        msg = "the private key is encrypted, expected an unencrypted RSA key"
+        raise ValueError(msg) from e
+    if not isinstance(key, rsa.RSAPrivateKey):
+        msg = f"the private key is not an RSA key but {type(key).__name__}"
+        raise ValueError(msg)  # noqa: TRY004
+    return key
+
+
+def rs256_sign(data: str, private_key: rsa.RSAPrivateKey) -> str:
+    signature = private_key.sign(
+        data.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256()
+    )
+    return base64url(signature)
+
+
+def build_jwt(app_id: int, private_key: rsa.RSAPrivateKey) -> str:
+    headers = json.dumps({"alg": "RS256", "typ": "JWT"}).encode("utf-8")
+    payload = json.dumps(build_jwt_payload(app_id)).encode("utf-8")
+    encoded_jwt_parts = f"{base64url(headers)}.{base64url(payload)}"
+    return f"{encoded_jwt_parts}.{rs256_sign(encoded_jwt_parts, private_key)}"
+
+
+@dataclass
+class InstallationToken:
+    installation_id: int
+    token: str
+    expires_at: float
+
+
+# lists the installations of the app, and mints a token for one; both are
+# authenticated with the app's JWT
+ListInstallations = Callable[[str], list[dict[str, Any]]]
+CreateToken = Callable[[str, int], dict[str, Any]]
+
+
+class AppTokens:
+    """Installation token of the GitHub app, renewed before it expires.
+
+    The private key is parsed and the installation looked up once. Tokens
+    last an hour; the refresher thread replaces them `refresh_margin`
+    seconds before that, so callers normally never wait for GitHub.
+    """
+
+    def __init__(
+        self,
+        app_login: str,
+        app_id: int,
+        private_key_path: Path,
+        list_installations: ListInstallations,
+        create_token: CreateToken,
+        *,
+        refresh_margin: float = REFRESH_MARGIN,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.app_login = app_login
+        self.app_id = app_id
+        self.private_key_path = Path(private_key_path)
+        self._private_key: rsa.RSAPrivateKey | None = None
+        self.list_installations = list_installations
+        self.create_token = create_token
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._installation_id: int | None = None
+        self._token: InstallationToken | None = None
+        self._refresher: threading.Thread | None = None
+        self._stop = threading.Event()
+        self.refreshes = 0
+        self.failures = 0
+
+    def jwt(self) -> str:
+        # loaded on first use, so a bad key fails token requests, not startup
+        if self._private_key is None:
+            self._private_key = load_private_key(self.private_key_path.read_bytes())
+        return build_jwt(self.app_id, self._private_key)
+
+    def installation_id(self, jwt: str) -> int:
+        if self._installation_id is not None:
+            return self._installation_id
+        log.info(
+            f"Searching for the NixOS Installation of our APP, searching for {self.app_login} and {self.app_id}"
+        )
+        for item in self.list_installations(jwt):
+            if (
+                item["account"]["login"] == self.app_login
+                and item["app_id"] == self.app_id
+            ):
+                self._installation_id = item["id"]
+                return item["id"]
+        log.error(
+            f"Installation not found for {self.app_login} and {self.app_id}, this is case sensitive!"
+        )
+        msg = "Access token URL not found"
+        raise ValueError(msg)
+
+    def _fresh(self, token: InstallationToken | None) -> bool:
+        return (
+            token is not None and self.clock() < token.expires_at - self.refresh_margin
+        )
+
+    def get(self) -> InstallationToken:
+        token = self._token
+        if self._fresh(token):
+            assert token is not None
+            return token
+        return self.refresh(force=False)
+
+    def refresh(self, force: bool = True) -> InstallationToken:
+        with self._lock:
+            # another thread may have renewed it while we waited
+            if not force and self._fresh(self._token):
+                assert self._token is not None
+                return self._token
+            jwt = self.jwt()
+            installation_id = self.installation_id(jwt)
+            try:
+                resp = self.create_token(jwt, installation_id)
+            except Exception:
+                # the app may have been installed again under a new id
+                self._installation_id = None
+                raise
+            expires_at = datetime.fromisoformat(
+                resp["expires_at"].replace("Z", "+00:00")
+            ).timestamp()
+            self._token = InstallationToken(installation_id, resp["token"], expires_at)
+            self.refreshes += 1
+            log.info(
+                f"Renewed the installation token, it expires at {resp['expires_at']}"
+            )
+            return self._token
+
+    def start_refresher(self) -> None:
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._run, name="token-refresher", daemon=True
+            )
+            self._refresher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            token = self._token
+            if self._fresh(token):
+                assert token is not None
+                delay = token.expires_at - self.refresh_margin - self.clock()
+            else:
+                try:
+                    self.refresh()
+                    continue
+                except Exception:
+                    log.exception("Failed to renew the installation token")
+                    self.failures += 1
+                    delay = RETRY_INTERVAL
+            self._stop.wait(max(delay, 1))
+
+    def stats(self) -> dict[str, Any]:
+        token = self._token
+        return {
+            "expires_in": token.expires_at - self.clock() if token else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+from nixpkgs_merge_bot.memoize import memoized
+from nixpkgs_merge_bot.metrics import METRICS
+
+from .github_client import GithubClient
+
+log = logging.getLogger(__name__)
+
+
+class CommitterCache:
+    """Members of a team, by login and id.
+
+    The first lookup loads the whole team; afterwards the set is kept current by
+    membership webhooks and refreshed in the background once it is older than
+    `ttl`, while lookups keep using the old set. Users that are not in the set
+    are checked with the cheap per-user membership endpoint, in case we missed
+    their addition; negative answers are remembered for `negative_ttl`.
+    """
+
+    def __init__(
+        self,
+        org: str,
+        team_slug: str,
+        ttl: float = 3600,
+        negative_ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.org = org
+        self.team_slug = team_slug
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._logins: set[str] = set()
+        self._ids: set[int] = set()
+        self._non_members: dict[str, float] = {}
+        self._loaded_at: float | None = None
+        self._refreshing = False
+        self.hits = 0
+        self.fallbacks = 0
+        self.refreshes = 0
+
+    def _replace(self, members: list[dict[str, Any]]) -> None:
+        logins = {member["login"].lower() for member in members}
+        ids = {member["id"] for member in members}
+        with self._lock:
+            self._logins = logins
+            self._ids = ids
+            self._non_members.clear()
+            self._loaded_at = self.clock()
+            self.refreshes += 1
+        log.info(f"Loaded {len(logins)} members of {self.org}/{self.team_slug}")
+
+    def refresh(self, client: GithubClient) -> None:
+        try:
+            self._replace(client.get_team_members(self.org, self.team_slug))
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _ensure_loaded(self, client: GithubClient) -> None:
+        with self._lock:
+            loaded_at = self._loaded_at
+            if loaded_at is not None and (
+                self._refreshing or self.clock() - loaded_at < self.ttl
+            ):
+                return
+            self._refreshing = True
+        if loaded_at is None:
+            try:
+                self.refresh(client)
+            except Exception:
+                log.exception(f"Failed to load {self.org}/{self.team_slug}")
+            return
+        # stale: answer from the old set while fetching the new one
+        threading.Thread(
+            target=self._background_refresh, args=(client,), daemon=True
+        ).start()
+
+    def _background_refresh(self, client: GithubClient) -> None:
+        try:
+            self.refresh(client)
+        except Exception:
+            log.exception(f"Failed to refresh {self.org}/{self.team_slug}")
+
+    def is_member(
+        self, client: GithubClient, login: str, user_id: int | None = None
+    ) -> bool:
+        self._ensure_loaded(client)
+        with self._lock:
+            if login.lower() in self._logins or user_id in self._ids:
+                self.hits += 1
+                return True
+            negative_until = self._non_members.get(login.lower(), 0)
+            if negative_until > self.clock():
+                self.hits += 1
+                return False
+            self.fallbacks += 1
+        member = client.is_team_member(self.org, self.team_slug, login)
+        if member:
+            self.add(login, user_id)
+        else:
+            with self._lock:
+                self._non_members[login.lower()] = self.clock() + self.negative_ttl
+        return member
+
+    def add(self, login: str, user_id: int | None) -> None:
+        with self._lock:
+            self._logins.add(login.lower())
+            if user_id is not None:
+                self._ids.add(user_id)
+            self._non_members.pop(login.lower(), None)
+
+    def remove(self, login: str, user_id: int | None) -> None:
+        with self._lock:
+            self._logins.discard(login.lower())
+            if user_id is not None:
+                self._ids.discard(user_id)
+
+    def invalidate(self) -> None:
+        """Forget the team, it is loaded again on the next lookup."""
+        with self._lock:
+            self._logins = set()
+            self._ids = set()
+            self._non_members.clear()
+            self._loaded_at = None
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "members": len(self._logins),
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+                "refreshes": self.refreshes,
+            }
+
+
+@memoized(lambda org, team_slug: (org.lower(), team_slug.lower()))
+def get_team_cache(org: str, team_slug: str) -> CommitterCache:
+    cache = CommitterCache(org, team_slug)
+    METRICS.gauge(f"team_cache_{org}/{team_slug}", cache.stats)
+    return cache
+
+
+def find_team_cache(org: str, team_slug: str) -> CommitterCache | None:
+    """The cache for a team, if it was used; other teams need no updates."""
+    return get_team_cache.find(org, team_slug)
@@ -0,0 +1,168 @@
+import gzip
+import http.client
+import logging
+import ssl
+import threading
+
+from .http_response import HttpResponse
+
+log = logging.getLogger(__name__)
+
+# errors of a kept-alive connection that the server closed in the meantime
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+# methods that may be sent again when the response was lost
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD"})
+
+
+class PooledHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection that resumes the TLS session of its pool."""
+
+    def __init__(self, pool: "ConnectionPool") -> None:
+        super().__init__(
+            pool.host, pool.port, timeout=pool.timeout, context=pool.ssl_context
+        )
+        self.pool = pool
+
+    def connect(self) -> None:
+        http.client.HTTPConnection.connect(self)
+        tls_sock = self.pool.ssl_context.wrap_socket(
+            self.sock, server_hostname=self.host, session=self.pool.tls_session
+        )
+        self.sock = tls_sock
+        self.pool.connected(tls_sock)
+
+
+class ConnectionPool:
+    """Keep-alive connections to a single HTTPS host, shared between threads.
+
+    At most `size` requests are in flight at once; further callers wait for a
+    connection to become free.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        size: int = 8,
+        port: int | None = None,
+        timeout: float = 30,
+        ssl_context: ssl.SSLContext | None = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.tls_session: ssl.SSLSession | None = None
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: list[PooledHTTPSConnection] = []
+        self._created = 0
+        self._resumed = 0
+        self._requests = 0
+
+    def connected(self, sock: ssl.SSLSocket) -> None:
+        with self._lock:
+            self._created += 1
+            if sock.session_reused:
+                self._resumed += 1
+            if sock.session is not None:
+                self.tls_session = sock.session
+
+    def _checkout(self) -> PooledHTTPSConnection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return PooledHTTPSConnection(self)
+
+    def _checkin(self, conn: PooledHTTPSConnection) -> None:
+        with self._lock:
+            # TLS 1.3 session tickets only arrive after the handshake
+            if isinstance(conn.sock, ssl.SSLSocket) and conn.sock.session is not None:
+                self.tls_session = conn.sock.session
+            self._idle.append(conn)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> HttpResponse:
+        with self._slots:
+            with self._lock:
+                self._requests += 1
+            conn = self._checkout()
+            reused = conn.sock is not None
+            headers = headers or {}
+            try:
+                self._send(conn, method, path, body, headers)
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # the server closed the connection before it read the request
+                log.debug(f"kept-alive connection to {self.host} was closed, retrying")
+                return self._request(method, path, body, headers)
+            try:
+                return self._receive(conn, path)
+            except STALE_CONNECTION_ERRORS:
+                # the server may have acted on a request it did not answer
+                if not reused or method not in IDEMPOTENT_METHODS:
+                    raise
+                log.debug(f"kept-alive connection to {self.host} was closed, retrying")
+                return self._request(method, path, body, headers)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None,
+        headers: dict[str, str],
+    ) -> HttpResponse:
+        conn = PooledHTTPSConnection(self)
+        self._send(conn, method, path, body, headers)
+        return self._receive(conn, path)
+
+    def _send(
+        self,
+        conn: PooledHTTPSConnection,
+        method: str,
+        path: str,
+        body: bytes | None,
+        headers: dict[str, str],
+    ) -> None:
+        try:
+            conn.request(method, path, body=body, headers=headers)
+        except Exception:
+            conn.close()
+            raise
+
+    def _receive(self, conn: PooledHTTPSConnection, path: str) -> HttpResponse:
+        try:
+            resp = conn.getresponse()
+            data = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        if resp.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return HttpResponse(
+            resp.status, resp.reason, resp.headers, data, f"https://{self.host}{path}"
+        )
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "connections_created": self._created,
+                "tls_sessions_resumed": self._resumed,
+                "requests": self._requests,
+            }
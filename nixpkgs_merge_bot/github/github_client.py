@@ -1,21 +1,23 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
-import contextlib
 import json
 import logging
 import os
-import subprocess
-import time
+import re
+import threading
 import urllib.parse
-import urllib.request
+from collections.abc import Callable, Iterator
 from pathlib import Path
 from textwrap import dedent
 from typing import Any, Literal
 
+from nixpkgs_merge_bot.memoize import memoized
+from nixpkgs_merge_bot.metrics import METRICS
 from nixpkgs_merge_bot.settings import Settings
 
+from .app_token import AppTokens
+from .connection_pool import ConnectionPool
 from .http_response import HttpResponse
 from .merge_result import (
     AutoMergeResult,
@@ -23,33 +25,52 @@ from .merge_result import (
     MergeResult,
     QueuedMergeResult,
 )
+from .rate_limit import (
+    Priority,
+    RateLimiter,
+    get_rate_limiter,
+    rate_limit_states,
+    request_resource,
+)
+from .response_cache import ResponseCache
+from .snapshot import (
+    FILES_QUERY,
+    PAGE_SIZE,
+    SNAPSHOT_QUERY,
+    PullRequestSnapshot,
+    details_query,
+    parse_check_runs,
+    parse_files,
+    parse_pull_request,
+)
 
 log = logging.getLogger(__name__)
 STAGING = os.environ.get("STAGING", None)
 if STAGING:
     log.info("Staging is set")
 
+MAX_REDIRECTS = 3
+REDIRECT_STATUSES = (301, 302, 307, 308)
+NOT_MODIFIED = 304
+MAX_THROTTLED_RETRIES = 2
+# the largest page size GitHub allows
+PER_PAGE = 100
+NEXT_LINK = re.compile(r'<([^>]+)>;\s*rel="next"')
 
-def base64url(data: bytes) -> str:
-    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("utf-8")
-
-
-def rs256_sign(data: str, private_key: Path) -> str:
-    signature = subprocess.run(
-        ["openssl", "dgst", "-binary", "-sha256", "-sign", private_key],
-        input=data.encode("utf-8"),
-        stdout=subprocess.PIPE,
-        check=True,
-    ).stdout
-    return base64url(signature)
+# shared by all clients, so connections survive token refreshes
+API_POOL = ConnectionPool("api.github.com", size=8)
+METRICS.gauge("github_connections", API_POOL.stats)
+RESPONSE_CACHE = ResponseCache(max_bytes=64 * 1024 * 1024)
+METRICS.gauge("github_response_cache", RESPONSE_CACHE.stats)
+METRICS.gauge("github_rate_limits", rate_limit_states)
 
 
-def build_jwt_payload(app_id: int) -> dict[str, Any]:
-    jwt_iat_drift = 60
-    jwt_exp_delta = 600
-    now = int(time.time())
-    iat = now - jwt_iat_drift
-    return {"iat": iat, "exp": iat + jwt_exp_delta, "iss": str(app_id)}
+def next_page_url(link: str | None) -> str | None:
+    """URL of the next page from a Link header, None on the last page."""
+    if not link:
+        return None
+    match = NEXT_LINK.search(link)
+    return match.group(1) if match else None
 
 
 class GithubClientError(Exception):
@@ -67,9 +88,27 @@ class GithubClientError(Exception):
 
 
 class GithubClient:
-    def __init__(self, api_token: str | None) -> None:
+    def __init__(
+        self,
+        api_token: str | None,
+        *,
+        pool: ConnectionPool | None = None,
+        accept_gzip: bool = True,
+        installation_id: int | None = None,
+        cache: ResponseCache | None = None,
+        rate_limiter: RateLimiter | None = None,
+    ) -> None:
         self.api_token = api_token
-        self.token_age = time.time()
+        self.pool = pool or API_POOL
+        self.accept_gzip = accept_gzip
+        # responses of different installations may differ, so they are cached apart
+        self.installation_id = installation_id
+        self.cache = cache or RESPONSE_CACHE
+        # one limiter for all requests instead of one per installation and resource
+        self.rate_limiter = rate_limiter
+
+    def _rate_limiter(self, resource: str) -> RateLimiter:
+        return self.rate_limiter or get_rate_limiter(self.installation_id, resource)
 
     def _request(
         self,
@@ -77,48 +116,92 @@ class GithubClient:
         method: str,
         data: dict[str, Any] | None = None,
         headers: dict[str, str] | None = None,
+        priority: Priority = Priority.LOW,
     ) -> HttpResponse:
-        if headers is None:
-            headers = {}
         url = urllib.parse.urljoin("https://api.github.com/", path)
-        headers = headers.copy()
         headers = {
             "Content-Type": "application/json",
             "X-GitHub-Api-Version": "2022-11-28",
+            **(headers or {}),
         }
 
         if self.api_token:
             headers["Authorization"] = f"Bearer {self.api_token}"
         headers["User-Agent"] = "nixpkgs-merge-bot"
+        if self.accept_gzip:
+            headers["Accept-Encoding"] = "gzip"
 
         body = None
         if data:
             body = json.dumps(data).encode("ascii")
 
-        assert url.startswith("https://"), f"Invalid URL: {url}"
-        req = urllib.request.Request(url, headers=headers, method=method, data=body)  # noqa: S310
-        try:
-            resp = urllib.request.urlopen(req)  # noqa: S310
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urllib.parse.urlsplit(url)
+            assert parsed.scheme == "https", f"Invalid URL: {url}"
+            assert parsed.hostname == self.pool.host, f"Unexpected host: {url}"
+            target = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+            resp = self._send(method, target, body, headers, priority)
+            # renamed repositories are redirected
+            if resp.status in REDIRECT_STATUSES and method == "GET":
+                url = urllib.parse.urljoin(url, resp.headers()["Location"])
+                continue
+            break
+        if resp.status >= 300 and resp.status != NOT_MODIFIED:
+            resp_body = resp.body.decode("utf-8", "replace")
+            raise GithubClientError(resp.status, resp.reason, url, resp_body)
+        return resp
 
-        except urllib.request.HTTPError as e:
-            resp_body = ""
-            with contextlib.suppress(Exception):
-                resp_body = e.fp.read().decode("utf-8", "replace")
-            raise GithubClientError(e.code, e.reason, url, resp_body) from e
-        return HttpResponse(resp)
+    def _send(
+        self,
+        method: str,
+        target: str,
+        body: bytes | None,
+        headers: dict[str, str],
+        priority: Priority,
+    ) -> HttpResponse:
+        attempt = 0
+        limiter = self._rate_limiter(request_resource(target))
+        while True:
+            limiter.acquire(priority)
+            resp = self.pool.request(method, target, body, headers)
+            # GitHub names the budget the request was counted against
+            resource = resp.headers().get("x-ratelimit-resource")
+            if resource:
+                self._rate_limiter(resource).update(resp.headers())
+            else:
+                limiter.update(resp.headers())
+            throttled = limiter.check_throttled(resp.status, resp.headers(), resp.body)
+            if not throttled or attempt == MAX_THROTTLED_RETRIES:
+                return resp
+            attempt += 1
 
     def get(self, path: str) -> HttpResponse:
-        resp = self._request(path, "GET")
+        # GitHub does not count 304 responses against the rate limit
+        key = (
+            self.installation_id,
+            urllib.parse.urljoin("https://api.github.com/", path),
+        )
+        cached = self.cache.get(key)
+        resp = self._request(
+            path, "GET", headers=cached.conditional_headers() if cached else None
+        )
         resp_headers = resp.headers()
         log.debug(f"rate limit: {resp_headers['x-ratelimit-limit']}")
         log.debug(f"rate limit remaining: {resp_headers['x-ratelimit-remaining']}")
         log.debug(f"rate limit used: {resp_headers['x-ratelimit-used']}")
         log.debug(f"rate limit reset: {resp_headers['x-ratelimit-reset']}")
+        if resp.status == NOT_MODIFIED and cached:
+            log.debug(f"GET {path}: not modified")
+            self.cache.record(hit=True)
+            return cached.response
+        self.cache.record(hit=False)
+        self.cache.put(key, resp)
         return resp
 
     def post(self, path: str, data: dict[str, str]) -> HttpResponse:
         log.debug(f"POST {path} {data}")
-        post_result = self._request(path, "POST", data)
+        # merges, comments and reactions go before reads
+        post_result = self._request(path, "POST", data, priority=Priority.HIGH)
         resp_headers = post_result.headers()
         log.debug(f"rate limit: {resp_headers['x-ratelimit-limit']}")
         log.debug(f"rate limit remaining: {resp_headers['x-ratelimit-remaining']}")
@@ -128,6 +211,87 @@ class GithubClient:
 
         return post_result
 
+    def _paginate(
+        self, first_page: Callable[[], HttpResponse], key: str | None = None
+    ) -> Iterator[Any]:
+        """Items of all pages, fetching each page only once the previous is used up.
+
+        `key` names the list in responses that wrap it in an object.
+        """
+        resp = first_page()
+        while True:
+            body = resp.json()
+            yield from body if key is None else body[key]
+            url = next_page_url(resp.headers().get("Link"))
+            if url is None:
+                return
+            resp = self.get(url)
+
+    def graphql(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        """Run a GraphQL query, returns its data."""
+        resp = self._request(
+            "/graphql", "POST", {"query": query, "variables": variables}
+        )
+        resp_body = resp.json()
+        if "errors" in resp_body:
+            raise GithubClientError(
+                resp.status, resp_body["errors"][0]["message"], resp.url, resp_body
+            )
+        return resp_body["data"]
+
+    def pull_request_snapshot(
+        self, owner: str, repo: str, pr_number: int, team_slug: str | None = None
+    ) -> PullRequestSnapshot:
+        """What a merge decision needs to know about a pull request.
+
+        One query covers the pull request, its first 100 files and the check
+        runs of its head; a second one the sizes of the files and whether the
+        author is in `owner`'s `team_slug`. Further pages of files take one
+        more query each.
+        """
+        variables: dict[str, Any] = {"owner": owner, "repo": repo, "number": pr_number}
+        node = self.graphql(SNAPSHOT_QUERY, variables)["repository"]["pullRequest"]
+        pull_request = parse_pull_request(node, owner, repo)
+        files = parse_files(node["files"]["nodes"])
+        page = node["files"]["pageInfo"]
+        while page["hasNextPage"]:
+            more = self.graphql(FILES_QUERY, {**variables, "cursor": page["endCursor"]})
+            page_files = more["repository"]["pullRequest"]["files"]
+            files.extend(parse_files(page_files["nodes"]))
+            page = page_files["pageInfo"]
+
+        author_in_team = None
+        for start in range(0, max(len(files), 1), PAGE_SIZE):
+            batch = files[start : start + PAGE_SIZE]
+            team = team_slug is not None and start == 0
+            if not batch and not team:
+                break
+            details_variables: dict[str, Any] = {"owner": owner, "repo": repo}
+            for i, file in enumerate(batch):
+                details_variables[f"path{i}"] = (
+                    f"{pull_request.head_sha}:{file['filename']}"
+                )
+            if team:
+                details_variables |= {
+                    "org": owner,
+                    "team": team_slug,
+                    "login": pull_request.user_login,
+                }
+            details = self.graphql(details_query(len(batch), team), details_variables)
+            for i, file in enumerate(batch):
+                # removed files have no blob at the head commit
+                blob = details["repository"][f"blob{i}"]
+                file["size"] = blob["byteSize"] if blob else 0
+            if team:
+                team_node = details["organization"]["team"]
+                author_in_team = team_node is not None and any(
+                    member["databaseId"] == pull_request.user_id
+                    for member in team_node["members"]["nodes"]
+                )
+        return PullRequestSnapshot(
+            pull_request, files, parse_check_runs(node), author_in_team
+        )
+
     def app_installations(self) -> HttpResponse:
         return self.get("/app/installations")
 
@@ -147,7 +311,16 @@ class GithubClient:
     def get_check_runs_for_commit(
         self, owner: str, repo: str, ref: str
     ) -> HttpResponse:
-        return self.get(f"/repos/{owner}/{repo}/commits/{ref}/check-runs")
+        return self.get(
+            f"/repos/{owner}/{repo}/commits/{ref}/check-runs?per_page={PER_PAGE}"
+        )
+
+    def iter_check_runs_for_commit(
+        self, owner: str, repo: str, ref: str
+    ) -> Iterator[dict[str, Any]]:
+        return self._paginate(
+            lambda: self.get_check_runs_for_commit(owner, repo, ref), "check_runs"
+        )
 
     def get_statuses_for_commit(self, owner: str, repo: str, ref: str) -> HttpResponse:
         return self.get(f"/repos/{owner}/{repo}/commits/{ref}/status")
@@ -161,7 +334,14 @@ class GithubClient:
         return self.get(f"/repos/{owner}/{repo}/issues/comments/{comment_id}")
 
     def pull_request_files(self, owner: str, repo: str, pr_number: int) -> HttpResponse:
-        return self.get(f"/repos/{owner}/{repo}/pulls/{pr_number}/files")
+        return self.get(
+            f"/repos/{owner}/{repo}/pulls/{pr_number}/files?per_page={PER_PAGE}"
+        )
+
+    def iter_pull_request_files(
+        self, owner: str, repo: str, pr_number: int
+    ) -> Iterator[dict[str, Any]]:
+        return self._paginate(lambda: self.pull_request_files(owner, repo, pr_number))
 
     def get_request_file_content(
         self, owner: str, repo: str, filepath: str, ref_query_param: str
@@ -172,18 +352,23 @@ class GithubClient:
         return self.get(f"/repos/{owner}/{repo}/issues/{issue_number}")
 
     def get_team_members(self, owner: str, team_slug: str) -> list[dict[str, Any]]:
-        per_page = 100
-        current_page = 1
-        result = []
+        return list(
+            self._paginate(
+                lambda: self.get(
+                    f"/orgs/{owner}/teams/{team_slug}/members?per_page={PER_PAGE}"
+                )
+            )
+        )
 
-        while True:
-            page_cursor = self.get(
-                f"/orgs/{owner}/teams/{team_slug}/members?page={current_page}&per_page={per_page}"
-            ).json()
-            result += page_cursor
-            if len(page_cursor) < per_page:
-                return result
-            current_page += 1
+    def is_team_member(self, owner: str, team_slug: str, username: str) -> bool:
+        try:
+            resp = self.get(f"/orgs/{owner}/teams/{team_slug}/memberships/{username}")
+        except GithubClientError as e:
+            if e.code == 404:
+                return False
+            raise
+        # pending members have been invited but did not accept yet
+        return resp.json().get("state") == "active"
 
     def create_issue_comment(
         self, owner: str, repo: str, issue_number: int, body: str
@@ -267,9 +452,9 @@ class GithubClient:
 
             if "errors" in resp_body:
                 raise GithubClientError(
-                    resp.raw.status,
+                    resp.status,
                     resp_body["errors"][0]["message"],
-                    resp.raw.url,
+                    resp.url,
                     resp_body,
                 )
 
@@ -300,49 +485,51 @@ class GithubClient:
         return self.post(f"/app/installations/{installation_id}/access_tokens", data={})
 
 
+def list_installations(jwt: str) -> list[dict[str, Any]]:
+    return GithubClient(jwt).app_installations().json()
+
+
+def create_installation_token(jwt: str, installation_id: int) -> dict[str, Any]:
+    return GithubClient(jwt).create_installation_access_token(installation_id).json()
+
+
 def request_access_token(app_login: str, app_id: int, app_private_key: Path) -> str:
-    jwt_payload = json.dumps(build_jwt_payload(app_id)).encode("utf-8")
-    json_headers = json.dumps({"alg": "RS256", "typ": "JWT"}).encode("utf-8")
-    encoded_jwt_parts = f"{base64url(json_headers)}.{base64url(jwt_payload)}"
-    encoded_mac = rs256_sign(encoded_jwt_parts, app_private_key)
-    generated_jwt = f"{encoded_jwt_parts}.{encoded_mac}"
-
-    client = GithubClient(generated_jwt)
-    response = client.app_installations()
-
-    installation_id = None
-    log.info(
-        f"Searching for the NixOS Installation of our APP, searching for {app_login} and {app_id}"
+    tokens = AppTokens(
+        app_login,
+        app_id,
+        app_private_key,
+        list_installations,
+        create_installation_token,
     )
-    for item in response.json():
-        if item["account"]["login"] == app_login and item["app_id"] == app_id:
-            installation_id = item["id"]
-            break
-    if not installation_id:
-        log.error(
-            f"Installation not found for {app_login} and {app_id}, this is case sensitive!"
-        )
-        msg = "Access token URL not found"
-        raise ValueError(msg)
+    return tokens.get().token
+
 
-    resp = client.create_installation_access_token(installation_id)
-    return resp.json()["token"]
+@memoized(lambda settings: settings.github_app_id)
+def get_app_tokens(settings: Settings) -> AppTokens:
+    tokens = AppTokens(
+        settings.github_app_login,
+        settings.github_app_id,
+        settings.github_app_private_key,
+        list_installations,
+        create_installation_token,
+    )
+    METRICS.gauge("github_app_token", tokens.stats)
+    return tokens
 
 
-CACHED_CLIENT = None
+CACHED_CLIENT: GithubClient | None = None
+CACHED_CLIENT_LOCK = threading.Lock()
 
 
 def get_github_client(settings: Settings) -> GithubClient:
     global CACHED_CLIENT  # noqa: PLW0603
-    if CACHED_CLIENT and CACHED_CLIENT.token_age + 300 > time.time():
+    token = get_app_tokens(settings).get()
+    with CACHED_CLIENT_LOCK:
+        if CACHED_CLIENT is None or CACHED_CLIENT.api_token != token.token:
+            CACHED_CLIENT = GithubClient(
+                token.token, installation_id=token.installation_id
+            )
         return CACHED_CLIENT
-    token = request_access_token(
-        settings.github_app_login,
-        settings.github_app_id,
-        settings.github_app_private_key,
-    )
-    CACHED_CLIENT = GithubClient(token)
-    return CACHED_CLIENT
 
 
 def main() -> None:
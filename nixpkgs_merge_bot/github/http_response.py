@@ -1,20 +1,34 @@
 import http.client
 import json
-import shutil
 from pathlib import Path
 from typing import Any
 
 
 class HttpResponse:
-    def __init__(self, raw: http.client.HTTPResponse) -> None:
-        self.raw = raw
+    """A response whose body has been read completely.
+
+    This allows the connection to be reused before the body is looked at.
+    """
+
+    def __init__(
+        self,
+        status: int,
+        reason: str,
+        headers: http.client.HTTPMessage,
+        body: bytes,
+        url: str = "",
+    ) -> None:
+        self.status = status
+        self.reason = reason
+        self._headers = headers
+        self.body = body
+        self.url = url
 
     def json(self) -> Any:
-        return json.load(self.raw)
+        return json.loads(self.body)
 
     def save(self, path: str) -> None:
-        with Path(path).open("wb") as f:
-            shutil.copyfileobj(self.raw, f)
+        Path(path).write_bytes(self.body)
 
     def headers(self) -> http.client.HTTPMessage:
-        return self.raw.headers
+        return self._headers
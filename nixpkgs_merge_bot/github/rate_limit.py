@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from email.message import Message
+from enum import IntEnum
+from typing import Any
+
+from nixpkgs_merge_bot.memoize import memoized
+
+log = logging.getLogger(__name__)
+
+# how long GitHub asks to back off from secondary rate limits without Retry-After
+SECONDARY_RATE_LIMIT_BACKOFF = 60
+
+
+class Priority(IntEnum):
+    # merges, comments and reactions, the user is waiting for them
+    HIGH = 0
+    # reads that lead up to a decision
+    LOW = 1
+
+
+class RateLimiter:
+    """Request budget of one installation, as last reported by GitHub.
+
+    Low priority requests are paced once fewer than `pace_below` requests are
+    left and stop entirely at `reserve`, which is kept for high priority ones.
+    No request waits longer than `max_wait`; it is sent anyway afterwards and
+    GitHub decides.
+    """
+
+    def __init__(
+        self,
+        reserve: int = 50,
+        pace_below: int = 500,
+        max_wait: float = 60,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.reserve = reserve
+        self.pace_below = pace_below
+        self.max_wait = max_wait
+        self.clock = clock
+        self._cond = threading.Condition()
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset_at: float | None = None
+        # set from Retry-After and secondary rate limits
+        self.blocked_until = 0.0
+        self._next_low_at = 0.0
+        self._high_waiting = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def _delay(self, priority: Priority, now: float) -> float:
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.remaining is None or self.reset_at is None or now >= self.reset_at:
+            return 0
+        if self.remaining <= 0:
+            return self.reset_at - now
+        if priority == Priority.HIGH:
+            return 0
+        if self.remaining <= self.reserve:
+            return self.reset_at - now
+        if self.remaining <= self.pace_below:
+            # spread what is left above the reserve until the reset
+            return max(0, self._next_low_at - now)
+        return 0
+
+    def acquire(self, priority: Priority) -> None:
+        """Block until a request with the given priority may be sent."""
+        with self._cond:
+            start = self.clock()
+            deadline = start + self.max_wait
+            if priority == Priority.HIGH:
+                self._high_waiting += 1
+            try:
+                while True:
+                    now = self.clock()
+                    delay = self._delay(priority, now)
+                    if priority == Priority.LOW and self._high_waiting and delay <= 0:
+                        # let waiting merges and comments go first
+                        delay = 0.1
+                    if delay <= 0:
+                        break
+                    if now >= deadline:
+                        log.warning(
+                            f"rate limit: waited {self.max_wait}s, sending request anyway"
+                        )
+                        break
+                    self._cond.wait(min(delay, deadline - now))
+                now = self.clock()
+                self.waited += now - start
+                if self.remaining is not None:
+                    # account for requests in flight until GitHub tells us better
+                    self.remaining -= 1
+                    if (
+                        priority == Priority.LOW
+                        and self.reset_at is not None
+                        and self.remaining <= self.pace_below
+                    ):
+                        left = max(1, self.remaining - self.reserve)
+                        self._next_low_at = now + (self.reset_at - now) / left
+            finally:
+                if priority == Priority.HIGH:
+                    self._high_waiting -= 1
+                self._cond.notify_all()
+
+    def update(self, headers: Message) -> None:
+        try:
+            limit = int(headers["x-ratelimit-limit"])
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset_at = float(headers["x-ratelimit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self._cond:
+            if self.reset_at is None or reset_at > self.reset_at:
+                self.remaining = remaining
+            elif reset_at == self.reset_at and self.remaining is not None:
+                # responses of concurrent requests arrive in any order
+                self.remaining = min(self.remaining, remaining)
+            else:
+                return
+            self.limit = limit
+            self.reset_at = reset_at
+            self._cond.notify_all()
+
+    def check_throttled(self, status: int, headers: Message, body: bytes) -> bool:
+        """Record a rate limited response; the request should then be retried."""
+        if status not in (403, 429):
+            return False
+        now = self.clock()
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        elif headers.get("x-ratelimit-remaining") == "0":
+            delay = float(headers.get("x-ratelimit-reset", now)) - now
+        elif b"secondary rate limit" in body:
+            delay = SECONDARY_RATE_LIMIT_BACKOFF
+        else:
+            return False
+        with self._cond:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, now + max(delay, 0))
+        log.warning(f"rate limited by GitHub, backing off for {delay:.0f}s")
+        return True
+
+    def state(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset_at": self.reset_at,
+                "blocked_until": self.blocked_until or None,
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited, 3),
+            }
+
+
+def request_resource(target: str) -> str:
+    """The x-ratelimit-resource whose budget a request to `target` uses."""
+    return "graphql" if target.split("?", 1)[0] == "/graphql" else "core"
+
+
+@memoized(lambda installation_id, resource="core": (installation_id, resource))
+def get_rate_limiter(
+    installation_id: int | None,  # noqa: ARG001
+    resource: str = "core",  # noqa: ARG001
+) -> RateLimiter:
+    """Budgets are per installation and resource; installation None is the
+    app's own (JWT) budget. REST ("core") and GraphQL are counted apart.
+    """
+    return RateLimiter()
+
+
+def rate_limit_states() -> dict[str, Any]:
+    return {
+        f"{installation_id}/{resource}": limiter.state()
+        for (installation_id, resource), limiter in get_rate_limiter.items()
+    }
@@ -0,0 +1,164 @@
+from dataclasses import dataclass
+from textwrap import dedent
+from typing import Any
+
+from .pull_request import PullRequest
+
+# the largest page size GitHub allows for connections
+PAGE_SIZE = 100
+
+# the pull request, its first files and the check runs of its head commit
+SNAPSHOT_QUERY = dedent("""\
+    query ($owner: String!, $repo: String!, $number: Int!) {
+        repository(owner: $owner, name: $repo) {
+            pullRequest(number: $number) {
+                id
+                number
+                title
+                body
+                state
+                baseRefName
+                headRefOid
+                author {
+                    login
+                    ... on User { databaseId }
+                    ... on Bot { databaseId }
+                }
+                files(first: 100) {
+                    pageInfo { hasNextPage endCursor }
+                    nodes { path changeType }
+                }
+                commits(last: 1) {
+                    nodes {
+                        commit {
+                            checkSuites(first: 100) {
+                                pageInfo { hasNextPage }
+                                nodes {
+                                    databaseId
+                                    app { databaseId name }
+                                    checkRuns(first: 100, filterBy: {checkType: LATEST}) {
+                                        pageInfo { hasNextPage }
+                                        nodes {
+                                            databaseId
+                                            name
+                                            status
+                                            conclusion
+                                            startedAt
+                                        }
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+""")
+
+FILES_QUERY = dedent("""\
+    query ($owner: String!, $repo: String!, $number: Int!, $cursor: String!) {
+        repository(owner: $owner, name: $repo) {
+            pullRequest(number: $number) {
+                files(first: 100, after: $cursor) {
+                    pageInfo { hasNextPage endCursor }
+                    nodes { path changeType }
+                }
+            }
+        }
+    }
+""")
+
+
+def details_query(paths: int, team: bool) -> str:
+    """Sizes of `paths` blobs at the head commit and the author's team membership."""
+    variables = ["$owner: String!", "$repo: String!"]
+    variables += [f"$path{i}: String!" for i in range(paths)]
+    blobs = "\n".join(
+        f"blob{i}: object(expression: $path{i}) {{ ... on Blob {{ byteSize }} }}"
+        for i in range(paths)
+    )
+    membership = ""
+    if team:
+        variables += ["$org: String!", "$team: String!", "$login: String!"]
+        membership = """
+            organization(login: $org) {
+                team(slug: $team) {
+                    members(query: $login, first: 100) { nodes { databaseId } }
+                }
+            }"""
+    return f"""query ({", ".join(variables)}) {{
+        repository(owner: $owner, name: $repo) {{
+            {blobs or "id"}
+        }}{membership}
+    }}"""
+
+
+# REST names of GraphQL's PatchStatus
+CHANGE_TYPES = {"DELETED": "removed"}
+
+
+@dataclass
+class PullRequestSnapshot:
+    pull_request: PullRequest
+    # as listed by the REST API, plus the size of the file at the head commit
+    files: list[dict[str, Any]]
+    # as listed by the REST API; None if there are too many for one query
+    check_runs: list[dict[str, Any]] | None
+    # None if it was not asked for
+    author_in_team: bool | None
+
+
+def parse_pull_request(node: dict[str, Any], owner: str, repo: str) -> PullRequest:
+    author = node["author"] or {}
+    return PullRequest(
+        user_id=author.get("databaseId", 0),
+        user_login=author.get("login", "ghost"),
+        text=node["body"],
+        repo_owner=owner,
+        repo_name=repo,
+        number=node["number"],
+        node_id=node["id"],
+        title=node["title"],
+        # merged pull requests are closed ones to the REST API
+        state="open" if node["state"] == "OPEN" else "closed",
+        head_sha=node["headRefOid"],
+        ref=node["baseRefName"],
+    )
+
+
+def parse_files(nodes: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    return [
+        {
+            "filename": node["path"],
+            "status": CHANGE_TYPES.get(node["changeType"], node["changeType"].lower()),
+        }
+        for node in nodes
+    ]
+
+
+def parse_check_runs(node: dict[str, Any]) -> list[dict[str, Any]] | None:
+    commits = node["commits"]["nodes"]
+    if not commits:
+        return []
+    suites = commits[0]["commit"]["checkSuites"]
+    if suites["pageInfo"]["hasNextPage"]:
+        return None
+    check_runs: list[dict[str, Any]] = []
+    for suite in suites["nodes"]:
+        if suite["checkRuns"]["pageInfo"]["hasNextPage"]:
+            return None
+        app = suite["app"] or {"databaseId": 0, "name": "unknown"}
+        check_runs.extend(
+            {
+                "id": run["databaseId"],
+                "name": run["name"],
+                "status": run["status"].lower(),
+                "conclusion": run["conclusion"] and run["conclusion"].lower(),
+                "started_at": run["startedAt"],
+                "check_suite": {"id": suite["databaseId"]},
+                "app": {"id": app["databaseId"], "name": app["name"]},
+            }
+            for run in suite["checkRuns"]["nodes"]
+        )
+    return check_runs
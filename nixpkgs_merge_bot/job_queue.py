@@ -0,0 +1,176 @@
+import json
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from .database import Database, get_database
+from .memoize import memoized
+from .settings import Settings
+from .webhook.http_response import HttpResponse
+
+log = logging.getLogger(__name__)
+
+# a job that was running during this many restarts is most likely what killed us
+MAX_ATTEMPTS = 3
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: int
+    event_type: str
+    key: str | None
+    body: bytes
+    attempts: int
+
+
+class JobQueue:
+    """Webhook deliveries persisted in SQLite until they have been processed.
+
+    Jobs sharing a key are handed out one at a time and in insertion order.
+    """
+
+    def __init__(self, db: Database, max_size: int) -> None:
+        self.max_size = max_size
+        self.db = db
+        self._cond = threading.Condition(db.lock)
+        self.db.create(
+            """CREATE TABLE IF NOT EXISTS jobs(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_type TEXT NOT NULL,
+                key TEXT,
+                body BLOB NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, id)",
+        )
+        # jobs that were running when the previous process stopped are retried
+        with self._cond:
+            recovered = self.db.con.execute(
+                "UPDATE jobs SET state = 'pending' WHERE state = 'running'"
+            ).rowcount
+        if recovered:
+            log.info(f"Recovered {recovered} interrupted jobs")
+
+    def put(self, event_type: str, key: str | None, body: bytes) -> int:
+        with self._cond:
+            if self.depth() >= self.max_size:
+                msg = f"job queue is full ({self.max_size} jobs)"
+                raise JobQueueFullError(msg)
+            cur = self.db.con.execute(
+                "INSERT INTO jobs(event_type, key, body, created_at) VALUES (?, ?, ?, ?)",
+                (event_type, key, body, time.time()),
+            )
+            self._cond.notify()
+            assert cur.lastrowid is not None
+            return cur.lastrowid
+
+    def claim(self, timeout: float | None = None) -> Job | None:
+        """Take the oldest pending job whose key has no job running."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                row = self.db.con.execute(
+                    """SELECT id, event_type, key, body, attempts FROM jobs
+                    WHERE state = 'pending' AND (key IS NULL OR key NOT IN (
+                        SELECT key FROM jobs WHERE state = 'running' AND key IS NOT NULL
+                    ))
+                    ORDER BY id LIMIT 1"""
+                ).fetchone()
+                if row is not None:
+                    self.db.con.execute(
+                        "UPDATE jobs SET state = 'running', attempts = attempts + 1 WHERE id = ?",
+                        (row[0],),
+                    )
+                    return Job(row[0], row[1], row[2], row[3], row[4] + 1)
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def done(self, job: Job) -> None:
+        with self._cond:
+            self.db.con.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            # jobs with the same key may be claimable now
+            self._cond.notify_all()
+
+    def depth(self) -> int:
+        with self._cond:
+            return self.db.con.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            counts = dict(
+                self.db.con.execute(
+                    "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+                ).fetchall()
+            )
+        return {
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "max_size": self.max_size,
+        }
+
+
+class JobExecutor:
+    """Threads that drain a JobQueue through the regular event handlers."""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        dispatch: Callable[[str, dict[str, Any], Settings], HttpResponse],
+        settings: Settings,
+    ) -> None:
+        self.queue = queue
+        self.dispatch = dispatch
+        self.settings = settings
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-{i}", daemon=True)
+            for i in range(settings.workers)
+        ]
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            job = self.queue.claim(timeout=1)
+            if job is None:
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: Job) -> None:
+        if job.attempts > MAX_ATTEMPTS:
+            log.error(
+                f"Dropping job {job.id} ({job.event_type}) after {job.attempts - 1} attempts"
+            )
+            self.queue.done(job)
+            return
+        try:
+            resp = self.dispatch(job.event_type, json.loads(job.body), self.settings)
+            log.info(
+                f"Job {job.id} ({job.event_type}) finished with {resp.code}: {resp.body!r}"
+            )
+        except Exception:
+            log.exception(f"Job {job.id} ({job.event_type}) failed")
+        self.queue.done(job)
+
+
+@memoized(lambda settings: settings.database_file)
+def get_job_queue(settings: Settings) -> JobQueue:
+    return JobQueue(get_database(settings), settings.job_queue_size)
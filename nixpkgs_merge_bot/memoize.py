@@ -0,0 +1,51 @@
+import functools
+import threading
+from collections.abc import Callable, Hashable
+from typing import Generic, ParamSpec, TypeVar
+
+P = ParamSpec("P")
+K = TypeVar("K", bound=Hashable)
+T = TypeVar("T")
+
+
+class Memoized(Generic[P, K, T]):
+    """Process-wide instances made by `create`, one per `key` of the arguments."""
+
+    def __init__(self, create: Callable[P, T], key: Callable[P, K]) -> None:
+        functools.update_wrapper(self, create)
+        self.create = create
+        self.key = key
+        self._lock = threading.Lock()
+        self._instances: dict[K, T] = {}
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> T:
+        key = self.key(*args, **kwargs)
+        with self._lock:
+            if key not in self._instances:
+                self._instances[key] = self.create(*args, **kwargs)
+            return self._instances[key]
+
+    def find(self, *args: P.args, **kwargs: P.kwargs) -> T | None:
+        """The instance for these arguments, if one was made."""
+        key = self.key(*args, **kwargs)
+        with self._lock:
+            return self._instances.get(key)
+
+    def items(self) -> list[tuple[K, T]]:
+        with self._lock:
+            return list(self._instances.items())
+
+    def values(self) -> list[T]:
+        with self._lock:
+            return list(self._instances.values())
+
+
+def memoized(
+    key: Callable[P, K],
+) -> Callable[[Callable[P, T]], Memoized[P, K, T]]:
+    """Decorate a `get_x(...)` accessor to create its instance once per key."""
+
+    def decorator(create: Callable[P, T]) -> Memoized[P, K, T]:
+        return Memoized(create, key)
+
+    return decorator
@@ -1,9 +1,8 @@
 import logging
 from abc import ABC, abstractmethod
-from typing import Any
-from urllib.parse import urlparse
+from typing import ClassVar
 
-from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.commands.facts import FACTS, Facts
 from nixpkgs_merge_bot.github.issue import IssueComment
 from nixpkgs_merge_bot.github.pull_request import PullRequest
 from nixpkgs_merge_bot.settings import Settings
@@ -12,61 +11,30 @@ log = logging.getLogger(__name__)
 
 
 class MergingStrategyTemplate(ABC):
-    def __init__(self, client: GithubClient, settings: Settings) -> None:
-        self.github_client: GithubClient = client
+    # names of the facts the strategy decides on
+    needs: ClassVar[tuple[str, ...]] = ("technical_limits",)
+
+    def __init_subclass__(cls) -> None:
+        super().__init_subclass__()
+        unknown = set(cls.needs) - FACTS
+        if unknown:
+            msg = f"{cls.__name__} needs unknown facts: {', '.join(sorted(unknown))}"
+            raise TypeError(msg)
+
+    def __init__(self, facts: Facts, settings: Settings) -> None:
+        self.facts = facts
+        self.context = facts.context
+        self.github_client = facts.context.client
         self.settings: Settings = settings
 
-    def run_technical_limits_check(
-        self, pull_request: PullRequest
-    ) -> tuple[bool, list[str]]:
-        result = True
-        decline_reasons = []
-        files_response = self.github_client.pull_request_files(
-            pull_request.repo_owner, pull_request.repo_name, pull_request.number
-        )
-        body = files_response.json()
-        sha = pull_request.head_sha
-        log.info(
-            f"{pull_request.number}: Checking mergeability of {pull_request.number} with sha {sha}"
-        )
-
-        if pull_request.state != "open":
-            result = False
-            message = f"pr is not open, state is {pull_request.state}"
-            decline_reasons.append(message)
-            log.info(f"{pull_request.number}: {message}")
-
-        if pull_request.ref not in ("staging", "staging-next", "master"):
-            result = False
-            message = "pr is not targeted to any of the allowed branches: staging, staging-next, master"
-            decline_reasons.append(message)
-            log.info(f"{pull_request.number}: {message}")
-
-        for file in body:
-            filename = file["filename"]
-            file_size_bytes = self.get_file_size_bytes(pull_request, file)
-            if file_size_bytes > self.settings.max_file_size_bytes:
-                result = False
-                message = f"{filename} exceeds the maximum allowed file size of {self.settings.max_file_size_mb} MB"
-                decline_reasons.append(message)
-            if not filename.startswith("pkgs/by-name/"):
-                result = False
-                message = f"{filename} is not in pkgs/by-name/"
-                decline_reasons.append(message)
-                log.info(f"{pull_request.number}: {message}")
-        return result, decline_reasons
+    def run_technical_limits_check(self) -> tuple[bool, list[str]]:
+        decline_reasons = list(self.facts.technical_limits)
+        return not decline_reasons, decline_reasons
 
-    def get_file_size_bytes(
-        self, pull_request: PullRequest, file: dict[str, Any]
-    ) -> int:
-        file_contents_url = urlparse(file["contents_url"])
-        response = self.github_client.get_request_file_content(
-            pull_request.repo_owner,
-            pull_request.repo_name,
-            file["filename"],
-            file_contents_url.query,
-        )
-        return response.json()["size"]
+    def prefetch(self) -> None:
+        """Start on the remaining facts once the author may use the strategy."""
+        # the check runs are needed as soon as any strategy accepts
+        self.facts.prefetch((*self.needs, "check_runs"))
 
     @abstractmethod
     def run(
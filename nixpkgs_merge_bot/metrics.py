@@ -0,0 +1,34 @@
+import threading
+from collections.abc import Callable
+from typing import Any
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = {}
+        self._gauges: dict[str, Callable[[], Any]] = {}
+
+    def inc(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def gauge(self, name: str, callback: Callable[[], Any]) -> None:
+        """Register a value that is computed whenever a snapshot is taken."""
+        with self._lock:
+            self._gauges[name] = callback
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            result: dict[str, Any] = dict(self._counters)
+            gauges = list(self._gauges.items())
+        for name, callback in gauges:
+            result[name] = callback()
+        return result
+
+
+METRICS = Metrics()
@@ -0,0 +1,207 @@
+import json
+import logging
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import IO, Any
+
+log = logging.getLogger(__name__)
+
+REPL_COMMAND = ["nix", "--extra-experimental-features", "nix-command", "repl"]
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+STRING_LINE = re.compile(r'"((?:[^"\\]|\\.)*)"\s*$')
+STRING_ESCAPE = re.compile(r"\\(.)")
+STRING_ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+ERROR_LINE = re.compile(r"^(?:nix-repl> )*error:")
+
+
+class NixEvalError(Exception):
+    pass
+
+
+def nix_string(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False).replace("${", "\\${")
+
+
+def parse_nix_string(line: str) -> str | None:
+    """The string the repl printed on `line`, if it printed one."""
+    match = STRING_LINE.search(line)
+    if match is None:
+        return None
+    return STRING_ESCAPE.sub(
+        lambda m: STRING_ESCAPES.get(m.group(1), m.group(1)), match.group(1)
+    )
+
+
+def resident_memory(pid: int) -> int | None:
+    """Resident set size of process `pid` in bytes, None where /proc is missing."""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+class NixEvaluator:
+    """A `nix repl` that keeps one nixpkgs checkout loaded between queries.
+
+    nixpkgs is imported once as `pkgs` and the files in `functions` are bound
+    by name, so a query only pays for what it evaluates. The repl is started
+    again for another checkout, after a query timed out, or once it uses more
+    than `max_memory` bytes.
+    """
+
+    def __init__(
+        self,
+        functions: dict[str, str],
+        timeout: float = 600,
+        max_memory: int = 4 * 1024 * 1024 * 1024,
+        command: list[str] = REPL_COMMAND,
+    ) -> None:
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.command = command
+        self._dir = tempfile.TemporaryDirectory(prefix="nixpkgs-merge-bot-eval-")
+        self._functions = {}
+        for name, expr in functions.items():
+            path = Path(self._dir.name) / f"{name}.nix"
+            path.write_text(expr)
+            self._functions[name] = path
+        # held for a whole query
+        self._lock = threading.Lock()
+        # guards the counters, so stats() does not wait for a running query
+        self._stats_lock = threading.Lock()
+        self._proc: subprocess.Popen[str] | None = None
+        self._lines: queue.Queue[str | None] = queue.Queue()
+        self._nixpkgs: Path | None = None
+        self.queries = 0
+        self.starts = 0
+        self.timeouts = 0
+        self.memory_restarts = 0
+
+    def eval_json(self, nixpkgs: Path, expr: str) -> Any:
+        """Evaluate `expr` with `pkgs` from `nixpkgs`; it must return JSON data."""
+        with self._lock:
+            if self._nixpkgs != nixpkgs or self._proc is None:
+                self._start(nixpkgs)
+            try:
+                lines = self._send(f"builtins.toJSON ({expr})")
+            except subprocess.TimeoutExpired:
+                with self._stats_lock:
+                    self.timeouts += 1
+                self._stop()
+                raise
+            with self._stats_lock:
+                self.queries += 1
+            assert self._proc is not None
+            memory = resident_memory(self._proc.pid)
+            if memory is not None and memory > self.max_memory:
+                log.info(f"nix repl uses {memory >> 20} MiB, restarting it")
+                with self._stats_lock:
+                    self.memory_restarts += 1
+                self._stop()
+        if any(ERROR_LINE.match(line) for line in lines):
+            raise NixEvalError("\n".join(lines))
+        for line in reversed(lines):
+            value = parse_nix_string(line)
+            if value is not None:
+                return json.loads(value)
+        msg = f"nix repl printed no result: {lines}"
+        raise NixEvalError(msg)
+
+    def _start(self, nixpkgs: Path) -> None:
+        self._stop()
+        log.info(f"Starting nix repl for {nixpkgs}")
+        self._proc = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        self._lines = queue.Queue()
+        assert self._proc.stdout is not None
+        threading.Thread(
+            target=self._read, args=(self._proc.stdout, self._lines), daemon=True
+        ).start()
+        with self._stats_lock:
+            self._nixpkgs = nixpkgs
+            self.starts += 1
+        bindings = [
+            f"pkgs = import (/. + {nix_string(str(nixpkgs.absolute()))}) {{ }}",
+            *(f"{name} = import {path}" for name, path in self._functions.items()),
+        ]
+        try:
+            lines = self._send("\n".join(bindings))
+        except subprocess.TimeoutExpired:
+            self._stop()
+            raise
+        if any(ERROR_LINE.match(line) for line in lines):
+            self._stop()
+            raise NixEvalError("\n".join(lines))
+
+    @staticmethod
+    def _read(stdout: IO[str], lines: "queue.Queue[str | None]") -> None:
+        for line in stdout:
+            lines.put(ANSI_ESCAPE.sub("", line.rstrip("\n")))
+        lines.put(None)
+
+    def _send(self, text: str) -> list[str]:
+        """Send `text` and collect the output until a marker is echoed back."""
+        assert self._proc is not None
+        assert self._proc.stdin is not None
+        marker = uuid.uuid4().hex
+        try:
+            self._proc.stdin.write(f"{text}\n{nix_string(marker)}\n")
+            self._proc.stdin.flush()
+        except BrokenPipeError as e:
+            self._stop()
+            msg = "nix repl exited"
+            raise NixEvalError(msg) from e
+        lines: list[str] = []
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                line = self._lines.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty as e:
+                raise subprocess.TimeoutExpired(self.command, self.timeout) from e
+            if line is None:
+                self._stop()
+                msg = f"nix repl exited: {lines}"
+                raise NixEvalError(msg)
+            if parse_nix_string(line) == marker:
+                return lines
+            lines.append(line)
+
+    def _stop(self) -> None:
+        if self._proc is None:
+            return
+        self._proc.kill()
+        self._proc.wait()
+        self._proc = None
+        with self._stats_lock:
+            self._nixpkgs = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._stop()
+        self._dir.cleanup()
+
+    def stats(self) -> dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "nixpkgs": str(self._nixpkgs) if self._nixpkgs else None,
+                "queries": self.queries,
+                "starts": self.starts,
+                "timeouts": self.timeouts,
+                "memory_restarts": self.memory_restarts,
+            }
@@ -0,0 +1,371 @@
+import json
+import logging
+import subprocess
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.git import by_name_packages, changed_paths
+from nixpkgs_merge_bot.repo_manager import RepoManager
+
+from .evaluator import NixEvalError
+
+log = logging.getLogger(__name__)
+
+MAINTAINER_LIST = "maintainers/maintainer-list.nix"
+TEAM_LIST = "maintainers/team-list.nix"
+# packages per nix-instantiate, bounds the memory of a full build
+BATCH_SIZE = 1000
+MISSING_PACKAGE = "attribute does not exist"
+EVALUATION_FAILED = "evaluation failed"
+
+
+@dataclass
+class Maintainer:
+    github_id: int
+    name: str
+
+
+@dataclass
+class PackageMaintainers:
+    maintainers: list[Maintainer]
+    # set if the maintainers of the package could not be evaluated
+    error: str | None = None
+
+
+# handle in the maintainer list -> (githubId, github)
+MaintainerList = dict[str, tuple[int | None, str | None]]
+EvaluatePackages = Callable[[Path, list[str]], dict[str, PackageMaintainers]]
+EvaluateMaintainerList = Callable[[Path], MaintainerList]
+
+
+class MaintainerIndex:
+    """Maintainers of every pkgs/by-name package of a branch, kept in SQLite.
+
+    The index of a branch is built by evaluating all its packages. When the
+    branch moves, only packages whose directory changed are evaluated again,
+    and those listing a maintainer whose maintainer-list.nix entry changed.
+    Maintainers that packages take from elsewhere are picked up by a full
+    rebuild, which runs in the background once the index is older than
+    `rebuild_interval` or the team list changed.
+
+    Lookups fetch the branch (at most once per fetch interval of the
+    repository) and refresh the index to its head before answering, so an
+    answer is never older than one fetch interval. Only the first lookup of
+    a branch waits for a full build.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        repo: RepoManager,
+        evaluate_packages: EvaluatePackages,
+        evaluate_maintainer_list: EvaluateMaintainerList,
+        *,
+        rebuild_interval: float = 24 * 60 * 60,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.repo = repo
+        self.evaluate_packages = evaluate_packages
+        self.evaluate_maintainer_list = evaluate_maintainer_list
+        self.rebuild_interval = rebuild_interval
+        self.clock = clock
+        self.db = db
+        # ref -> lock held while its index is updated
+        self._update_locks: dict[str, threading.Lock] = {}
+        # ref -> thread rebuilding its index in the background
+        self._rebuilding: dict[str, threading.Thread] = {}
+        self.db.create(
+            """CREATE TABLE IF NOT EXISTS maintainer_index(
+                ref TEXT PRIMARY KEY,
+                sha TEXT NOT NULL,
+                built_at REAL NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS package_maintainers(
+                ref TEXT NOT NULL,
+                package TEXT NOT NULL,
+                maintainers TEXT NOT NULL,
+                error TEXT,
+                PRIMARY KEY (ref, package)
+            )""",
+            """CREATE TABLE IF NOT EXISTS maintainer_list(
+                ref TEXT NOT NULL,
+                handle TEXT NOT NULL,
+                github_id INTEGER,
+                github TEXT,
+                PRIMARY KEY (ref, handle)
+            )""",
+        )
+        self.full_builds = 0
+        self.incremental_updates = 0
+        self.evaluated_packages = 0
+
+    def _indexed(self, ref: str) -> tuple[str, float] | None:
+        with self.db.lock:
+            return self.db.con.execute(
+                "SELECT sha, built_at FROM maintainer_index WHERE ref = ?", (ref,)
+            ).fetchone()
+
+    def _update_lock(self, ref: str) -> threading.Lock:
+        with self.db.lock:
+            return self._update_locks.setdefault(ref, threading.Lock())
+
+    def update(self, ref: str) -> str:
+        """Bring the index of branch `ref` to its fetched head, returns the indexed sha."""
+        with self._update_lock(ref):
+            return self._update(ref)
+
+    def _update(self, ref: str) -> str:
+        self.repo.fetch()
+        sha = self.repo.resolve(ref)
+        indexed = self._indexed(ref)
+        if indexed is None or indexed[0] != sha:
+            with self.repo.checkout(sha) as worktree:
+                if indexed is None or not self._refresh(ref, indexed[0], sha, worktree):
+                    self._build(ref, sha, worktree)
+            indexed = self._indexed(ref)
+        if indexed is not None and self.clock() - indexed[1] >= self.rebuild_interval:
+            self.rebuild_in_background(ref)
+        return sha
+
+    def rebuild_in_background(self, ref: str) -> None:
+        """Start a full rebuild of the index of `ref` unless one is running."""
+        with self.db.lock:
+            if ref in self._rebuilding:
+                return
+            thread = threading.Thread(
+                target=self._rebuild_in_background,
+                args=(ref,),
+                name=f"maintainer-index-{ref}",
+                daemon=True,
+            )
+            self._rebuilding[ref] = thread
+        thread.start()
+
+    def _rebuild_in_background(self, ref: str) -> None:
+        try:
+            self.rebuild(ref)
+        except Exception:
+            log.exception(f"Rebuilding the maintainer index of {ref} failed")
+        finally:
+            with self.db.lock:
+                del self._rebuilding[ref]
+
+    def rebuild(self, ref: str) -> None:
+        """Evaluate all packages of `ref` again, lookups are not blocked meanwhile."""
+        self.repo.fetch()
+        sha = self.repo.resolve(ref)
+        with self.repo.checkout(sha) as worktree:
+            packages, maintainer_list = self._evaluate_all(ref, sha, worktree)
+        with self._update_lock(ref):
+            self._store_build(ref, sha, packages, maintainer_list)
+            # lookups may have moved the index past `sha` in the meantime
+            self._update(ref)
+
+    def _evaluate(
+        self, worktree: Path, names: list[str]
+    ) -> dict[str, PackageMaintainers]:
+        packages = {}
+        for i in range(0, len(names), BATCH_SIZE):
+            packages.update(self._evaluate_batch(worktree, names[i : i + BATCH_SIZE]))
+        with self.db.lock:
+            self.evaluated_packages += len(names)
+        return packages
+
+    def _evaluate_batch(
+        self, worktree: Path, names: list[str]
+    ) -> dict[str, PackageMaintainers]:
+        """Evaluate `names`, halving the batch when one of them breaks the call."""
+        try:
+            return self.evaluate_packages(worktree, names)
+        except (subprocess.CalledProcessError, NixEvalError):
+            if len(names) == 1:
+                log.exception(f"Failed to evaluate the maintainers of {names[0]}")
+                return {names[0]: PackageMaintainers([], EVALUATION_FAILED)}
+            log.warning(
+                f"Evaluating {len(names)} packages failed, evaluating them in halves"
+            )
+        middle = len(names) // 2
+        return {
+            **self._evaluate_batch(worktree, names[:middle]),
+            **self._evaluate_batch(worktree, names[middle:]),
+        }
+
+    def _build(self, ref: str, sha: str, worktree: Path) -> None:
+        self._store_build(ref, sha, *self._evaluate_all(ref, sha, worktree))
+
+    def _evaluate_all(
+        self, ref: str, sha: str, worktree: Path
+    ) -> tuple[dict[str, PackageMaintainers], MaintainerList]:
+        started = time.monotonic()
+        names = by_name_packages(self.repo.repo_path, sha)
+        log.info(
+            f"Building the maintainer index of {ref} at {sha}, {len(names)} packages"
+        )
+        packages = self._evaluate(worktree, names)
+        maintainer_list = self.evaluate_maintainer_list(worktree)
+        log.info(
+            f"Evaluated the maintainer index of {ref} in {time.monotonic() - started:.1f}s"
+        )
+        return packages, maintainer_list
+
+    def _store_build(
+        self,
+        ref: str,
+        sha: str,
+        packages: dict[str, PackageMaintainers],
+        maintainer_list: MaintainerList,
+    ) -> None:
+        with self.db.transaction() as con:
+            con.execute("DELETE FROM package_maintainers WHERE ref = ?", (ref,))
+            self._store(ref, packages, maintainer_list)
+            con.execute(
+                "INSERT OR REPLACE INTO maintainer_index(ref, sha, built_at) VALUES (?, ?, ?)",
+                (ref, sha, self.clock()),
+            )
+            self.full_builds += 1
+
+    def _refresh(self, ref: str, old: str, new: str, worktree: Path) -> bool:
+        """Update the index from `old` to `new`; False if it must be rebuilt."""
+        try:
+            changed = changed_paths(
+                self.repo.repo_path, old, new, "pkgs/by-name/", "maintainers/"
+            )
+        except subprocess.CalledProcessError:
+            log.exception(f"Cannot compare {old} and {new}, rebuilding the index")
+            return False
+        names = {
+            path.split("/")[3]
+            for path in changed
+            if path.startswith("pkgs/by-name/") and path.count("/") >= 4
+        }
+        maintainer_list = None
+        if MAINTAINER_LIST in changed:
+            maintainer_list = self.evaluate_maintainer_list(worktree)
+            names |= self._packages_of(
+                ref, self._changed_maintainers(ref, maintainer_list)
+            )
+        log.info(
+            f"Updating the maintainer index of {ref} from {old} to {new}, {len(names)} packages"
+        )
+        packages = self._evaluate(worktree, sorted(names))
+        with self.db.transaction() as con:
+            self._store(ref, packages, maintainer_list)
+            con.execute("UPDATE maintainer_index SET sha = ? WHERE ref = ?", (new, ref))
+            if TEAM_LIST in changed:
+                # team members are only picked up by a full rebuild, make it due
+                con.execute(
+                    "UPDATE maintainer_index SET built_at = ? WHERE ref = ?",
+                    (self.clock() - self.rebuild_interval, ref),
+                )
+            self.incremental_updates += 1
+        return True
+
+    def _store(
+        self,
+        ref: str,
+        packages: dict[str, PackageMaintainers],
+        maintainer_list: MaintainerList | None,
+    ) -> None:
+        self.db.con.executemany(
+            "INSERT OR REPLACE INTO package_maintainers(ref, package, maintainers, error) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    ref,
+                    name,
+                    json.dumps([[m.github_id, m.name] for m in package.maintainers]),
+                    package.error,
+                )
+                for name, package in packages.items()
+            ],
+        )
+        if maintainer_list is not None:
+            self.db.con.execute("DELETE FROM maintainer_list WHERE ref = ?", (ref,))
+            self.db.con.executemany(
+                "INSERT INTO maintainer_list(ref, handle, github_id, github) VALUES (?, ?, ?, ?)",
+                [
+                    (ref, handle, github_id, github)
+                    for handle, (github_id, github) in maintainer_list.items()
+                ],
+            )
+
+    def _changed_maintainers(
+        self, ref: str, maintainer_list: MaintainerList
+    ) -> set[int]:
+        """GitHub ids of maintainers whose entry was changed or removed."""
+        with self.db.lock:
+            rows = self.db.con.execute(
+                "SELECT handle, github_id, github FROM maintainer_list WHERE ref = ?",
+                (ref,),
+            ).fetchall()
+        ids = set()
+        for handle, github_id, github in rows:
+            if (
+                maintainer_list.get(handle) != (github_id, github)
+                and github_id is not None
+            ):
+                ids.add(github_id)
+        return ids
+
+    def _packages_of(self, ref: str, github_ids: set[int]) -> set[str]:
+        if not github_ids:
+            return set()
+        with self.db.lock:
+            rows = self.db.con.execute(
+                "SELECT package, maintainers FROM package_maintainers WHERE ref = ?",
+                (ref,),
+            ).fetchall()
+        return {
+            package
+            for package, maintainers in rows
+            if any(github_id in github_ids for github_id, _ in json.loads(maintainers))
+        }
+
+    def lookup(self, ref: str, names: Iterable[str]) -> dict[str, PackageMaintainers]:
+        names = sorted(set(names))
+        # read under the update lock, so that a rebuild cannot commit an
+        # older sha between the update and the read
+        with self._update_lock(ref):
+            sha = self._update(ref)
+            with self.db.lock:
+                rows = self.db.con.execute(
+                    f"SELECT package, maintainers, error FROM package_maintainers WHERE ref = ? AND package IN ({', '.join('?' * len(names))})",  # noqa: S608
+                    (ref, *names),
+                ).fetchall()
+        log.info(f"Maintainers of {names} from the index of {ref} at {sha}")
+        packages = {
+            package: PackageMaintainers(
+                [
+                    Maintainer(github_id, name)
+                    for github_id, name in json.loads(maintainers)
+                ],
+                error,
+            )
+            for package, maintainers, error in rows
+        }
+        for name in names:
+            # not a package on the target branch yet
+            packages.setdefault(name, PackageMaintainers([], MISSING_PACKAGE))
+        return packages
+
+    def stats(self) -> dict[str, Any]:
+        with self.db.lock:
+            refs = self.db.con.execute(
+                """SELECT i.ref, i.sha, i.built_at, COUNT(p.package)
+                FROM maintainer_index i LEFT JOIN package_maintainers p ON p.ref = i.ref
+                GROUP BY i.ref"""
+            ).fetchall()
+            return {
+                "refs": {
+                    ref: {"sha": sha, "built_at": built_at, "packages": packages}
+                    for ref, sha, built_at, packages in refs
+                },
+                "full_builds": self.full_builds,
+                "incremental_updates": self.incremental_updates,
+                "evaluated_packages": self.evaluated_packages,
+                "rebuilding": len(self._rebuilding),
+            }
@@ -1,12 +1,27 @@
+import functools
 import json
 import logging
 import subprocess
+import tempfile
+from collections.abc import Iterable
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Any
 
-from nixpkgs_merge_bot.git import checkout_newest_master
+from nixpkgs_merge_bot.database import get_database
+from nixpkgs_merge_bot.memoize import memoized
+from nixpkgs_merge_bot.metrics import METRICS
+from nixpkgs_merge_bot.repo_manager import get_repo_manager
 from nixpkgs_merge_bot.settings import Settings
 
+from .evaluator import NixEvaluator, nix_string
+from .maintainer_index import (
+    Maintainer,
+    MaintainerIndex,
+    MaintainerList,
+    PackageMaintainers,
+)
+
 log = logging.getLogger(__name__)
 
 
@@ -17,23 +32,73 @@ class MergeResponse:
     sha: str
 
 
-@dataclass
-class Maintainer:
-    github_id: int
-    name: str
+# Evaluates the maintainers of several packages at once, so nixpkgs is only
+# parsed once. Only the fields needed to check and name maintainers are
+# returned. tryEval only catches throw and assert, so missing attributes and
+# values of the wrong type are defaulted instead; a package that still fails
+# to evaluate aborts the whole call.
+PACKAGE_MAINTAINERS_EXPR = """
+{ pkgs, names }:
+let
+  maintainersOf =
+    name:
+    if !(pkgs ? ${name}) then
+      { error = "attribute does not exist"; }
+    else
+      let
+        declared = pkgs.${name}.meta.maintainers or [ ];
+        maintainers = map (m: {
+          githubId = m.githubId or null;
+          github = m.github or null;
+        }) (builtins.filter builtins.isAttrs (if builtins.isList declared then declared else [ ]));
+        result = builtins.tryEval (builtins.deepSeq maintainers maintainers);
+      in
+      if result.success then
+        { maintainers = result.value; }
+      else
+        { error = "evaluation failed"; };
+in
+builtins.listToAttrs (
+  map (name: {
+    inherit name;
+    value = maintainersOf name;
+  }) names
+)
+"""
+
+MAINTAINERS_EXPR = (
+    """
+{ nixpkgs, namesFile }:
+("""
+    + PACKAGE_MAINTAINERS_EXPR
+    + """) {
+  pkgs = import (/. + nixpkgs) { };
+  names = builtins.fromJSON (builtins.readFile namesFile);
+}
+"""
+)
 
+MAINTAINER_LIST_EXPR = """
+{ nixpkgs }:
+builtins.mapAttrs (handle: m: {
+  githubId = m.githubId or null;
+  github = m.github or null;
+}) (import (/. + nixpkgs + "/maintainers/maintainer-list.nix"))
+"""
 
-def nix_eval(folder: Path, attr: str) -> bytes:
-    log.info(f"Running nix-instantiate with attr: {attr} and folder: {folder}")
+
+def nix_eval(expr: str, args: dict[str, str]) -> bytes:
+    log.info(f"Running nix-instantiate with args: {args}")
+    argstrs = [arg for name, value in args.items() for arg in ("--argstr", name, value)]
     proc = subprocess.run(
         [
             "nix-instantiate",
             "--eval",
             "--strict",
             "--json",
-            str(folder),
-            "-A",
-            attr,
+            *argstrs,
+            "--expr",
+            expr,
         ],
         check=True,
         stdin=subprocess.PIPE,
@@ -42,17 +107,99 @@ def nix_eval(folder: Path, attr: str) -> bytes:
     return proc.stdout
 
 
-def get_package_maintainers(settings: Settings, path: Path) -> list[Maintainer]:
-    checkout_newest_master(settings.repo_path)
-    package_name = path.parts[3]
-    # TODO maybe we want to check the merge target remote here?
-    proc = nix_eval(settings.repo_path, f"{package_name}.meta.maintainers")
-    maintainers = json.loads(proc.decode("utf-8"))
-    log.debug(f"Found {maintainers} for {path}")
-    return [
-        Maintainer(maintainer["githubId"], maintainer["github"])
-        for maintainer in maintainers
-    ]
+def package_name(path: Path) -> str:
+    """Attribute of the package a file in pkgs/by-name/ belongs to."""
+    return path.parts[3]
+
+
+def parse_maintainers(result: dict[str, Any]) -> dict[str, PackageMaintainers]:
+    packages = {}
+    for name, package in result.items():
+        if "error" in package:
+            log.info(
+                f"Failed to evaluate the maintainers of {name}: {package['error']}"
+            )
+            packages[name] = PackageMaintainers([], package["error"])
+            continue
+        packages[name] = PackageMaintainers(
+            [Maintainer(m["githubId"], m["github"]) for m in package["maintainers"]]
+        )
+    return packages
+
+
+def evaluate_maintainers(
+    nixpkgs: Path, names: list[str]
+) -> dict[str, PackageMaintainers]:
+    # the names of a full build do not fit into a command line argument
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as names_file:
+        json.dump(names, names_file)
+        names_file.flush()
+        proc = nix_eval(
+            MAINTAINERS_EXPR,
+            {"nixpkgs": str(nixpkgs.absolute()), "namesFile": names_file.name},
+        )
+    return parse_maintainers(json.loads(proc.decode("utf-8")))
+
+
+def warm_evaluate_maintainers(
+    evaluator: NixEvaluator, nixpkgs: Path, names: list[str]
+) -> dict[str, PackageMaintainers]:
+    """Like evaluate_maintainers, in a repl that keeps `nixpkgs` loaded."""
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as names_file:
+        json.dump(names, names_file)
+        names_file.flush()
+        result = evaluator.eval_json(
+            nixpkgs,
+            "packageMaintainers { inherit pkgs; names = builtins.fromJSON"
+            f" (builtins.readFile {nix_string(names_file.name)}); }}",
+        )
+    return parse_maintainers(result)
+
+
+def evaluate_maintainer_list(nixpkgs: Path) -> MaintainerList:
+    proc = nix_eval(MAINTAINER_LIST_EXPR, {"nixpkgs": str(nixpkgs.absolute())})
+    return {
+        handle: (m["githubId"], m["github"])
+        for handle, m in json.loads(proc.decode("utf-8")).items()
+    }
+
+
+@memoized(lambda settings: settings.repo_path)
+def get_nix_evaluator(settings: Settings) -> NixEvaluator:
+    evaluator = NixEvaluator(
+        {"packageMaintainers": PACKAGE_MAINTAINERS_EXPR},
+        timeout=settings.eval_timeout,
+        max_memory=settings.eval_max_memory_mb * 1024 * 1024,
+    )
+    METRICS.gauge("nix_evaluator", evaluator.stats)
+    return evaluator
+
+
+@memoized(lambda settings: settings.database_file)
+def get_maintainer_index(settings: Settings) -> MaintainerIndex:
+    evaluate_packages = evaluate_maintainers
+    if settings.warm_eval:
+        evaluate_packages = functools.partial(
+            warm_evaluate_maintainers, get_nix_evaluator(settings)
+        )
+    index = MaintainerIndex(
+        get_database(settings),
+        get_repo_manager(settings),
+        evaluate_packages,
+        evaluate_maintainer_list,
+    )
+    METRICS.gauge("maintainer_index", index.stats)
+    return index
+
+
+def get_package_maintainers(
+    settings: Settings, package_names: Iterable[str], ref: str = "master"
+) -> dict[str, PackageMaintainers]:
+    """Maintainers of packages as listed on the branch the pull request targets."""
+    names = set(package_names)
+    if not names:
+        return {}
+    return get_maintainer_index(settings).lookup(ref, names)
 
 
 def is_maintainer(github_id: int, maintainers: list[Maintainer]) -> bool:
@@ -0,0 +1,165 @@
+import logging
+import time
+from collections.abc import Callable
+
+from .database import Database, get_database
+from .github.issue import IssueComment
+from .memoize import memoized
+from .metrics import METRICS
+from .settings import Settings
+
+log = logging.getLogger(__name__)
+
+
+class PendingMerges:
+    """Merge commands waiting for the check runs of a head commit.
+
+    Commands are kept until they are taken for a retry, for at most `ttl`
+    seconds, and are dropped when their pull request is closed or its head
+    moves to another commit.
+    """
+
+    def __init__(
+        self, db: Database, ttl: float, clock: Callable[[], float] = time.time
+    ) -> None:
+        self.ttl = ttl
+        self.clock = clock
+        self.db = db
+        # the primary key also serves lookups by pull request
+        self.db.create(
+            """CREATE TABLE IF NOT EXISTS pending_merges(
+                repo_owner TEXT NOT NULL,
+                repo_name TEXT NOT NULL,
+                pr_number INTEGER NOT NULL,
+                head_sha TEXT NOT NULL,
+                comment_id INTEGER NOT NULL,
+                comment_type TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                commenter_id INTEGER NOT NULL,
+                commenter_login TEXT NOT NULL,
+                text TEXT,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (repo_owner, repo_name, pr_number, comment_id)
+            )""",
+            "CREATE INDEX IF NOT EXISTS pending_merges_head_sha ON pending_merges(head_sha)",
+            "CREATE INDEX IF NOT EXISTS pending_merges_created_at ON pending_merges(created_at)",
+        )
+
+    def add(self, issue_comment: IssueComment, head_sha: str) -> None:
+        with self.db.lock:
+            self.db.con.execute(
+                """INSERT OR REPLACE INTO pending_merges(
+                    repo_owner, repo_name, pr_number, head_sha, comment_id,
+                    comment_type, node_id, commenter_id, commenter_login, text,
+                    title, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    issue_comment.repo_owner,
+                    issue_comment.repo_name,
+                    issue_comment.issue_number,
+                    head_sha,
+                    issue_comment.comment_id,
+                    issue_comment.comment_type,
+                    issue_comment.node_id,
+                    issue_comment.commenter_id,
+                    issue_comment.commenter_login,
+                    issue_comment.text,
+                    issue_comment.title,
+                    self.clock(),
+                ),
+            )
+
+    def has(self, head_sha: str) -> bool:
+        with self.db.lock:
+            return (
+                self.db.con.execute(
+                    "SELECT 1 FROM pending_merges WHERE head_sha = ? LIMIT 1",
+                    (head_sha,),
+                ).fetchone()
+                is not None
+            )
+
+    def take(self, head_sha: str) -> list[IssueComment]:
+        """Remove and return the newest command of each pull request at `head_sha`."""
+        with self.db.lock:
+            self._expire()
+            with self.db.transaction() as con:
+                rows = con.execute(
+                    """SELECT repo_owner, repo_name, pr_number, comment_id,
+                        comment_type, node_id, commenter_id, commenter_login, text,
+                        title
+                    FROM pending_merges WHERE head_sha = ? ORDER BY created_at""",
+                    (head_sha,),
+                ).fetchall()
+                con.execute(
+                    "DELETE FROM pending_merges WHERE head_sha = ?", (head_sha,)
+                )
+        newest: dict[tuple[str, str, int], IssueComment] = {}
+        for (
+            repo_owner,
+            repo_name,
+            pr_number,
+            comment_id,
+            comment_type,
+            node_id,
+            commenter_id,
+            commenter_login,
+            text,
+            title,
+        ) in rows:
+            newest[(repo_owner, repo_name, pr_number)] = IssueComment(
+                commenter_id=commenter_id,
+                commenter_login=commenter_login,
+                text=text,
+                action="created",
+                node_id=node_id,
+                comment_id=comment_id,
+                comment_type=comment_type,
+                repo_owner=repo_owner,
+                repo_name=repo_name,
+                issue_number=pr_number,
+                is_bot=False,
+                title=title,
+                state="open",
+            )
+        return list(newest.values())
+
+    def remove(
+        self,
+        repo_owner: str,
+        repo_name: str,
+        pr_number: int,
+        head_sha: str | None = None,
+    ) -> int:
+        """Drop the commands of a pull request, except those for `head_sha`."""
+        with self.db.lock:
+            return self.db.con.execute(
+                """DELETE FROM pending_merges
+                WHERE repo_owner = ? AND repo_name = ? AND pr_number = ?
+                AND head_sha IS NOT ?""",
+                (repo_owner, repo_name, pr_number, head_sha),
+            ).rowcount
+
+    def _expire(self) -> None:
+        expired = self.db.con.execute(
+            "DELETE FROM pending_merges WHERE created_at < ?",
+            (self.clock() - self.ttl,),
+        ).rowcount
+        if expired:
+            log.info(f"Dropped {expired} expired pending merges")
+
+    def stats(self) -> dict[str, int]:
+        with self.db.lock:
+            return {
+                "pending": self.db.con.execute(
+                    "SELECT COUNT(*) FROM pending_merges"
+                ).fetchone()[0]
+            }
+
+
+@memoized(lambda settings: settings.database_file)
+def get_pending_merges(settings: Settings) -> PendingMerges:
+    pending = PendingMerges(get_database(settings), settings.pending_merge_ttl)
+    METRICS.gauge("pending_merges", pending.stats)
+    return pending
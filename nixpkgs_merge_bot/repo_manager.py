@@ -0,0 +1,194 @@
+import contextlib
+import logging
+import shutil
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .git import fetch
+from .memoize import memoized
+from .metrics import METRICS
+from .settings import Settings
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Worktree:
+    path: Path
+    users: int = 0
+    ready: threading.Event = field(default_factory=threading.Event)
+    error: Exception | None = None
+
+
+class RepoManager:
+    """The nixpkgs clone, fetched at most once per `fetch_interval`.
+
+    Revisions are checked out into detached worktrees next to the clone, one
+    per commit, so commands evaluating different branches do not reset each
+    other's checkout. Worktrees must not be modified; the least recently used
+    ones are removed once there are more than `max_worktrees` that are not in
+    use.
+    """
+
+    def __init__(
+        self,
+        repo_path: Path,
+        fetch_interval: float = 60,
+        max_worktrees: int = 4,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.repo_path = Path(repo_path)
+        self.worktrees_path = self.repo_path.parent / f"{self.repo_path.name}-worktrees"
+        self.fetch_interval = fetch_interval
+        self.max_worktrees = max_worktrees
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._fetched = threading.Condition(self._lock)
+        self._fetching = False
+        self._fetched_at: float | None = None
+        self._worktrees: OrderedDict[str, Worktree] = OrderedDict()
+        self._prune_lock = threading.Lock()
+        self._pruned = False
+        self._serial = 0
+        self.fetches = 0
+        self.created = 0
+        self.evicted = 0
+
+    def fetch(self) -> None:
+        """Fetch unless that happened recently; joins a fetch that is running."""
+        with self._lock:
+            while self._fetching:
+                self._fetched.wait()
+            if (
+                self._fetched_at is not None
+                and self.clock() - self._fetched_at < self.fetch_interval
+            ):
+                return
+            self._fetching = True
+            started = self.clock()
+        fetched = False
+        try:
+            fetch(self.repo_path)
+            fetched = True
+        finally:
+            with self._lock:
+                self._fetching = False
+                if fetched:
+                    self._fetched_at = started
+                    self.fetches += 1
+                self._fetched.notify_all()
+
+    def resolve(self, ref: str) -> str:
+        proc = subprocess.run(
+            ["git", "rev-parse", "--verify", f"refs/remotes/origin/{ref}^{{commit}}"],
+            cwd=self.repo_path,
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        return proc.stdout.decode().strip()
+
+    @contextlib.contextmanager
+    def worktree(self, ref: str) -> Iterator[Path]:
+        """A checkout of the newest commit of branch `ref`."""
+        self.fetch()
+        with self.checkout(self.resolve(ref)) as path:
+            yield path
+
+    @contextlib.contextmanager
+    def checkout(self, sha: str) -> Iterator[Path]:
+        """A checkout of commit `sha`, which must have been fetched."""
+        worktree = self._acquire(sha)
+        try:
+            yield worktree.path
+        finally:
+            self._release(worktree)
+
+    def _acquire(self, sha: str) -> Worktree:
+        with self._lock:
+            worktree = self._worktrees.get(sha)
+            create = worktree is None
+            if worktree is None:
+                # a worktree of the same commit may still be being removed
+                self._serial += 1
+                worktree = Worktree(self.worktrees_path / f"{sha}-{self._serial}")
+                self._worktrees[sha] = worktree
+            self._worktrees.move_to_end(sha)
+            worktree.users += 1
+        if create:
+            try:
+                self._create(worktree.path, sha)
+            except Exception as e:
+                worktree.error = e
+                with self._lock:
+                    self._worktrees.pop(sha, None)
+                raise
+            finally:
+                worktree.ready.set()
+        else:
+            worktree.ready.wait()
+            if worktree.error is not None:
+                with self._lock:
+                    worktree.users -= 1
+                raise worktree.error
+        return worktree
+
+    def _release(self, worktree: Worktree) -> None:
+        with self._lock:
+            worktree.users -= 1
+            unused = [sha for sha, w in self._worktrees.items() if w.users == 0]
+            evict = unused[: max(0, len(unused) - self.max_worktrees)]
+            evicted = [self._worktrees.pop(sha) for sha in evict]
+        for w in evicted:
+            self._remove(w.path)
+
+    def _create(self, path: Path, sha: str) -> None:
+        with self._prune_lock:
+            if not self._pruned:
+                # worktrees of a previous run are not tracked anymore
+                shutil.rmtree(self.worktrees_path, ignore_errors=True)
+                self._git("worktree", "prune")
+                self._pruned = True
+        log.info(f"Checking out {sha} into {path}")
+        self._git("worktree", "add", "--detach", str(path), sha)
+        with self._lock:
+            self.created += 1
+
+    def _remove(self, path: Path) -> None:
+        log.info(f"Removing worktree {path}")
+        try:
+            self._git("worktree", "remove", "--force", str(path))
+        except subprocess.CalledProcessError:
+            log.exception(f"Failed to remove worktree {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            self._git("worktree", "prune")
+        with self._lock:
+            self.evicted += 1
+
+    def _git(self, *args: str) -> None:
+        subprocess.run(["git", *args], cwd=self.repo_path, check=True)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "worktrees": len(self._worktrees),
+                "in_use": sum(1 for w in self._worktrees.values() if w.users),
+                "fetches": self.fetches,
+                "created": self.created,
+                "evicted": self.evicted,
+            }
+
+
+@memoized(lambda settings: Path(settings.repo_path))
+def get_repo_manager(settings: Settings) -> RepoManager:
+    manager = RepoManager(
+        Path(settings.repo_path),
+        fetch_interval=settings.fetch_interval,
+        max_worktrees=settings.max_worktrees,
+    )
+    METRICS.gauge("repo_manager", manager.stats)
+    return manager
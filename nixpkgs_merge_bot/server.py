@@ -1,23 +1,145 @@
 import contextlib
+import functools
 import os
+import queue
+import selectors
+import signal
 import socket
+import time
 
 from .git import clone
+from .github.github_client import get_app_tokens
+from .job_queue import JobExecutor, get_job_queue
+from .metrics import METRICS
 from .settings import Settings
-from .webhook.handler import GithubWebHook
+from .webhook.handler import GithubWebHook, dispatch_event
+from .webhook.secret import get_webhook_secret, reload_webhook_secrets
+from .worker_pool import KeyedDispatcher, get_dispatcher
+
+
+class Listener:
+    """Accepts connections and waits for idle keep-alive connections.
+
+    Requests are handled on the dispatcher's worker pool; a connection only
+    occupies a worker while one of its requests is being processed.
+    """
+
+    def __init__(
+        self,
+        socks: list[socket.socket],
+        dispatcher: KeyedDispatcher,
+        settings: Settings,
+    ) -> None:
+        self.socks = socks
+        self.dispatcher = dispatcher
+        self.pool = dispatcher.pool
+        self.settings = settings
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._parked: queue.SimpleQueue[GithubWebHook] = queue.SimpleQueue()
+        # idle connections and when they time out
+        self._idle: dict[GithubWebHook, float] = {}
+
+    def park(self, handler: GithubWebHook) -> None:
+        """Called from workers when a keep-alive connection becomes idle."""
+        self._parked.put(handler)
+        self._wakeup_send.send(b"\0")
+
+    def accept(self, sock: socket.socket) -> None:
+        # BlockingIOError if another process sharing the socket was faster
+        with contextlib.suppress(OSError):
+            conn, addr = sock.accept()
+            conn.setblocking(True)
+            self.pool.submit(functools.partial(self.open_connection, conn, addr))
+
+    def open_connection(self, conn: socket.socket, addr: tuple[str, int]) -> None:
+        try:
+            GithubWebHook(
+                conn, addr, self.settings, park=self.park, dispatcher=self.dispatcher
+            )
+        except OSError:
+            conn.close()
+
+    @staticmethod
+    def resume(handler: GithubWebHook) -> None:
+        try:
+            handler.handle()
+        except OSError:
+            handler.close()
+
+    def register_parked(self) -> None:
+        self._wakeup_recv.recv(4096)
+        deadline = time.monotonic() + self.settings.keepalive_timeout
+        while not self._parked.empty():
+            handler = self._parked.get()
+            self._idle[handler] = deadline
+            self.selector.register(handler.connection, selectors.EVENT_READ, handler)
+
+    def close_expired(self) -> None:
+        now = time.monotonic()
+        for handler, deadline in list(self._idle.items()):
+            if deadline <= now:
+                del self._idle[handler]
+                self.selector.unregister(handler.connection)
+                handler.close()
+
+    def idle_connections(self) -> int:
+        return len(self._idle)
+
+    def serve_forever(self) -> None:
+        for sock in self.socks:
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, sock)
+        self._wakeup_recv.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+        while True:
+            timeout = None
+            if self._idle:
+                timeout = max(0, min(self._idle.values()) - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    self.register_parked()
+                elif isinstance(key.data, GithubWebHook):
+                    handler = key.data
+                    del self._idle[handler]
+                    self.selector.unregister(handler.connection)
+                    self.pool.submit(functools.partial(self.resume, handler))
+                else:
+                    self.accept(key.data)
+            self.close_expired()
+
+
+def serve(
+    socks: list[socket.socket], dispatcher: KeyedDispatcher, settings: Settings
+) -> None:
+    listener = Listener(socks, dispatcher, settings)
+    METRICS.gauge("idle_connections", listener.idle_connections)
+    listener.serve_forever()
+
+
+def activated_sockets() -> list[socket.socket] | None:
+    """Sockets passed by systemd socket activation, if any."""
+    nfds = os.environ.get("LISTEN_FDS", None)
+    if nfds is None:
+        return None
+    # family and type are detected from the file descriptor
+    return [socket.socket(fileno=fd) for fd in range(3, 3 + int(nfds))]
 
 
 def start_server(settings: Settings) -> None:
     clone(settings.repo, settings.repo_path)
-    nfds = os.environ.get("LISTEN_FDS", None)
-    if nfds is not None:
-        fds = range(3, 3 + int(nfds))
-        for fd in fds:
-            sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
-
-            while True:
-                with contextlib.suppress(OSError):
-                    GithubWebHook(*sock.accept(), settings)
+    get_webhook_secret(settings.webhook_secret)
+    # the first token is minted here rather than by the first webhook
+    get_app_tokens(settings).start_refresher()
+    signal.signal(signal.SIGHUP, lambda _signum, _frame: reload_webhook_secrets())
+    dispatcher = get_dispatcher(settings)
+    if settings.fast_ack:
+        job_queue = get_job_queue(settings)
+        METRICS.gauge("job_queue", job_queue.stats)
+        JobExecutor(job_queue, dispatch_event, settings).start()
+    socks = activated_sockets()
+    if socks is not None:
+        serve(socks, dispatcher, settings)
     else:
         serversocket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
         try:
@@ -25,10 +147,7 @@ def start_server(settings: Settings) -> None:
             serversocket.bind((settings.host, settings.port))
             print(f"listen on {settings.host}:{settings.port}")
             serversocket.listen()
-            while True:
-                with contextlib.suppress(OSError):
-                    conn, addr = serversocket.accept()
-                    GithubWebHook(conn, addr, settings)
+            serve([serversocket], dispatcher, settings)
         finally:
             serversocket.shutdown(socket.SHUT_RDWR)
             serversocket.close()
@@ -16,6 +16,49 @@ class Settings:
     database_path: str = "."
     max_file_size_mb: int = 2
     committer_team_slug: str = "nixpkgs-committers"
+    workers: int = 4
+    keepalive_timeout: float = 60
+    keepalive_max_requests: int = 100
+    # acknowledge deliveries once they are stored in the job queue and process them
+    # in the background; deliveries are refused with 503 while the queue is full
+    fast_ack: bool = False
+    job_queue_size: int = 1000
+    # list the files of pull requests and their sizes from repo_path instead of
+    # asking the GitHub API for each file
+    local_git: bool = False
+    # seconds during which repo_path is not fetched again
+    fetch_interval: float = 60
+    # unused checkouts of other revisions that are kept around
+    max_worktrees: int = 4
+    # evaluate maintainers in a nix repl that keeps nixpkgs loaded, restarted
+    # for every new revision and once it uses more than eval_max_memory_mb
+    warm_eval: bool = False
+    eval_timeout: float = 600
+    eval_max_memory_mb: int = 4096
+    # seconds a merge command waits for pending check runs at most
+    pending_merge_ttl: float = 24 * 60 * 60
+    # pending merges of a commit are retried once no check run completed for
+    # check_run_window seconds, at most check_run_max_delay seconds after the
+    # first; 0 retries on every completed check run
+    check_run_window: float = 30
+    check_run_max_delay: float = 300
+    # seconds the check runs of a commit are remembered
+    check_state_ttl: float = 7 * 24 * 60 * 60
+    # read pull requests, their files, check runs and the author's team
+    # membership with two GraphQL queries instead of a REST call each
+    graphql_snapshot: bool = False
+    # independent GitHub and nix lookups a merge command runs at the same time;
+    # 1 runs them one after the other
+    command_concurrency: int = 4
+    # webhook deliveries whose X-GitHub-Delivery id was seen in the last
+    # delivery_ttl seconds are answered with the earlier response code; the
+    # delivery_cache_size most recent ones are also kept in memory
+    delivery_ttl: float = 3 * 24 * 60 * 60
+    delivery_cache_size: int = 10000
+
+    @property
+    def database_file(self) -> Path:
+        return Path(self.database_path) / "nixpkgs_merge_bot.db"
 
     @property
     def max_file_size_bytes(self) -> int:
@@ -1,18 +1,28 @@
+import dataclasses
+import functools
 import json
 import logging
 from dataclasses import dataclass
 from typing import Any
 
-from nixpkgs_merge_bot.database import Database
-from nixpkgs_merge_bot.github.github_client import get_github_client
+from nixpkgs_merge_bot.check_states import get_check_states
+from nixpkgs_merge_bot.coalescer import Coalescer
 from nixpkgs_merge_bot.github.issue import IssueComment
+from nixpkgs_merge_bot.job_queue import JobQueueFullError, get_job_queue
+from nixpkgs_merge_bot.memoize import memoized
+from nixpkgs_merge_bot.metrics import METRICS
+from nixpkgs_merge_bot.pending_merges import get_pending_merges
 from nixpkgs_merge_bot.settings import Settings
+from nixpkgs_merge_bot.worker_pool import get_dispatcher
 
 from .http_response import HttpResponse
 from .issue_comment import merge_command
 
 log = logging.getLogger(__name__)
 
+# job queue event retrying a merge command, never sent by GitHub
+MERGE_RETRY_EVENT = "merge_retry"
+
 
 @dataclass
 class CheckRun:
@@ -50,31 +60,108 @@ def check_run(body: dict[str, Any], settings: Settings) -> HttpResponse:
     log.debug(
         f"Check Run {check_run.name} with commit id {check_run.head_sha} is in state: {check_run.status} and conclusion: {check_run.conclusion}"
     )
+    get_check_states(settings).record(
+        check_run.repo_owner, check_run.repo_name, check_run.head_sha, body["check_run"]
+    )
     if check_run.status == "completed":
-        db = Database(settings)
         log.debug(
             f"Check Run {check_run.name} with commit id {check_run.head_sha} completed"
         )
-        values = db.get(check_run.head_sha)
-        for value in values:
-            (
-                issue_number_str,
-                commenter_id_str,
-                commenter_login,
-                comment_id_str,
-            ) = value.split(";")
-            issue_number = int(issue_number_str)
-            log.debug(f"{issue_number}: Found pr for commit it {check_run.head_sha}")
-            commenter_id = int(commenter_id_str)
-            comment_id = int(comment_id_str)
-            client = get_github_client(settings)
-            comment = client.get_comment(
-                check_run.repo_owner, check_run.repo_name, comment_id
-            ).json()
-            issue_comment = IssueComment.from_issue_comment_json(comment)
-            issue_comment.comment_id = commenter_id
-            issue_comment.commenter_login = commenter_login
-            log.debug(f"{issue_number} Rerunning merge command for this")
-
-            return merge_command(issue_comment, settings)
+        if not get_pending_merges(settings).has(check_run.head_sha):
+            return check_run_response("success")
+        if settings.check_run_window <= 0:
+            return retry_pending_merges(check_run.head_sha, settings)
+        get_check_run_coalescer(settings).add(check_run.head_sha)
+        return check_run_response("coalesced")
     return check_run_response("success")
+
+
+def retry_pending_merges(head_sha: str, settings: Settings) -> HttpResponse:
+    response = check_run_response("success")
+    # commands that still have to wait are added again by merge_command
+    issue_comments = get_pending_merges(settings).take(head_sha)
+    for i, issue_comment in enumerate(issue_comments):
+        log.debug(
+            f"{issue_comment.issue_number}: Rerunning merge command for commit {head_sha}"
+        )
+        try:
+            response = rerun_merge(issue_comment, head_sha, settings)
+        except Exception:
+            # the failed command was put back, so are the ones not run yet
+            pending = get_pending_merges(settings)
+            for remaining in issue_comments[i + 1 :]:
+                pending.add(remaining, head_sha)
+            raise
+    return response
+
+
+def rerun_merge(
+    issue_comment: IssueComment, head_sha: str, settings: Settings
+) -> HttpResponse:
+    """Run a taken merge command again, it is put back if that fails."""
+    try:
+        return merge_command(issue_comment, settings)
+    except Exception:
+        # the next completed check run of the commit retries it
+        get_pending_merges(settings).add(issue_comment, head_sha)
+        raise
+
+
+def retry_merge(issue_comment: IssueComment, head_sha: str, settings: Settings) -> None:
+    try:
+        resp = rerun_merge(issue_comment, head_sha, settings)
+        log.info(
+            f"{issue_comment.issue_number}: Retried merge finished with {resp.code}: {resp.body!r}"
+        )
+    except Exception:
+        log.exception(f"{issue_comment.issue_number}: Retrying the merge failed")
+
+
+def merge_retry(body: dict[str, Any], settings: Settings) -> HttpResponse:
+    return rerun_merge(
+        IssueComment(**body["issue_comment"]), body["head_sha"], settings
+    )
+
+
+def enqueue_retry(
+    key: str, issue_comment: IssueComment, head_sha: str, settings: Settings
+) -> bool:
+    body = {"issue_comment": dataclasses.asdict(issue_comment), "head_sha": head_sha}
+    try:
+        job_id = get_job_queue(settings).put(
+            MERGE_RETRY_EVENT, key, json.dumps(body).encode("utf-8")
+        )
+    except JobQueueFullError as e:
+        log.warning(f"{issue_comment.issue_number}: Cannot queue the retry: {e}")
+        return False
+    log.debug(f"{issue_comment.issue_number}: Retry was queued as job {job_id}")
+    return True
+
+
+def retry_coalesced(head_sha: str, completions: int, settings: Settings) -> None:
+    """Hands the retries of a commit's pending merges to the webhook workers.
+
+    They are queued behind deliveries for the same pull request: in the job
+    queue when deliveries are acknowledged before processing, else in the
+    webhook dispatcher.
+    """
+    log.info(f"Retrying pending merges of {head_sha} after {completions} check runs")
+    for issue_comment in get_pending_merges(settings).take(head_sha):
+        key = f"{issue_comment.repo_owner}/{issue_comment.repo_name}#{issue_comment.issue_number}"
+        if settings.fast_ack and enqueue_retry(key, issue_comment, head_sha, settings):
+            continue
+        get_dispatcher(settings).submit(
+            key, functools.partial(retry_merge, issue_comment, head_sha, settings)
+        )
+
+
+@memoized(lambda settings: settings.database_file)
+def get_check_run_coalescer(settings: Settings) -> Coalescer:
+    """Gathers the check runs completing for a head commit into one retry."""
+    coalescer = Coalescer(
+        functools.partial(retry_coalesced, settings=settings),
+        settings.check_run_window,
+        settings.check_run_max_delay,
+    )
+    METRICS.gauge("check_run_coalescer", coalescer.stats)
+    return coalescer
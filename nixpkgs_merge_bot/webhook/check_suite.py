@@ -0,0 +1,27 @@
+import logging
+from typing import Any
+
+from nixpkgs_merge_bot.check_states import get_check_states
+from nixpkgs_merge_bot.settings import Settings
+
+from .http_response import HttpResponse
+from .utils.issue_response import issue_response
+
+log = logging.getLogger(__name__)
+
+
+def check_suite(body: dict[str, Any], settings: Settings) -> HttpResponse:
+    suite = body["check_suite"]
+    owner = body["repository"]["owner"]["login"]
+    repo = body["repository"]["name"]
+    states = get_check_states(settings)
+    match body["action"]:
+        case "completed":
+            if not states.suite_completed(owner, repo, suite["head_sha"], suite):
+                return issue_response("check-suite-reseed")
+        case "rerequested":
+            # runs may be restarted without a new start time
+            log.info(f"Check suite {suite['id']} of {suite['head_sha']} rerequested")
+            states.invalidate(owner, repo, suite["head_sha"])
+            return issue_response("check-suite-reseed")
+    return issue_response("check-suite")
@@ -0,0 +1,131 @@
+import logging
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+from nixpkgs_merge_bot.database import Database, get_database
+from nixpkgs_merge_bot.memoize import memoized
+from nixpkgs_merge_bot.metrics import METRICS
+from nixpkgs_merge_bot.settings import Settings
+
+log = logging.getLogger(__name__)
+
+# expired deliveries are removed after this many writes
+PRUNE_INTERVAL = 1000
+# answer to a redelivery of a delivery that is still being processed; not a
+# success, so that it is redelivered again should the original fail
+IN_PROGRESS = 409
+
+
+class Deliveries:
+    """Response codes of webhook deliveries, by X-GitHub-Delivery id.
+
+    The most recent `max_entries` deliveries are kept in memory, all of the
+    last `ttl` seconds in SQLite, so redeliveries are recognized across
+    restarts. Deliveries that failed with a server error are forgotten, so
+    that GitHub's redelivery processes them again.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        ttl: float,
+        max_entries: int,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.db = db
+        # delivery id -> (response code, received at)
+        self._recent: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._in_progress: set[str] = set()
+        self._writes = 0
+        self.duplicates = 0
+        self.db.create(
+            """CREATE TABLE IF NOT EXISTS deliveries(
+                id TEXT PRIMARY KEY,
+                code INTEGER NOT NULL,
+                received_at REAL NOT NULL
+            )""",
+            "CREATE INDEX IF NOT EXISTS deliveries_received_at ON deliveries(received_at)",
+        )
+
+    def claim(self, delivery_id: str) -> int | None:
+        """Response code of an earlier delivery with this id, or None if it is new.
+
+        A new delivery is processed by the caller, which reports its response
+        code with `done`.
+        """
+        with self.db.lock:
+            code = self._lookup(delivery_id)
+            if code is None:
+                self._in_progress.add(delivery_id)
+                return None
+            self.duplicates += 1
+        METRICS.inc("webhook_duplicate_deliveries")
+        log.info(f"Delivery {delivery_id} was received before, answering {code}")
+        return code
+
+    def _lookup(self, delivery_id: str) -> int | None:
+        if delivery_id in self._in_progress:
+            return IN_PROGRESS
+        cutoff = self.clock() - self.ttl
+        entry = self._recent.get(delivery_id)
+        if entry is None:
+            row = self.db.con.execute(
+                "SELECT code, received_at FROM deliveries WHERE id = ?",
+                (delivery_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            entry = row
+            self._remember(delivery_id, entry)
+        self._recent.move_to_end(delivery_id)
+        code, received_at = entry
+        if received_at < cutoff:
+            return None
+        return code
+
+    def _remember(self, delivery_id: str, entry: tuple[int, float]) -> None:
+        self._recent[delivery_id] = entry
+        self._recent.move_to_end(delivery_id)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def done(self, delivery_id: str, code: int) -> None:
+        with self.db.lock:
+            self._in_progress.discard(delivery_id)
+            if code >= 500:
+                return
+            entry = (code, self.clock())
+            self._remember(delivery_id, entry)
+            self.db.con.execute(
+                "INSERT OR REPLACE INTO deliveries(id, code, received_at) VALUES (?, ?, ?)",
+                (delivery_id, *entry),
+            )
+            self._writes += 1
+            if self._writes % PRUNE_INTERVAL == 0:
+                self.db.con.execute(
+                    "DELETE FROM deliveries WHERE received_at < ?",
+                    (self.clock() - self.ttl,),
+                )
+
+    def stats(self) -> dict[str, int]:
+        with self.db.lock:
+            return {
+                "cached": len(self._recent),
+                "in_progress": len(self._in_progress),
+                "duplicates": self.duplicates,
+            }
+
+
+@memoized(lambda settings: settings.database_file)
+def get_deliveries(settings: Settings) -> Deliveries:
+    deliveries = Deliveries(
+        get_database(settings),
+        settings.delivery_ttl,
+        settings.delivery_cache_size,
+    )
+    METRICS.gauge("webhook_deliveries", deliveries.stats)
+    return deliveries
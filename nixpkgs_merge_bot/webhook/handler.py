@@ -1,39 +1,222 @@
+import contextlib
+import functools
+import io
 import json
 import logging
 import socket
+from collections.abc import Callable
 from http.server import BaseHTTPRequestHandler
+from typing import Any
 
+from nixpkgs_merge_bot.job_queue import JobQueueFullError, get_job_queue
+from nixpkgs_merge_bot.metrics import METRICS
 from nixpkgs_merge_bot.settings import Settings
+from nixpkgs_merge_bot.worker_pool import KeyedDispatcher, next_arrival
 
 from . import http_header
-from .check_run import check_run
+from .check_run import MERGE_RETRY_EVENT, check_run, merge_retry
+from .check_suite import check_suite
+from .deliveries import get_deliveries
 from .errors import HttpError
-from .issue_comment import issue_comment, review, review_comment
-from .secret import WebhookSecret
+from .http_response import HttpResponse
+from .issue_comment import (
+    COMMENT_EVENTS,
+    issue_comment,
+    mentions_bot,
+    review,
+    review_comment,
+)
+from .membership import membership, team
+from .pull_request import pull_request
+from .secret import get_webhook_secret
+from .utils.issue_response import issue_response
 
 log = logging.getLogger(__name__)
 
 
+EventHandler = Callable[[dict[str, Any], Settings], HttpResponse]
+
+
+def pull_request_key(event_type: str, payload: dict[str, Any]) -> str | None:
+    """Key under which deliveries concerning the same pull request are serialized."""
+    try:
+        repo = payload["repository"]["full_name"]
+        match event_type:
+            case "issue_comment":
+                return f"{repo}#{payload['issue']['number']}"
+            case "pull_request_review_comment" | "pull_request_review" | "pull_request":
+                return f"{repo}#{payload['pull_request']['number']}"
+            case "check_run" | "check_suite":
+                pull_requests = payload[event_type]["pull_requests"]
+                if pull_requests:
+                    return f"{repo}#{pull_requests[0]['number']}"
+                # check runs of fork pull requests do not reference them
+                return f"{repo}@{payload[event_type]['head_sha']}"
+    except (KeyError, TypeError):
+        log.debug(f"no pull request key for event_type '{event_type}'")
+    return None
+
+
+def event_handler(event_type: str) -> EventHandler | None:
+    match event_type:
+        case "issue_comment":
+            return issue_comment
+        case "check_run":
+            return check_run
+        case "check_suite":
+            return check_suite
+        case "pull_request_review_comment":
+            return review_comment
+        case "pull_request_review":
+            return review
+        case "membership":
+            return membership
+        case "team":
+            return team
+        case "pull_request":
+            return pull_request
+    return None
+
+
+# events that only the job queue carries
+INTERNAL_EVENTS: dict[str, EventHandler] = {MERGE_RETRY_EVENT: merge_retry}
+
+
+def dispatch_event(
+    event_type: str, payload: dict[str, Any], settings: Settings
+) -> HttpResponse:
+    handler = event_handler(event_type) or INTERNAL_EVENTS.get(event_type)
+    if handler is None:
+        raise HttpError(404, f"event_type '{event_type}' not registered")
+    return handler(payload, settings)
+
+
 class GithubWebHook(BaseHTTPRequestHandler):
+    # keep connections open between requests unless the client asks otherwise
+    protocol_version = "HTTP/1.1"
+
     def __init__(
         self,
         conn: socket.socket,
         addr: tuple[str, int],
         settings: Settings,
+        park: Callable[["GithubWebHook"], None] | None = None,
+        dispatcher: KeyedDispatcher | None = None,
     ) -> None:
+        self.connection = conn
+        conn.settimeout(settings.keepalive_timeout)
         self.rfile = conn.makefile("rb")
         self.wfile = conn.makefile("wb")
         self.client_address = addr
-        self.secret = WebhookSecret(settings.webhook_secret)
+        self.secret = get_webhook_secret(settings.webhook_secret)
         self.settings = settings
         self.client_address = (
             "",
             0,
         )  # avoid exception in BaseHTTPServer.py log_message() when using unix sockets
+        self.park = park
+        self.dispatcher = dispatcher
+        self.requests_handled = 0
+        self.response_code = 0
         self.handle()
 
+    def handle(self) -> None:
+        """Serve requests until the connection is closed.
+
+        If a park callback was given, an idle connection is handed to it instead
+        of waiting for the next request; it calls handle() again once the
+        client sent more data.
+
+        With a dispatcher, events concerning a pull request are handed to it
+        once they are parsed, so that deliveries for the same pull request
+        queue there in arrival order instead of each blocking a worker. The
+        response is sent by the dispatched job, which then continues serving
+        the connection.
+        """
+        while True:
+            self.close_connection = True
+            self.arrival = next_arrival()
+            self.detached: tuple[str, Callable[[], None]] | None = None
+            self.after_response: list[Callable[[], None]] = []
+            self.handle_one_request()
+            if self.detached is not None and self.dispatcher is not None:
+                key, job = self.detached
+                self.dispatcher.submit(key, job, self.arrival)
+                return
+            if not self.request_done():
+                return
+
+    def request_done(self) -> bool:
+        """Account for a finished request, True if the next one can be read."""
+        self.requests_handled += 1
+        if self.close_connection:
+            self.close()
+            return False
+        if self.park is not None and not self.has_pending_input():
+            self.park(self)
+            return False
+        return True
+
+    def respond_detached(self, event_type: str, payload: dict[str, Any]) -> None:
+        try:
+            try:
+                self.send_http_response(
+                    dispatch_event(event_type, payload, self.settings)
+                )
+            except HttpError as e:
+                self.send_error(e.code, e.message)
+            except Exception as e:
+                log.exception("internal error")
+                self.send_error(500, explain=f"internal error: {e}")
+            finally:
+                for callback in self.after_response:
+                    callback()
+            self.wfile.flush()
+            if self.request_done():
+                self.handle()
+        except OSError:
+            self.close()
+
+    def has_pending_input(self) -> bool:
+        if not isinstance(self.rfile, io.BufferedReader):
+            return False
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.settings.keepalive_timeout)
+
+    def close(self) -> None:
+        with contextlib.suppress(OSError):
+            self.wfile.flush()
+        self.wfile.close()
+        self.rfile.close()
+        self.connection.close()
+
+    def send_response(self, code: int, message: str | None = None) -> None:
+        self.response_code = code
+        super().send_response(code, message)
+
+    def end_headers(self) -> None:
+        if (
+            not self.close_connection
+            and self.requests_handled + 1 >= self.settings.keepalive_max_requests
+        ):
+            self.send_header("Connection", "close")
+        super().end_headers()
+
     # for testing
     def do_GET(self) -> None:
+        if self.path == "/metrics":
+            body = json.dumps(METRICS.snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-type", "application/json")
+            self.send_header("Content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
         self.send_response(200)
         self.send_header("Content-type", "text/plain")
         self.send_header("Content-length", "2")
@@ -45,27 +228,20 @@ class GithubWebHook(BaseHTTPRequestHandler):
         if not event_type:
             log.error("X-Github-Event header missing")
             return self.send_error(400, explain="X-Github-Event header missing")
-        payload = json.loads(body)
         log.info(f"event_type '{event_type}' was triggered")
-        # TODO case "pull_request_review_comment":
 
-        match event_type:
-            case "issue_comment":
-                handler = issue_comment
-            case "check_run":
-                handler = check_run
-            case "check_suite":
-                # unhandled
-                return None
-            case "pull_request_review_comment":
-                handler = review_comment
-            case "pull_request_review":
-                handler = review
-            case _:
-                log.error(f"event_type '{event_type}' not registered")
-                return self.send_error(
-                    404, explain=f"event_type '{event_type}' not registered"
-                )
+        if event_handler(event_type) is None:
+            log.error(f"event_type '{event_type}' not registered")
+            return self.send_error(
+                404, explain=f"event_type '{event_type}' not registered"
+            )
+
+        if event_type in COMMENT_EVENTS:
+            METRICS.inc("comment_deliveries")
+            if not mentions_bot(body, self.settings):
+                METRICS.inc("comment_deliveries_prefiltered")
+                log.debug(f"'{event_type}' does not mention us, skipping decoding")
+                return self.send_http_response(issue_response("no-command"))
 
         try:
             payload = json.loads(body)
@@ -73,15 +249,49 @@ class GithubWebHook(BaseHTTPRequestHandler):
             log.exception("invalid json")
             return self.send_error(400, explain=f"invalid json: {e}")
 
-        resp = handler(payload, self.settings)
+        if self.settings.fast_ack:
+            return self.send_http_response(
+                self.enqueue_event(event_type, payload, body)
+            )
+
+        key = pull_request_key(event_type, payload)
+        if self.dispatcher is not None and key is not None:
+            self.detached = (
+                key,
+                functools.partial(self.respond_detached, event_type, payload),
+            )
+            return None
+
+        return self.send_http_response(
+            dispatch_event(event_type, payload, self.settings)
+        )
 
+    def enqueue_event(
+        self, event_type: str, payload: dict[str, Any], body: bytes
+    ) -> HttpResponse:
+        try:
+            job_id = get_job_queue(self.settings).put(
+                event_type, pull_request_key(event_type, payload), body
+            )
+        except JobQueueFullError as e:
+            log.warning(f"Refusing '{event_type}' delivery: {e}")
+            return HttpResponse(
+                503,
+                {"Retry-After": "60"},
+                json.dumps({"action": "queue-full"}).encode("utf-8"),
+            )
+        log.debug(f"event_type '{event_type}' was queued as job {job_id}")
+        return HttpResponse(
+            202, {}, json.dumps({"action": "queued", "job": job_id}).encode("utf-8")
+        )
+
+    def send_http_response(self, resp: HttpResponse) -> None:
         self.send_response(resp.code)
         for k, v in resp.headers.items():
             self.send_header(k, v)
         self.send_header("Content-length", str(len(resp.body)))
         self.end_headers()
         self.wfile.write(resp.body)
-        return None
 
     def do_POST(self) -> None:
         content_type = self.headers.get("content-type", "")
@@ -101,7 +311,28 @@ class GithubWebHook(BaseHTTPRequestHandler):
                 log.debug("Invalid Signature")
                 return self.send_error(403, explain="invalid signature")
 
-            self.process_event(body)
+            delivery_id = self.headers.get("X-GitHub-Delivery")
+            if not delivery_id:
+                return self.process_event(body)
+            deliveries = get_deliveries(self.settings)
+            code = deliveries.claim(delivery_id)
+            if code is not None:
+                return self.send_http_response(
+                    HttpResponse(
+                        code, {}, json.dumps({"action": "duplicate"}).encode("utf-8")
+                    )
+                )
+            # deliveries that raise are forgotten, so a redelivery runs them again
+            self.response_code = 500
+            try:
+                self.process_event(body)
+            finally:
+                if self.detached is None:
+                    deliveries.done(delivery_id, self.response_code)
+                else:
+                    self.after_response.append(
+                        lambda: deliveries.done(delivery_id, self.response_code)
+                    )
         except HttpError as e:
             self.send_error(e.code, e.message)
         except Exception as e:
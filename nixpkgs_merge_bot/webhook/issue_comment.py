@@ -11,6 +11,15 @@ from .utils.issue_response import issue_response
 
 log = logging.getLogger(__name__)
 
+COMMENT_EVENTS = ("issue_comment", "pull_request_review_comment", "pull_request_review")
+
+
+def mentions_bot(body: bytes, settings: Settings) -> bool:
+    """Cheap check on the raw delivery whether a command could be in it."""
+    mention = f"@{settings.bot_name}".encode()
+    # JSON encoders may escape the slash in "owner/name"
+    return mention in body or mention.replace(b"/", b"\\/") in body
+
 
 def process_comment(issue: IssueComment, settings: Settings) -> HttpResponse:
     log.debug(issue)
@@ -0,0 +1,45 @@
+import logging
+from typing import Any
+
+from nixpkgs_merge_bot.github.committers import find_team_cache
+from nixpkgs_merge_bot.settings import Settings
+
+from .http_response import HttpResponse
+from .utils.issue_response import issue_response
+
+log = logging.getLogger(__name__)
+
+
+def membership(body: dict[str, Any], settings: Settings) -> HttpResponse:  # noqa: ARG001
+    if body.get("scope") != "team":
+        return issue_response("ignore-membership")
+    org = body["organization"]["login"]
+    team_slug = body["team"]["slug"]
+    cache = find_team_cache(org, team_slug)
+    if cache is None:
+        return issue_response("ignore-membership")
+    member = body["member"]
+    match body["action"]:
+        case "added":
+            log.info(f"{member['login']} was added to {org}/{team_slug}")
+            cache.add(member["login"], member["id"])
+        case "removed":
+            log.info(f"{member['login']} was removed from {org}/{team_slug}")
+            cache.remove(member["login"], member["id"])
+        case _:
+            return issue_response("ignore-membership")
+    return issue_response(f"membership-{body['action']}")
+
+
+def team(body: dict[str, Any], settings: Settings) -> HttpResponse:  # noqa: ARG001
+    # repository access changes do not affect who is a member
+    if body["action"] not in ("deleted", "edited"):
+        return issue_response("ignore-team")
+    org = body["organization"]["login"]
+    team_slug = body["team"]["slug"]
+    cache = find_team_cache(org, team_slug)
+    if cache is None:
+        return issue_response("ignore-team")
+    log.info(f"team {org}/{team_slug} was {body['action']}, reloading its members")
+    cache.invalidate()
+    return issue_response("team-invalidated")
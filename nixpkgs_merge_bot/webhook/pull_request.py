@@ -0,0 +1,30 @@
+import logging
+from typing import Any
+
+from nixpkgs_merge_bot.pending_merges import get_pending_merges
+from nixpkgs_merge_bot.settings import Settings
+
+from .http_response import HttpResponse
+from .utils.issue_response import issue_response
+
+log = logging.getLogger(__name__)
+
+
+def pull_request(body: dict[str, Any], settings: Settings) -> HttpResponse:
+    action = body["action"]
+    number = body["pull_request"]["number"]
+    repo_owner = body["repository"]["owner"]["login"]
+    repo_name = body["repository"]["name"]
+    pending = get_pending_merges(settings)
+    if action == "closed":
+        removed = pending.remove(repo_owner, repo_name, number)
+    elif action == "synchronize":
+        # the command was given for the previous head
+        removed = pending.remove(
+            repo_owner, repo_name, number, body["pull_request"]["head"]["sha"]
+        )
+    else:
+        return issue_response("ignore-action")
+    if removed:
+        log.info(f"{number}: Dropped {removed} pending merges after '{action}'")
+    return issue_response("pending-merges-updated")
@@ -1,41 +1,105 @@
 import hashlib
 import hmac
 import logging
+import threading
+from dataclasses import dataclass
 from email.message import Message
 from pathlib import Path
 
+from nixpkgs_merge_bot.memoize import memoized
+
 from .errors import HttpError
 
 log = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class _Keys:
+    mtime_ns: int
+    # HMAC objects keyed with the secret, copied for every body
+    sha256: "hmac.HMAC"
+    sha1: "hmac.HMAC"
+
+
 class WebhookSecret:
     def __init__(self, secret: Path) -> None:
-        if secret.exists():
-            self.secret = secret.read_text().strip()
-        else:
+        self.path = secret
+        self._lock = threading.Lock()
+        self._keys = self._load()
+
+    def _load(self) -> _Keys:
+        if not self.path.exists():
             raise FileNotFoundError
+        mtime_ns = self.path.stat().st_mtime_ns
+        key = self.path.read_text().strip().encode("utf-8")
+        return _Keys(
+            mtime_ns,
+            hmac.new(key, digestmod=hashlib.sha256),
+            hmac.new(key, digestmod=hashlib.sha1),
+        )
+
+    def reload(self) -> None:
+        keys = self._load()
+        with self._lock:
+            # a single assignment, so concurrent readers see either key
+            self._keys = keys
+        log.info(f"Loaded webhook secret from {self.path}")
+
+    def refresh(self) -> None:
+        """Reload the secret, keeping the current one if that fails."""
+        try:
+            self.reload()
+        except OSError:
+            log.exception(f"Failed to reload webhook secret {self.path}")
+
+    def _current_keys(self) -> _Keys:
+        keys = self._keys
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except OSError:
+            # keep the last key while the file is being replaced
+            return keys
+        if mtime_ns != keys.mtime_ns:
+            self.refresh()
+        return self._keys
 
     def validate_signature(self, body: bytes, headers: Message) -> bool:
-        # Get the signature from the payload
-        signature_header = headers.get("X-Hub-Signature")
+        keys = self._current_keys()
+        # Get the signature from the payload, SHA-256 if GitHub sent it
+        signature_header = headers.get("X-Hub-Signature-256")
+        expected_sha_name = "sha256"
+        template = keys.sha256
         if not signature_header:
-            raise HttpError(401, "X-Hub-Signature header missing")
-        sha_name, github_signature = signature_header.split("=")
-        if sha_name != "sha1":
-            raise HttpError(401, "X-Hub-Signature sha_name is not sha1")
+            signature_header = headers.get("X-Hub-Signature")
+            expected_sha_name = "sha1"
+            template = keys.sha1
+        if not signature_header:
+            raise HttpError(401, "X-Hub-Signature-256 header missing")
+        sha_name, _, github_signature = signature_header.partition("=")
+        if sha_name != expected_sha_name:
+            raise HttpError(401, f"signature sha_name is not {expected_sha_name}")
 
         # Create our own signature
-        local_signature = hmac.new(
-            self.secret.encode("utf-8"),
-            msg=body,
-            digestmod=hashlib.sha1,
-        )
+        local_signature = template.copy()
+        local_signature.update(body)
 
         # See if they match
-        result = hmac.compare_digest(local_signature.hexdigest(), github_signature)
+        result = hmac.compare_digest(
+            local_signature.hexdigest().encode("ascii"),
+            github_signature.encode("utf-8"),
+        )
         if not result:
             log.debug(f"Local signature: {local_signature.hexdigest()}")
             log.debug(f"Github signature: {github_signature}")
 
         return result
+
+
+@memoized(lambda path: path)
+def get_webhook_secret(path: Path) -> WebhookSecret:
+    return WebhookSecret(path)
+
+
+def reload_webhook_secrets() -> None:
+    for secret in get_webhook_secret.values():
+        secret.refresh()
@@ -0,0 +1,137 @@
+import functools
+import heapq
+import itertools
+import logging
+import queue
+import threading
+from collections.abc import Callable, Hashable
+
+from .memoize import memoized
+from .metrics import METRICS
+from .settings import Settings
+
+log = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """A fixed number of threads that run submitted tasks in FIFO order."""
+
+    def __init__(self, workers: int, name: str = "worker") -> None:
+        self.workers = workers
+        self._queue: queue.Queue[Callable[[], None] | None] = queue.Queue()
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, task: Callable[[], None]) -> None:
+        self._queue.put(task)
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            with self._lock:
+                self._busy += 1
+            try:
+                task()
+            except Exception:
+                log.exception("worker task failed")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def shutdown(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            busy = self._busy
+        return {
+            "workers": self.workers,
+            "busy": busy,
+            "queued": self._queue.qsize(),
+        }
+
+
+class KeyedDispatcher:
+    """Hands tasks to a worker pool, one at a time per key.
+
+    Tasks sharing a key wait on the dispatch side instead of on a worker, so
+    a burst of deliveries for one pull request occupies a single worker and
+    other pull requests keep being processed. Waiting tasks run in the order
+    of their `arrival` (see `next_arrival`), or of submission without one.
+    Tasks without a key go to the pool directly.
+    """
+
+    def __init__(self, pool: WorkerPool) -> None:
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._submitted = itertools.count()
+        # keys with a task on the pool, and the tasks waiting behind it
+        self._waiting: dict[Hashable, list[tuple[int, int, Callable[[], None]]]] = {}
+
+    def submit(
+        self,
+        key: Hashable | None,
+        task: Callable[[], None],
+        arrival: int | None = None,
+    ) -> None:
+        if key is None:
+            self.pool.submit(task)
+            return
+        with self._lock:
+            submitted = next(self._submitted)
+            waiting = self._waiting.get(key)
+            if waiting is not None:
+                order = submitted if arrival is None else arrival
+                heapq.heappush(waiting, (order, submitted, task))
+                return
+            self._waiting[key] = []
+        self.pool.submit(functools.partial(self._run, key, task))
+
+    def _run(self, key: Hashable, task: Callable[[], None]) -> None:
+        try:
+            task()
+        finally:
+            next_task: Callable[[], None] | None = None
+            with self._lock:
+                waiting = self._waiting[key]
+                if waiting:
+                    _, _, next_task = heapq.heappop(waiting)
+                else:
+                    del self._waiting[key]
+            if next_task is not None:
+                self.pool.submit(functools.partial(self._run, key, next_task))
+
+    def waiting(self) -> int:
+        """Number of tasks queued behind a running task with the same key."""
+        with self._lock:
+            return sum(len(waiting) for waiting in self._waiting.values())
+
+    def stats(self) -> dict[str, int]:
+        return {**self.pool.stats(), "waiting_for_key": self.waiting()}
+
+
+ARRIVALS = itertools.count()
+
+
+def next_arrival() -> int:
+    """Number ordering requests by when they started being read."""
+    return next(ARRIVALS)
+
+
+@memoized(lambda settings: settings.database_file)
+def get_dispatcher(settings: Settings) -> KeyedDispatcher:
+    """The webhook worker pool, serializing work on the same pull request."""
+    dispatcher = KeyedDispatcher(WorkerPool(settings.workers, name="webhook"))
+    METRICS.gauge("webhook_pool", dispatcher.stats)
+    return dispatcher
@@ -3,3 +3,13 @@ import logging
 pytest_plugins = ["test_server"]
 
 logging.basicConfig(level=logging.DEBUG)
+
+
+class FakeClock:
+    """A clock for the `clock` arguments that only moves when `now` is set."""
+
+    def __init__(self, now: float = 0.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
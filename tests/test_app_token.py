@@ -0,0 +1,174 @@
+import base64
+import shutil
+import subprocess
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import pytest
+from conftest import FakeClock
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+
+from nixpkgs_merge_bot.github.app_token import (
+    AppTokens,
+    base64url,
+    load_private_key,
+    rs256_sign,
+)
+
+TEST_DATA = Path(__file__).parent.joinpath("data")
+KEY = TEST_DATA / "github_app_key.pem"
+
+INSTALLATIONS = [
+    {"id": 1, "app_id": 408064, "account": {"login": "someone-else"}},
+    {"id": 42943463, "app_id": 408064, "account": {"login": "nixpkgs-merge"}},
+]
+
+
+class FakeGithub:
+    def __init__(self, clock: FakeClock) -> None:
+        self.clock = clock
+        self.listed = 0
+        self.issued: list[str] = []
+        self.jwts: list[str] = []
+        self.fail = False
+
+    def list_installations(self, jwt: str) -> list[dict[str, Any]]:
+        self.listed += 1
+        self.jwts.append(jwt)
+        return INSTALLATIONS
+
+    def create_token(self, jwt: str, installation_id: int) -> dict[str, Any]:
+        assert installation_id == 42943463
+        self.jwts.append(jwt)
+        if self.fail:
+            msg = "404 Not Found"
+            raise RuntimeError(msg)
+        self.issued.append(f"token-{len(self.issued) + 1}")
+        expires_at = datetime.fromtimestamp(self.clock.now + 3600, timezone.utc)
+        return {
+            "token": self.issued[-1],
+            "expires_at": expires_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+
+
+def make_tokens() -> tuple[AppTokens, FakeGithub, FakeClock]:
+    clock = FakeClock(1_700_000_000.0)
+    github = FakeGithub(clock)
+    tokens = AppTokens(
+        "nixpkgs-merge",
+        408064,
+        KEY,
+        github.list_installations,
+        github.create_token,
+        refresh_margin=600,
+        clock=clock,
+    )
+    return tokens, github, clock
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="needs openssl")
+def test_signature_matches_openssl() -> None:
+    # PKCS#1 v1.5 signatures are deterministic
+    data = b"header.payload"
+    expected = subprocess.run(
+        ["openssl", "dgst", "-binary", "-sha256", "-sign", KEY],
+        input=data,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    key = load_private_key(KEY.read_bytes())
+    assert rs256_sign(data.decode(), key) == base64url(expected)
+
+
+def test_unsupported_keys_are_rejected() -> None:
+    ec_key = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    with pytest.raises(ValueError, match="not an RSA key"):
+        load_private_key(ec_key)
+    rsa_key = rsa.generate_private_key(65537, 2048)
+    encrypted = rsa_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.BestAvailableEncryption(b"secret"),
+    )
+    with pytest.raises(ValueError, match="encrypted"):
+        load_private_key(encrypted)
+    truncated = KEY.read_bytes()[:300] + b"\n-----END PRIVATE KEY-----\n"
+    with pytest.raises(ValueError):  # noqa: PT011
+        load_private_key(truncated)
+
+
+def test_token_is_reused_until_close_to_expiry() -> None:
+    tokens, github, clock = make_tokens()
+    first = tokens.get()
+    assert first.token == github.issued[0]
+    assert first.installation_id == 42943463
+
+    clock.now += 2900
+    assert tokens.get() is first
+    assert len(github.issued) == 1
+
+    clock.now += 200
+    assert tokens.get().token == github.issued[1]
+    # the installation id is only looked up once
+    assert github.listed == 1
+    # the JWT is signed with the key from the test data
+    header, payload, signature = github.jwts[0].split(".")
+    key = load_private_key(KEY.read_bytes())
+    key.public_key().verify(
+        base64.urlsafe_b64decode(signature + "=" * (-len(signature) % 4)),
+        f"{header}.{payload}".encode(),
+        padding.PKCS1v15(),
+        hashes.SHA256(),
+    )
+
+
+def test_bad_key_fails_token_requests(tmp_path: Path) -> None:
+    key = tmp_path / "dummy.key"
+    key.write_text("key")
+    clock = FakeClock()
+    github = FakeGithub(clock)
+    tokens = AppTokens(
+        "nixpkgs-merge", 408064, key, github.list_installations, github.create_token
+    )
+    with pytest.raises(ValueError):  # noqa: PT011
+        tokens.get()
+    assert github.listed == 0
+
+
+def test_failed_refresh_looks_up_installation_again() -> None:
+    tokens, github, clock = make_tokens()
+    tokens.get()
+    clock.now += 3600
+    github.fail = True
+    with pytest.raises(RuntimeError):
+        tokens.get()
+    github.fail = False
+    assert tokens.get().token == github.issued[1]
+    assert github.listed == 2
+
+
+def test_refresher_renews_token() -> None:
+    tokens, github, _ = make_tokens()
+    minted = threading.Event()
+    create_token = github.create_token
+
+    def create_and_signal(jwt: str, installation_id: int) -> dict[str, Any]:
+        resp = create_token(jwt, installation_id)
+        minted.set()
+        return resp
+
+    tokens.create_token = create_and_signal
+    tokens.start_refresher()
+    try:
+        assert minted.wait(5)
+        assert tokens.get().token == github.issued[0]
+        assert len(github.issued) == 1
+    finally:
+        tokens.stop()
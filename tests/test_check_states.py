@@ -0,0 +1,128 @@
+import dataclasses
+import json
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+from test_webhook import SETTINGS, TEST_DATA
+
+from nixpkgs_merge_bot.check_states import CheckStates, get_check_states
+from nixpkgs_merge_bot.commands.context import CommandContext
+from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.settings import Settings
+from nixpkgs_merge_bot.webhook.check_run import check_run
+from nixpkgs_merge_bot.webhook.check_suite import check_suite
+from nixpkgs_merge_bot.webhook.utils.issue_response import issue_response
+
+
+def run(
+    id_: int, status: str, conclusion: str | None = None, started_at: str = "1"
+) -> dict[str, Any]:
+    return {
+        "id": id_,
+        "name": f"run-{id_}",
+        "status": status,
+        "conclusion": conclusion,
+        "started_at": started_at,
+        "check_suite": {"id": 7},
+        "app": {"id": 15368, "name": "GitHub Actions"},
+    }
+
+
+def states_of(states: CheckStates) -> list[tuple[str, str | None]]:
+    return [
+        (r["status"], r["conclusion"])
+        for r in states.check_runs("NixOS", "nixpkgs", "aaa")
+    ]
+
+
+@pytest.fixture
+def settings(tmp_path: Path) -> Settings:
+    return dataclasses.replace(
+        SETTINGS, database_path=str(tmp_path), check_run_window=0
+    )
+
+
+def test_out_of_order_deliveries(tmp_path: Path) -> None:
+    states = CheckStates(Database(tmp_path / "db"), ttl=60)
+    states.record("NixOS", "nixpkgs", "aaa", run(1, "completed", "success"))
+    states.record("NixOS", "nixpkgs", "aaa", run(1, "in_progress"))
+    assert states_of(states) == [("completed", "success")]
+
+    # started again
+    states.record("NixOS", "nixpkgs", "aaa", run(1, "queued", started_at="2"))
+    assert states_of(states) == [("queued", None)]
+
+
+def test_check_runs_are_seeded_once(settings: Settings) -> None:
+    client = MagicMock()
+    client.iter_check_runs_for_commit.return_value = iter([run(1, "in_progress")])
+
+    context = CommandContext(client, settings)
+    assert [r["status"] for r in context.check_runs("NixOS", "nixpkgs", "aaa")] == [
+        "in_progress"
+    ]
+    body = {
+        "action": "completed",
+        "check_run": {
+            **run(1, "completed", "success"),
+            "head_sha": "aaa",
+            "node_id": "CR_1",
+            "pull_requests": [],
+        },
+        "repository": {"name": "nixpkgs", "owner": {"login": "NixOS"}},
+    }
+    check_run(body, settings)
+
+    context = CommandContext(client, settings)
+    assert list(context.check_runs("NixOS", "nixpkgs", "aaa")) == [
+        {
+            "id": 1,
+            "name": "run-1",
+            "status": "completed",
+            "conclusion": "success",
+            "app": {"id": 15368, "name": "GitHub Actions"},
+        }
+    ]
+    client.iter_check_runs_for_commit.assert_called_once()
+    assert (context.calls, context.saved) == (0, 1)
+
+
+def test_check_suite_with_missed_runs_is_seeded_again(settings: Settings) -> None:
+    states = get_check_states(settings)
+    body = json.loads((TEST_DATA / "check_suite_webhook.json").read_text())
+    suite = body["check_suite"]
+    owner = body["repository"]["owner"]["login"]
+    repo = body["repository"]["name"]
+    states.seed(owner, repo, suite["head_sha"], [])
+
+    # the suite has a run that was never delivered
+    assert check_suite(body, settings) == issue_response("check-suite-reseed")
+    assert not states.seeded(owner, repo, suite["head_sha"])
+
+    states.seed(
+        owner,
+        repo,
+        suite["head_sha"],
+        [run(1, "completed", "success") | {"check_suite": {"id": suite["id"]}}],
+    )
+    assert check_suite(body, settings) == issue_response("check-suite")
+    assert states.seeded(owner, repo, suite["head_sha"])
+
+
+def test_reruns_supersede_failed_attempts(tmp_path: Path) -> None:
+    now = iter(range(100))
+    states = CheckStates(Database(tmp_path / "db"), ttl=60, clock=lambda: next(now))
+    failed = run(1, "completed", "failure")
+    states.seed("NixOS", "nixpkgs", "aaa", [failed])
+    # the job is re-run, which creates a new check run with the same name
+    rerun = {**run(2, "completed", "success", started_at="2"), "name": failed["name"]}
+    states.record("NixOS", "nixpkgs", "aaa", rerun)
+    assert states_of(states) == [("completed", "success")]
+
+    # the listing only has the latest attempt
+    states.invalidate("NixOS", "nixpkgs", "aaa")
+    states.seed("NixOS", "nixpkgs", "aaa", [rerun])
+    assert [r["id"] for r in states.check_runs("NixOS", "nixpkgs", "aaa")] == [2]
+    assert states.stats()["check_runs"] == 1
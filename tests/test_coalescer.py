@@ -0,0 +1,46 @@
+from conftest import FakeClock
+
+from nixpkgs_merge_bot.coalescer import Coalescer
+
+
+def test_bursts_run_once() -> None:
+    clock = FakeClock()
+    runs: list[tuple[str, int]] = []
+    coalescer = Coalescer(
+        lambda key, events: runs.append((key, events)),
+        window=10,
+        max_delay=25,
+        clock=clock,
+    )
+
+    coalescer.add("aaa")
+    clock.now = 5
+    coalescer.add("aaa")
+    coalescer.add("bbb")
+    clock.now = 14
+    assert coalescer.run_due() == 15
+    assert runs == []
+
+    clock.now = 15
+    assert coalescer.run_due() is None
+    assert runs == [("aaa", 2), ("bbb", 1)]
+
+
+def test_max_delay() -> None:
+    clock = FakeClock()
+    runs: list[tuple[str, int]] = []
+    coalescer = Coalescer(
+        lambda key, events: runs.append((key, events)),
+        window=10,
+        max_delay=25,
+        clock=clock,
+    )
+
+    for now in (0, 5, 10, 15, 20):
+        clock.now = now
+        coalescer.add("aaa")
+    # without the cap the burst would end at 30
+    clock.now = 25
+    coalescer.run_due()
+    assert runs == [("aaa", 5)]
+    assert coalescer.stats() == {"waiting": 0, "events": 5, "runs": 1}
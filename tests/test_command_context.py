@@ -0,0 +1,55 @@
+from collections.abc import Iterator
+from typing import Any
+
+from test_webhook import SETTINGS, TEST_DATA, FakeHttpResponse
+
+from nixpkgs_merge_bot.commands.context import CommandContext, SharedIterator
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.metrics import METRICS
+
+
+class CountingClient(GithubClient):
+    def __init__(self) -> None:
+        super().__init__("token")
+        self.calls: list[tuple[Any, ...]] = []
+
+    def pull_request_files(  # type: ignore[override]
+        self, owner: str, repo: str, pr_number: int
+    ) -> FakeHttpResponse:
+        self.calls.append(("files", owner, repo, pr_number))
+        return FakeHttpResponse(TEST_DATA / "pull_request_files.json")
+
+
+def test_reads_are_shared() -> None:
+    client = CountingClient()
+    context = CommandContext(client, SETTINGS)
+
+    first = list(context.pull_request_files("nixpkgs-merge", "nixpkgs", 1))
+    assert list(context.pull_request_files("nixpkgs-merge", "nixpkgs", 1)) == first
+    list(context.pull_request_files("nixpkgs-merge", "nixpkgs", 2))
+
+    assert client.calls == [
+        ("files", "nixpkgs-merge", "nixpkgs", 1),
+        ("files", "nixpkgs-merge", "nixpkgs", 2),
+    ]
+    assert (context.calls, context.saved) == (2, 1)
+
+    saved = METRICS.get("command_github_reads_saved")
+    context.report("1")
+    assert METRICS.get("command_github_reads_saved") == saved + 1
+
+
+def test_shared_iterator_is_lazy() -> None:
+    pulled = []
+
+    def items() -> Iterator[int]:
+        for i in range(3):
+            pulled.append(i)
+            yield i
+
+    shared = SharedIterator(items())
+    assert next(iter(shared)) == 0
+    assert pulled == [0]
+    assert list(shared) == [0, 1, 2]
+    assert list(shared) == [0, 1, 2]
+    assert pulled == [0, 1, 2]
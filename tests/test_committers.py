@@ -0,0 +1,123 @@
+import threading
+from typing import Any
+
+from conftest import FakeClock
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.github.committers import CommitterCache, get_team_cache
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.webhook.membership import membership, team
+
+
+class FakeClient(GithubClient):
+    def __init__(self, members: list[dict[str, Any]]) -> None:
+        super().__init__("token")
+        self.members = members
+        self.active: set[str] = set()
+        self.team_loads = 0
+        self.membership_checks: list[str] = []
+        self.loaded = threading.Event()
+        # cleared to hold team loads back
+        self.release = threading.Event()
+        self.release.set()
+
+    def get_team_members(
+        self,
+        owner: str,  # noqa: ARG002
+        team_slug: str,  # noqa: ARG002
+    ) -> list[dict[str, Any]]:
+        self.release.wait(5)
+        self.team_loads += 1
+        self.loaded.set()
+        return list(self.members)
+
+    def is_team_member(
+        self,
+        owner: str,  # noqa: ARG002
+        team_slug: str,  # noqa: ARG002
+        username: str,
+    ) -> bool:
+        self.membership_checks.append(username)
+        return username in self.active
+
+
+def test_lookup_by_login_and_id() -> None:
+    client = FakeClient([{"login": "Peti", "id": 1}])
+    cache = CommitterCache("NixOS", "nixpkgs-committers")
+
+    assert cache.is_member(client, "peti")
+    assert cache.is_member(client, "renamed", 1)
+    assert client.team_loads == 1
+    assert client.membership_checks == []
+
+
+def test_missing_user_is_checked_once() -> None:
+    clock = FakeClock()
+    client = FakeClient([{"login": "peti", "id": 1}])
+    cache = CommitterCache("NixOS", "nixpkgs-committers", clock=clock)
+
+    assert not cache.is_member(client, "random-user", 2)
+    assert not cache.is_member(client, "random-user", 2)
+    assert client.membership_checks == ["random-user"]
+
+    # added after the team was loaded and we missed the webhook
+    client.active.add("random-user")
+    clock.now += cache.negative_ttl + 1
+    assert cache.is_member(client, "random-user", 2)
+    assert cache.is_member(client, "random-user", 2)
+    assert client.membership_checks == ["random-user", "random-user"]
+
+
+def test_stale_while_revalidate() -> None:
+    clock = FakeClock()
+    client = FakeClient([{"login": "peti", "id": 1}])
+    cache = CommitterCache("NixOS", "nixpkgs-committers", ttl=10, clock=clock)
+    assert cache.is_member(client, "peti")
+
+    client.members = []
+    client.loaded.clear()
+    client.release.clear()
+    clock.now += 11
+    # answered from the old set while the new one loads
+    assert cache.is_member(client, "peti")
+    client.release.set()
+    assert client.loaded.wait(5)
+    for _ in range(100):
+        if cache.stats()["refreshes"] == 2:
+            break
+        threading.Event().wait(0.01)
+    assert not cache.is_member(client, "peti")
+    assert client.team_loads == 2
+
+
+def test_membership_events() -> None:
+    client = FakeClient([{"login": "peti", "id": 1}])
+    cache = get_team_cache("nixpkgs-merge", "test-committers")
+    assert cache.is_member(client, "peti", 1)
+
+    def event(action: str, login: str, user_id: int) -> dict[str, Any]:
+        return {
+            "action": action,
+            "scope": "team",
+            "member": {"login": login, "id": user_id},
+            "team": {"slug": "test-committers"},
+            "organization": {"login": "nixpkgs-merge"},
+        }
+
+    membership(event("removed", "peti", 1), SETTINGS)
+    membership(event("added", "Lassulus", 621759), SETTINGS)
+    assert cache.is_member(client, "lassulus", 621759)
+    assert client.membership_checks == []
+    assert not cache.is_member(client, "peti", 1)
+    assert client.membership_checks == ["peti"]
+
+    team(
+        {
+            "action": "deleted",
+            "team": {"slug": "test-committers"},
+            "organization": {"login": "nixpkgs-merge"},
+        },
+        SETTINGS,
+    )
+    assert cache.is_member(client, "peti", 1)
+    assert client.team_loads == 2
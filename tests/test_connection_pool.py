@@ -0,0 +1,146 @@
+import gzip
+import http.client
+import ssl
+import subprocess
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from nixpkgs_merge_bot.github.connection_pool import ConnectionPool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    posts = 0
+
+    def do_GET(self) -> None:
+        body = b'{"path": "' + self.path.encode() + b'"}'
+        self.send_response(200)
+        if self.path == "/gzip":
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        if self.path == "/close":
+            self.send_header("Connection", "close")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        Handler.posts += 1
+        # acted on the request, but the connection is lost before answering
+        self.close_connection = True
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory: pytest.TempPathFactory) -> tuple[Path, Path]:
+    tmp_path = tmp_path_factory.mktemp("tls")
+    key, cert = tmp_path / "key.pem", tmp_path / "cert.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-keyout",
+            str(key),
+            "-out",
+            str(cert),
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return key, cert
+
+
+@pytest.fixture
+def tls_server(
+    certificate: tuple[Path, Path],
+) -> Iterator[tuple[ThreadingHTTPServer, ssl.SSLContext]]:
+    key, cert = certificate
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert, key)
+    httpd = ThreadingHTTPServer(("localhost", 0), Handler)
+    httpd.socket = server_context.wrap_socket(httpd.socket, server_side=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client_context = ssl.create_default_context(cafile=cert)
+    yield httpd, client_context
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_are_reused(
+    tls_server: tuple[ThreadingHTTPServer, ssl.SSLContext],
+) -> None:
+    httpd, context = tls_server
+    pool = ConnectionPool(
+        "localhost", size=2, port=httpd.server_address[1], ssl_context=context
+    )
+    for i in range(5):
+        resp = pool.request("GET", f"/{i}")
+        assert resp.status == 200
+        assert resp.json() == {"path": f"/{i}"}
+    # the response is buffered, so it can be read again
+    assert resp.json() == {"path": "/4"}
+    assert pool.stats()["connections_created"] == 1
+    assert pool.stats()["requests"] == 5
+
+    resp = pool.request("GET", "/close")
+    assert pool.stats()["idle"] == 0
+    pool.request("GET", "/")
+    assert pool.stats()["connections_created"] == 2
+
+
+def test_gzip(tls_server: tuple[ThreadingHTTPServer, ssl.SSLContext]) -> None:
+    httpd, context = tls_server
+    pool = ConnectionPool(
+        "localhost", port=httpd.server_address[1], ssl_context=context
+    )
+    resp = pool.request("GET", "/gzip", headers={"Accept-Encoding": "gzip"})
+    assert resp.json() == {"path": "/gzip"}
+
+
+def test_stale_connection_is_retried(
+    tls_server: tuple[ThreadingHTTPServer, ssl.SSLContext],
+) -> None:
+    httpd, context = tls_server
+    pool = ConnectionPool(
+        "localhost", port=httpd.server_address[1], ssl_context=context
+    )
+    pool.request("GET", "/")
+    # simulate the server dropping the idle connection
+    idle = pool._idle[0]  # noqa: SLF001
+    assert idle.sock is not None
+    idle.sock.shutdown(2)
+    resp = pool.request("GET", "/again")
+    assert resp.json() == {"path": "/again"}
+    assert pool.stats()["connections_created"] == 2
+
+
+def test_lost_post_response_is_not_retried(
+    tls_server: tuple[ThreadingHTTPServer, ssl.SSLContext],
+) -> None:
+    httpd, context = tls_server
+    pool = ConnectionPool(
+        "localhost", port=httpd.server_address[1], ssl_context=context
+    )
+    pool.request("GET", "/")
+    posts = Handler.posts
+    with pytest.raises(http.client.RemoteDisconnected):
+        pool.request("POST", "/merge", body=b"{}")
+    assert Handler.posts == posts + 1
+    assert pool.stats()["connections_created"] == 1
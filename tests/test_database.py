@@ -0,0 +1,46 @@
+import dataclasses
+from pathlib import Path
+
+import pytest
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.database import Database, get_database
+from nixpkgs_merge_bot.job_queue import get_job_queue
+from nixpkgs_merge_bot.memoize import memoized
+from nixpkgs_merge_bot.pending_merges import get_pending_merges
+
+
+def test_stores_share_one_connection(tmp_path: Path) -> None:
+    settings = dataclasses.replace(SETTINGS, database_path=str(tmp_path))
+    db = get_database(settings)
+    assert get_job_queue(settings).db is db
+    assert get_pending_merges(settings).db is db
+    assert get_database(dataclasses.replace(settings)) is db
+
+
+def test_failed_transaction_is_rolled_back(tmp_path: Path) -> None:
+    db = Database(tmp_path / "db")
+    db.create("CREATE TABLE t(x INTEGER)")
+
+    def insert() -> None:
+        with db.transaction() as con:
+            con.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        insert()
+    assert db.con.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+
+
+def test_memoized_per_key() -> None:
+    created: list[str] = []
+
+    @memoized(lambda name: name.lower())
+    def get_thing(name: str) -> list[str]:
+        created.append(name)
+        return [name]
+
+    assert get_thing("A") is get_thing("a")
+    assert get_thing.find("b") is None
+    assert get_thing("b") == ["b"]
+    assert created == ["A", "b"]
@@ -0,0 +1,91 @@
+import json
+import uuid
+from pathlib import Path
+
+from conftest import FakeClock
+from pytest_mock import MockerFixture
+from test_server import WebhookTestServer
+from test_webhook import SETTINGS, TEST_DATA
+
+from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.metrics import METRICS
+from nixpkgs_merge_bot.webhook.deliveries import IN_PROGRESS, Deliveries
+from nixpkgs_merge_bot.webhook.handler import GithubWebHook
+
+
+def test_duplicates_are_answered_with_the_earlier_code(tmp_path: Path) -> None:
+    clock = FakeClock()
+    deliveries = Deliveries(
+        Database(tmp_path / "db"), ttl=100, max_entries=10, clock=clock
+    )
+    assert deliveries.claim("a") is None
+    # redelivered while it is still processed
+    assert deliveries.claim("a") == IN_PROGRESS
+    deliveries.done("a", 200)
+    assert deliveries.claim("a") == 200
+    assert deliveries.stats()["duplicates"] == 2
+
+    clock.now = 101
+    assert deliveries.claim("a") is None
+
+
+def test_server_errors_are_forgotten(tmp_path: Path) -> None:
+    deliveries = Deliveries(Database(tmp_path / "db"), ttl=100, max_entries=10)
+    assert deliveries.claim("a") is None
+    deliveries.done("a", 500)
+    assert deliveries.claim("a") is None
+
+
+def test_redelivery_during_a_failing_delivery_is_not_lost(tmp_path: Path) -> None:
+    deliveries = Deliveries(Database(tmp_path / "db"), ttl=100, max_entries=10)
+    assert deliveries.claim("a") is None
+    # GitHub must not count the redelivery as delivered
+    assert deliveries.claim("a") == IN_PROGRESS
+    assert IN_PROGRESS >= 400
+    deliveries.done("a", 500)
+    # so it redelivers again, which is processed
+    assert deliveries.claim("a") is None
+
+
+def test_evicted_deliveries_are_read_from_the_database(tmp_path: Path) -> None:
+    deliveries = Deliveries(Database(tmp_path / "db"), ttl=100, max_entries=2)
+    for i in range(3):
+        assert deliveries.claim(str(i)) is None
+        deliveries.done(str(i), 202)
+    assert deliveries.stats()["cached"] == 2
+    assert deliveries.claim("0") == 202
+
+    # and survive restarts
+    restarted = Deliveries(Database(tmp_path / "db"), ttl=100, max_entries=2)
+    assert restarted.claim("1") == 202
+
+
+def test_redelivery_is_not_processed_again(
+    server: WebhookTestServer, mocker: MockerFixture
+) -> None:
+    process_event = mocker.spy(GithubWebHook, "process_event")
+    duplicates = METRICS.get("webhook_duplicate_deliveries")
+    server.start_handler(GithubWebHook, SETTINGS)
+
+    client = server.get_client()
+    create_event = (TEST_DATA / "issue_comment.no-merge.json").read_bytes()
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": "issue_comment",
+        "X-GitHub-Delivery": str(uuid.uuid4()),
+        "X-Hub-Signature-256": "sha256=286913f698705a38a157eb947acf716a32879c0eb8adf3a8e0155f2a6eb51960",
+    }
+    responses = []
+    for _ in range(2):
+        client.request("POST", "/", body=create_event, headers=headers)
+        response = client.getresponse()
+        responses.append((response.status, json.loads(response.read())))
+
+    server.wait_for_handler()
+
+    assert responses == [
+        (200, {"action": "no-command"}),
+        (200, {"action": "duplicate"}),
+    ]
+    assert process_event.call_count == 1
+    assert METRICS.get("webhook_duplicate_deliveries") == duplicates + 1
@@ -0,0 +1,157 @@
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from nixpkgs_merge_bot.nix.evaluator import NixEvalError, NixEvaluator, nix_string
+from nixpkgs_merge_bot.nix.nix_utils import (
+    PACKAGE_MAINTAINERS_EXPR,
+    Maintainer,
+    PackageMaintainers,
+    evaluate_maintainers,
+    warm_evaluate_maintainers,
+)
+
+# answers like nix repl: bindings print nothing, values are printed after a
+# prompt and strings are quoted
+FAKE_REPL = r"""
+import json, re, sys, time
+nixpkgs = None
+for line in sys.stdin:
+    line = line.strip()
+    sys.stdout.write("nix-repl> ")
+    if m := re.match(r'pkgs = import \(/\. \+ "(.*)"\) \{ \}', line):
+        nixpkgs = m.group(1)
+    elif line.startswith('"'):
+        print(line)
+    elif "sleep" in line:
+        time.sleep(10)
+    elif "throw" in line:
+        print("error: boom", file=sys.stderr)
+    elif line.startswith("builtins.toJSON"):
+        value = json.dumps({"nixpkgs": nixpkgs, "quote": 'a"b\\c${'})
+        print(json.dumps(value).replace("${", "\\${"))
+    sys.stdout.flush()
+"""
+
+
+# a nixpkgs with just enough packages to exercise the maintainer queries
+NIXPKGS = """
+{ }:
+{
+  hello.meta.maintainers = [ { github = "Mic92"; githubId = 96200; } ];
+  not-a-list.meta.maintainers = "mic92";
+  broken.meta.maintainers = throw "broken";
+}
+"""
+
+
+@pytest.fixture
+def fake_repl(tmp_path: Path) -> list[str]:
+    script = tmp_path / "repl.py"
+    script.write_text(FAKE_REPL)
+    return [sys.executable, str(script)]
+
+
+@pytest.fixture
+def evaluator(fake_repl: list[str]) -> Iterator[NixEvaluator]:
+    evaluator = NixEvaluator({"f": "x: x"}, timeout=5, command=fake_repl)
+    yield evaluator
+    evaluator.close()
+
+
+def test_nixpkgs_stays_loaded(evaluator: NixEvaluator) -> None:
+    result = evaluator.eval_json(Path("/a"), "f pkgs")
+    assert result == {"nixpkgs": "/a", "quote": 'a"b\\c${'}
+    assert evaluator.eval_json(Path("/a"), "f pkgs")["nixpkgs"] == "/a"
+    assert evaluator.stats()["starts"] == 1
+
+    # another revision is loaded into a new repl
+    assert evaluator.eval_json(Path("/b"), "f pkgs")["nixpkgs"] == "/b"
+    assert evaluator.stats()["starts"] == 2
+    assert evaluator.stats()["queries"] == 3
+
+
+def test_errors(evaluator: NixEvaluator) -> None:
+    with pytest.raises(NixEvalError, match="boom"):
+        evaluator.eval_json(Path("/a"), 'throw "boom"')
+    assert evaluator.eval_json(Path("/a"), "f pkgs")["nixpkgs"] == "/a"
+    assert evaluator.stats()["starts"] == 1
+
+
+def test_timeout_restarts_the_repl(evaluator: NixEvaluator) -> None:
+    evaluator.timeout = 0.5
+    with pytest.raises(subprocess.TimeoutExpired):
+        evaluator.eval_json(Path("/a"), "sleep")
+    evaluator.timeout = 5
+    assert evaluator.eval_json(Path("/a"), "f pkgs")["nixpkgs"] == "/a"
+    assert evaluator.stats()["timeouts"] == 1
+    assert evaluator.stats()["starts"] == 2
+
+
+def test_stats_do_not_wait_for_a_query(evaluator: NixEvaluator) -> None:
+    evaluator.timeout = 1
+
+    def slow_query() -> None:
+        with pytest.raises(subprocess.TimeoutExpired):
+            evaluator.eval_json(Path("/a"), "sleep")
+
+    query = threading.Thread(target=slow_query)
+    query.start()
+    for _ in range(50):
+        if evaluator.stats()["starts"]:
+            break
+        time.sleep(0.01)
+    started = time.monotonic()
+    assert evaluator.stats()["nixpkgs"] == "/a"
+    assert time.monotonic() - started < 0.5
+    query.join(5)
+    assert evaluator.stats()["timeouts"] == 1
+
+
+@pytest.mark.skipif(not Path("/proc/self/status").exists(), reason="needs /proc")
+def test_memory_limit_restarts_the_repl(evaluator: NixEvaluator) -> None:
+    evaluator.max_memory = 0
+    evaluator.eval_json(Path("/a"), "f pkgs")
+    evaluator.eval_json(Path("/a"), "f pkgs")
+    assert evaluator.stats()["memory_restarts"] == 2
+    assert evaluator.stats()["starts"] == 2
+
+
+def test_nix_string() -> None:
+    assert nix_string('a"${b}') == '"a\\"\\${b}"'
+
+
+@pytest.mark.skipif(shutil.which("nix") is None, reason="needs nix")
+def test_real_nix_repl(tmp_path: Path) -> None:
+    nixpkgs = tmp_path / "nixpkgs"
+    nixpkgs.mkdir()
+    (nixpkgs / "default.nix").write_text(NIXPKGS)
+    names = ["broken", "hello", "missing", "not-a-list"]
+    evaluator = NixEvaluator(
+        {"packageMaintainers": PACKAGE_MAINTAINERS_EXPR}, timeout=60
+    )
+    try:
+        # the warm repl answers like a cold nix-instantiate
+        expected = evaluate_maintainers(nixpkgs, names)
+        assert expected == {
+            "broken": PackageMaintainers([], "evaluation failed"),
+            "hello": PackageMaintainers([Maintainer(96200, "Mic92")]),
+            "missing": PackageMaintainers([], "attribute does not exist"),
+            "not-a-list": PackageMaintainers([]),
+        }
+        assert warm_evaluate_maintainers(evaluator, nixpkgs, names) == expected
+
+        # errors are recognized in the repl output and it keeps running
+        with pytest.raises(NixEvalError, match="boom"):
+            evaluator.eval_json(nixpkgs, 'throw "boom"')
+        assert evaluator.eval_json(nixpkgs, '"a\\"b\\n${"c"}"') == 'a"b\nc'
+        assert evaluator.stats()["starts"] == 1
+        assert evaluator.stats()["queries"] == 3
+    finally:
+        evaluator.close()
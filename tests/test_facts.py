@@ -0,0 +1,159 @@
+import dataclasses
+from collections import Counter
+from collections.abc import Iterable
+from typing import Any
+
+import pytest
+from test_pending_merges import comment
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.commands.context import CommandContext
+from nixpkgs_merge_bot.commands.facts import Facts
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.github.pull_request import PullRequest
+from nixpkgs_merge_bot.merging_strategies.committer_pr import CommitterPR
+from nixpkgs_merge_bot.merging_strategies.maintainer_update import MaintainerUpdate
+from nixpkgs_merge_bot.merging_strategies.merging_strategy import (
+    MergingStrategyTemplate,
+)
+from nixpkgs_merge_bot.nix.maintainer_index import Maintainer, PackageMaintainers
+
+FILES = [
+    {"filename": "pkgs/by-name/ni/nixos-anywhere/package.nix", "size": 100},
+    {"filename": "pkgs/by-name/ni/nixos-anywhere/src.json", "size": 100},
+]
+
+
+class CountingContext(CommandContext):
+    def __init__(self, command_concurrency: int = 1) -> None:
+        super().__init__(
+            GithubClient("token"),
+            dataclasses.replace(SETTINGS, command_concurrency=command_concurrency),
+        )
+        self.counts: Counter[str] = Counter()
+
+    def check_runs(self, owner: str, repo: str, ref: str) -> list[dict[str, Any]]:  # noqa: ARG002
+        self.counts["check_runs"] += 1
+        return []
+
+    def changed_files(self, pull_request: PullRequest) -> Iterable[dict[str, Any]]:  # noqa: ARG002
+        self.counts["changed_files"] += 1
+        return FILES
+
+    def file_size(self, pull_request: PullRequest, file: dict[str, Any]) -> int:  # noqa: ARG002
+        self.counts["file_size"] += 1
+        return file["size"]
+
+    def package_maintainers(
+        self,
+        pull_request: PullRequest,  # noqa: ARG002
+    ) -> dict[str, PackageMaintainers]:
+        self.counts["package_maintainers"] += 1
+        return {"nixos-anywhere": PackageMaintainers([Maintainer(96200, "Mic92")])}
+
+    def is_team_member(
+        self,
+        org: str,  # noqa: ARG002
+        team_slug: str,  # noqa: ARG002
+        login: str,  # noqa: ARG002
+        user_id: int,  # noqa: ARG002
+    ) -> bool:
+        self.counts["is_team_member"] += 1
+        return True
+
+
+def pull_request(user_login: str) -> PullRequest:
+    return PullRequest(
+        user_id=1,
+        user_login=user_login,
+        text="",
+        repo_owner="NixOS",
+        repo_name="nixpkgs",
+        number=1,
+        node_id="PR_1",
+        title="nixos-anywhere: 1.0.0 -> 1.1.0",
+        state="open",
+        head_sha="deadbeef",
+        ref="master",
+    )
+
+
+def test_strategies_share_facts() -> None:
+    context = CountingContext()
+    pr = pull_request("Mic92")
+    issue_comment = comment(1, 1)
+    facts = Facts(context, pr, issue_comment)
+
+    assert MaintainerUpdate(facts, SETTINGS).run(pr, issue_comment)[0] is False
+    assert CommitterPR(facts, SETTINGS).run(pr, issue_comment) == (True, [])
+
+    assert context.counts == {
+        "changed_files": 1,
+        "file_size": 2,
+        "package_maintainers": 1,
+        "is_team_member": 1,
+    }
+    assert facts.computed == [
+        "technical_limits",
+        "target_branch_allowed",
+        "files",
+        "author_is_committer",
+        "unmaintained_files",
+        "package_maintainers",
+    ]
+
+
+def test_facts_are_prefetched() -> None:
+    context = CountingContext(command_concurrency=4)
+    pr = pull_request("Mic92")
+    issue_comment = comment(1, 1)
+    facts = Facts(context, pr, issue_comment)
+    try:
+        assert CommitterPR(facts, SETTINGS).run(pr, issue_comment) == (True, [])
+        assert facts.check_runs == []
+    finally:
+        context.close()
+
+    assert context.counts == {
+        "changed_files": 1,
+        "file_size": 2,
+        "package_maintainers": 1,
+        "is_team_member": 1,
+        "check_runs": 1,
+    }
+
+
+def test_unmaintained_files() -> None:
+    context = CountingContext()
+    pr = pull_request("r-ryantm")
+    issue_comment = comment(1, 1)
+    issue_comment.commenter_id = 2
+    facts = Facts(context, pr, issue_comment)
+
+    result, reasons = MaintainerUpdate(facts, SETTINGS).run(pr, issue_comment)
+    assert result is False
+    assert len(reasons) == len(FILES)
+    assert [filename for filename, _ in facts.unmaintained_files] == [
+        file["filename"] for file in FILES
+    ]
+
+
+def test_unknown_facts_are_rejected() -> None:
+    with pytest.raises(TypeError, match="maintainer_count"):
+
+        class Broken(MergingStrategyTemplate):
+            needs = ("technical_limits", "maintainer_count")
+
+
+def test_nothing_is_prefetched_for_other_authors() -> None:
+    context = CountingContext(command_concurrency=4)
+    pr = pull_request("Mic92")
+    issue_comment = comment(1, 1)
+    facts = Facts(context, pr, issue_comment)
+    try:
+        assert MaintainerUpdate(facts, SETTINGS).run(pr, issue_comment)[0] is False
+    finally:
+        context.close()
+
+    # only the technical limits were needed to decline
+    assert context.counts == {"changed_files": 1, "file_size": 2}
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from nixpkgs_merge_bot.fan_out import FanOut
+
+
+def test_map_runs_concurrently_up_to_the_limit() -> None:
+    fan_out = FanOut(3)
+    lock = threading.Lock()
+    running = 0
+    most = 0
+
+    def lookup(i: int) -> int:
+        nonlocal running, most
+        with lock:
+            running += 1
+            most = max(most, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return i * i
+
+    try:
+        assert fan_out.map(lookup, range(8)) == [i * i for i in range(8)]
+    finally:
+        fan_out.shutdown()
+    # the calling thread helps the workers
+    assert 1 < most <= 4
+
+
+def test_first_error_in_order_is_raised() -> None:
+    fan_out = FanOut(4)
+
+    def lookup(i: int) -> int:
+        # the later error happens first
+        time.sleep(0.05 if i == 1 else 0)
+        if i in (1, 3):
+            msg = f"lookup {i} failed"
+            raise ValueError(msg)
+        return i
+
+    try:
+        with pytest.raises(ValueError, match="lookup 1 failed"):
+            fan_out.map(lookup, range(5))
+    finally:
+        fan_out.shutdown()
+
+
+def test_nested_fan_out_does_not_deadlock() -> None:
+    fan_out = FanOut(2)
+
+    def outer(i: int) -> list[int]:
+        return fan_out.map(lambda j: i * 10 + j, range(3))
+
+    try:
+        assert fan_out.map(outer, range(4)) == [
+            [i * 10 + j for j in range(3)] for i in range(4)
+        ]
+    finally:
+        fan_out.shutdown()
+
+
+def test_limit_of_one_runs_in_caller() -> None:
+    fan_out = FanOut(1)
+    threads = fan_out.map(lambda _: threading.current_thread(), range(3))
+    assert threads == [threading.current_thread()] * 3
+
+
+def test_shutdown_waits_for_running_lookups() -> None:
+    fan_out = FanOut(2)
+    started = threading.Event()
+    finished: list[int] = []
+
+    def lookup(i: int) -> None:
+        started.set()
+        time.sleep(0.1)
+        finished.append(i)
+
+    fan_out.submit(lambda: lookup(0))
+    assert started.wait(5)
+    fan_out.shutdown()
+    assert finished == [0]
+    # lookups submitted after the shutdown run in the waiting caller
+    task = fan_out.submit(lambda: lookup(1))
+    assert finished == [0]
+    task.wait()
+    assert finished == [0, 1]
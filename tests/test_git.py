@@ -0,0 +1,128 @@
+import dataclasses
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock import MockerFixture
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.commands.context import CommandContext
+from nixpkgs_merge_bot.git import BlobSizes, changed_files, fetch_pull_request
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.github.pull_request import PullRequest
+
+
+def git(folder: Path, *args: str) -> str:
+    proc = subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=folder,
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return proc.stdout.decode().strip()
+
+
+def make_pull_request(head_sha: str) -> PullRequest:
+    return PullRequest(
+        user_id=1,
+        user_login="test",
+        text="",
+        repo_owner="NixOS",
+        repo_name="nixpkgs",
+        number=1,
+        node_id="",
+        title="hello: update",
+        state="open",
+        head_sha=head_sha,
+        ref="master",
+    )
+
+
+@pytest.fixture
+def repos(tmp_path: Path) -> tuple[Path, Path, str]:
+    """A remote with a pull request, a clone of it and the head of the pull request."""
+    origin = tmp_path / "origin"
+    origin.mkdir()
+    git(origin, "init", "-q", "-b", "master")
+    package = origin / "pkgs/by-name/he/hello"
+    package.mkdir(parents=True)
+    (package / "package.nix").write_text("{ }\n")
+    (origin / "README.md").write_text("readme\n")
+    git(origin, "add", ".")
+    git(origin, "commit", "-q", "-m", "init")
+
+    clone = tmp_path / "clone"
+    git(tmp_path, "clone", "-q", str(origin), str(clone))
+
+    git(origin, "checkout", "-q", "-b", "pr")
+    (package / "package.nix").write_text("{ version = 2; }\n")
+    git(origin, "mv", "README.md", "README")
+    (package / "big.bin").write_bytes(b"x" * 4096)
+    git(origin, "add", ".")
+    git(origin, "commit", "-q", "-m", "update hello")
+    head = git(origin, "rev-parse", "HEAD")
+    git(origin, "update-ref", "refs/pull/1/head", head)
+    git(origin, "checkout", "-q", "master")
+    # master moved on after the pull request branched off
+    (origin / "other").write_text("other\n")
+    git(origin, "add", ".")
+    git(origin, "commit", "-q", "-m", "other")
+    return origin, clone, head
+
+
+def test_changed_files(repos: tuple[Path, Path, str]) -> None:
+    _, clone, head = repos
+    fetch_pull_request(clone, 1, "master")
+
+    files = changed_files(clone, "refs/remotes/origin/master", head)
+
+    assert sorted(files, key=lambda f: f["filename"]) == [
+        {"filename": "README", "previous_filename": "README.md", "status": "renamed"},
+        {"filename": "pkgs/by-name/he/hello/big.bin", "status": "added"},
+        {"filename": "pkgs/by-name/he/hello/package.nix", "status": "modified"},
+    ]
+
+
+def test_blob_sizes(repos: tuple[Path, Path, str]) -> None:
+    _, clone, head = repos
+    fetch_pull_request(clone, 1, "master")
+    blob_sizes = BlobSizes(clone)
+    try:
+        assert blob_sizes.size(head, "pkgs/by-name/he/hello/big.bin") == 4096
+        assert blob_sizes.size(head, "pkgs/by-name/he/hello/package.nix") == 17
+        assert blob_sizes.size(head, "README.md") is None
+    finally:
+        blob_sizes.close()
+
+
+def test_context_uses_local_clone(
+    repos: tuple[Path, Path, str], mocker: MockerFixture
+) -> None:
+    _, clone, head = repos
+    settings = dataclasses.replace(SETTINGS, repo_path=clone, local_git=True)
+    pull_request_files = mocker.patch.object(GithubClient, "pull_request_files")
+    file_content = mocker.patch.object(GithubClient, "get_request_file_content")
+    pull_request = make_pull_request(head)
+    context = CommandContext(GithubClient("token"), settings)
+
+    sizes = {
+        file["filename"]: context.file_size(pull_request, file)
+        for file in context.changed_files(pull_request)
+    }
+
+    assert sizes["pkgs/by-name/he/hello/big.bin"] == 4096
+    pull_request_files.assert_not_called()
+    file_content.assert_not_called()
+
+
+def test_context_falls_back_to_github(tmp_path: Path, mocker: MockerFixture) -> None:
+    settings = dataclasses.replace(SETTINGS, repo_path=tmp_path, local_git=True)
+    pull_request_files = mocker.patch.object(GithubClient, "pull_request_files")
+    pull_request_files.return_value.json.return_value = []
+    pull_request_files.return_value.headers.return_value = {}
+    pull_request = make_pull_request("0" * 40)
+    context = CommandContext(GithubClient("token"), settings)
+
+    # not a git repository
+    assert list(context.changed_files(pull_request)) == []
+    pull_request_files.assert_called_once()
@@ -0,0 +1,155 @@
+import http.client
+import json
+from typing import Any
+
+from nixpkgs_merge_bot.github.connection_pool import ConnectionPool
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.github.http_response import HttpResponse
+from nixpkgs_merge_bot.github.response_cache import ResponseCache
+
+RATE_LIMIT_HEADERS = {
+    "x-ratelimit-limit": "5000",
+    "x-ratelimit-remaining": "4999",
+    "x-ratelimit-used": "1",
+    "x-ratelimit-reset": "0",
+}
+
+
+def make_response(
+    status: int, headers: dict[str, str], body: Any = None
+) -> HttpResponse:
+    message = http.client.HTTPMessage()
+    for k, v in {**RATE_LIMIT_HEADERS, **headers}.items():
+        message[k] = v
+    data = b"" if body is None else json.dumps(body).encode()
+    return HttpResponse(status, "", message, data)
+
+
+class FakePool(ConnectionPool):
+    def __init__(self, responses: list[HttpResponse]) -> None:
+        super().__init__("api.github.com")
+        self.responses = responses
+        self.requests: list[tuple[str, str, dict[str, str]]] = []
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,  # noqa: ARG002
+        headers: dict[str, str] | None = None,
+    ) -> HttpResponse:
+        self.requests.append((method, path, headers or {}))
+        return self.responses.pop(0)
+
+
+def test_conditional_get() -> None:
+    pool = FakePool(
+        [
+            make_response(200, {"ETag": '"abc"'}, {"number": 1}),
+            make_response(304, {}),
+            make_response(200, {"ETag": '"def"'}, {"number": 2}),
+        ]
+    )
+    cache = ResponseCache(1024)
+    client = GithubClient("token", pool=pool, installation_id=1, cache=cache)
+
+    assert client.get("/repos/NixOS/nixpkgs/pulls/1").json() == {"number": 1}
+    assert "If-None-Match" not in pool.requests[0][2]
+
+    assert client.get("/repos/NixOS/nixpkgs/pulls/1").json() == {"number": 1}
+    assert pool.requests[1][2]["If-None-Match"] == '"abc"'
+
+    assert client.get("/repos/NixOS/nixpkgs/pulls/1").json() == {"number": 2}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+    # other installations do not see the cached response
+    other = GithubClient("token", pool=pool, installation_id=2, cache=cache)
+    pool.responses.append(make_response(200, {}, {"number": 3}))
+    assert other.get("/repos/NixOS/nixpkgs/pulls/1").json() == {"number": 3}
+    assert "If-None-Match" not in pool.requests[3][2]
+
+
+def test_cache_is_bounded() -> None:
+    cache = ResponseCache(20)
+    for i in range(3):
+        cache.put(i, make_response(200, {"ETag": str(i)}, "x" * 6))
+    # every body is 8 bytes, so only two fit
+    assert cache.get(0) is None
+    assert cache.get(1) is not None
+    cache.put(3, make_response(200, {"ETag": "3"}, "x" * 6))
+    # 1 was used more recently than 2
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.stats()["evictions"] == 2
+    # responses without validators are useless for conditional requests
+    cache.put(4, make_response(200, {}, "x"))
+    assert cache.get(4) is None
+
+
+def page_link(path: str, next_page: int | None, last_page: int) -> str:
+    links = []
+    if next_page is not None:
+        links.append(
+            f'<https://api.github.com{path}?per_page=100&page={next_page}>; rel="next"'
+        )
+    links.append(
+        f'<https://api.github.com{path}?per_page=100&page={last_page}>; rel="last"'
+    )
+    return ", ".join(links)
+
+
+def test_paginated_pull_request_files() -> None:
+    path = "/repositories/1/pulls/1/files"
+    pool = FakePool(
+        [
+            make_response(
+                200,
+                {"Link": page_link(path, 2, 3)},
+                [{"filename": f"a{i}"} for i in range(100)],
+            ),
+            make_response(
+                200,
+                {"Link": page_link(path, 3, 3)},
+                [{"filename": f"b{i}"} for i in range(100)],
+            ),
+            make_response(200, {}, [{"filename": "c"}]),
+        ]
+    )
+    client = GithubClient("token", pool=pool, cache=ResponseCache(0))
+
+    files = client.iter_pull_request_files("NixOS", "nixpkgs", 1)
+    # nothing is fetched before the first file is needed
+    assert pool.requests == []
+    assert next(files) == {"filename": "a0"}
+    assert [r[1] for r in pool.requests] == [
+        "/repos/NixOS/nixpkgs/pulls/1/files?per_page=100"
+    ]
+
+    rest = list(files)
+    assert len(rest) == 200
+    assert rest[-1] == {"filename": "c"}
+    assert [r[1] for r in pool.requests[1:]] == [
+        f"{path}?per_page=100&page=2",
+        f"{path}?per_page=100&page=3",
+    ]
+
+
+def test_paginated_check_runs() -> None:
+    path = "/repositories/1/commits/abc/check-runs"
+    pool = FakePool(
+        [
+            make_response(
+                200,
+                {"Link": page_link(path, 2, 2)},
+                {"total_count": 101, "check_runs": [{"id": i} for i in range(100)]},
+            ),
+            make_response(200, {}, {"total_count": 101, "check_runs": [{"id": 100}]}),
+        ]
+    )
+    client = GithubClient("token", pool=pool, cache=ResponseCache(0))
+
+    check_runs = list(client.iter_check_runs_for_commit("NixOS", "nixpkgs", "abc"))
+
+    assert [c["id"] for c in check_runs] == list(range(101))
+    assert len(pool.requests) == 2
@@ -0,0 +1,99 @@
+import dataclasses
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+from test_server import WebhookTestServer
+from test_webhook import SETTINGS, TEST_DATA
+
+from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.job_queue import (
+    JobExecutor,
+    JobQueue,
+    JobQueueFullError,
+    get_job_queue,
+)
+from nixpkgs_merge_bot.settings import Settings
+from nixpkgs_merge_bot.webhook.handler import GithubWebHook
+from nixpkgs_merge_bot.webhook.http_response import HttpResponse
+
+
+def test_jobs_with_same_key_are_serialized(tmp_path: Path) -> None:
+    queue = JobQueue(Database(tmp_path / "jobs.db"), 10)
+    first = queue.put("issue_comment", "NixOS/nixpkgs#1", b"{}")
+    second = queue.put("issue_comment", "NixOS/nixpkgs#1", b"{}")
+    other = queue.put("check_run", "NixOS/nixpkgs#2", b"{}")
+
+    job = queue.claim(timeout=0)
+    assert job is not None
+    assert job.id == first
+    # the second job for #1 has to wait for the first one
+    job2 = queue.claim(timeout=0)
+    assert job2 is not None
+    assert job2.id == other
+    assert queue.claim(timeout=0) is None
+
+    queue.done(job)
+    job3 = queue.claim(timeout=0)
+    assert job3 is not None
+    assert job3.id == second
+
+
+def test_running_jobs_survive_restart(tmp_path: Path) -> None:
+    queue = JobQueue(Database(tmp_path / "jobs.db"), 10)
+    queue.put("issue_comment", None, b'{"a": 1}')
+    job = queue.claim(timeout=0)
+    assert job is not None
+
+    restarted = JobQueue(Database(tmp_path / "jobs.db"), 10)
+    job = restarted.claim(timeout=0)
+    assert job is not None
+    assert job.body == b'{"a": 1}'
+    assert job.attempts == 2
+
+
+def test_queue_is_bounded(tmp_path: Path) -> None:
+    queue = JobQueue(Database(tmp_path / "jobs.db"), 2)
+    queue.put("issue_comment", None, b"{}")
+    queue.put("issue_comment", None, b"{}")
+    with pytest.raises(JobQueueFullError):
+        queue.put("issue_comment", None, b"{}")
+    assert queue.stats() == {"pending": 2, "running": 0, "max_size": 2}
+
+
+def test_fast_ack(server: WebhookTestServer, tmp_path: Path) -> None:
+    settings = dataclasses.replace(SETTINGS, fast_ack=True, database_path=str(tmp_path))
+    server.start_handler(GithubWebHook, settings)
+
+    client = server.get_client()
+    create_event = (TEST_DATA / "issue_comment.merge.json").read_bytes()
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": "issue_comment",
+        "X-Hub-Signature": "sha1=46879ac80229482672e9d7acde7b37834a49b8c3",
+    }
+    client.request("POST", "/", body=create_event, headers=headers)
+    response = client.getresponse()
+    response_body = json.loads(response.read().decode("utf-8"))
+
+    server.wait_for_handler()
+
+    assert response.status == 202, f"Response: {response.status}, {response_body}"
+    assert response_body["action"] == "queued"
+
+    dispatched: list[tuple[str, Any]] = []
+
+    def dispatch(
+        event_type: str, payload: dict[str, Any], _settings: Settings
+    ) -> HttpResponse:
+        dispatched.append((event_type, payload["issue"]["number"]))
+        return HttpResponse(200, {}, b"{}")
+
+    queue = get_job_queue(settings)
+    job = queue.claim(timeout=0)
+    assert job is not None
+    assert job.key == "nixpkgs-merge/nixpkgs#1"
+    JobExecutor(queue, dispatch, settings).run_job(job)
+    assert dispatched == [("issue_comment", 1)]
+    assert queue.depth() == 0
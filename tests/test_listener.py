@@ -0,0 +1,150 @@
+import dataclasses
+import hashlib
+import hmac
+import json
+import socket
+import threading
+from http.client import HTTPConnection
+from pathlib import Path
+from typing import Any
+
+from pytest_mock import MockerFixture
+from test_server import WebhookTestServer
+from test_webhook import SETTINGS, TEST_DATA
+
+from nixpkgs_merge_bot.server import serve
+from nixpkgs_merge_bot.settings import Settings
+from nixpkgs_merge_bot.webhook.handler import GithubWebHook
+from nixpkgs_merge_bot.webhook.utils.issue_response import issue_response
+from nixpkgs_merge_bot.worker_pool import KeyedDispatcher, WorkerPool
+
+
+def test_serves_every_socket(tmp_path: Path) -> None:
+    socks = []
+    for name in ("a.sock", "b.sock"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(str(tmp_path / name))
+        sock.listen()
+        socks.append(sock)
+
+    dispatcher = KeyedDispatcher(WorkerPool(2))
+    threading.Thread(
+        target=serve, args=(socks, dispatcher, SETTINGS), daemon=True
+    ).start()
+
+    # ask the second socket first, a loop stuck on the first one would hang here
+    for name in ("b.sock", "a.sock"):
+        client_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client_sock.settimeout(5)
+        client_sock.connect(str(tmp_path / name))
+        client = HTTPConnection("localhost")
+        client.sock = client_sock
+        client.request("GET", "/")
+        response = client.getresponse()
+        assert response.status == 200
+        assert response.read() == b"ok"
+        client.close()
+
+    for sock in socks:
+        sock.close()
+
+
+def test_keep_alive(tmp_path: Path) -> None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(tmp_path / "bot.sock"))
+    sock.listen()
+    settings = dataclasses.replace(SETTINGS, keepalive_max_requests=3)
+    pool = WorkerPool(1)
+    threading.Thread(
+        target=serve, args=([sock], KeyedDispatcher(pool), settings), daemon=True
+    ).start()
+
+    client_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client_sock.settimeout(5)
+    client_sock.connect(str(tmp_path / "bot.sock"))
+    client = HTTPConnection("localhost")
+    client.sock = client_sock
+
+    for _ in range(2):
+        client.request("GET", "/")
+        response = client.getresponse()
+        assert response.status == 200
+        assert response.getheader("Connection") is None
+        assert response.read() == b"ok"
+        # the idle connection must not occupy the only worker
+        assert client.sock is client_sock
+        threading.Event().wait(0.1)
+        assert pool.stats()["busy"] == 0
+
+    client.request("GET", "/")
+    response = client.getresponse()
+    assert response.getheader("Connection") == "close"
+    assert response.read() == b"ok"
+    # http.client drops the connection after "Connection: close"
+    assert client.sock is None
+
+    client.close()
+    sock.close()
+
+
+def test_dispatched_events_keep_the_connection(
+    tmp_path: Path, mocker: MockerFixture
+) -> None:
+    handled: list[str] = []
+
+    def handler(payload: dict[str, Any], _settings: Settings) -> Any:
+        handled.append(threading.current_thread().name)
+        return issue_response(f"handled {payload['issue']['number']}")
+
+    mocker.patch(
+        "nixpkgs_merge_bot.webhook.handler.event_handler", return_value=handler
+    )
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(tmp_path / "bot.sock"))
+    sock.listen()
+    pool = WorkerPool(1)
+    threading.Thread(
+        target=serve, args=([sock], KeyedDispatcher(pool), SETTINGS), daemon=True
+    ).start()
+
+    client_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client_sock.settimeout(5)
+    client_sock.connect(str(tmp_path / "bot.sock"))
+    client = HTTPConnection("localhost")
+    client.sock = client_sock
+
+    body = (TEST_DATA / "issue_comment.merge.json").read_bytes()
+    key = SETTINGS.webhook_secret.read_text().strip().encode()
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": "issue_comment",
+        "X-Hub-Signature-256": "sha256="
+        + hmac.new(key, body, hashlib.sha256).hexdigest(),
+    }
+    number = json.loads(body)["issue"]["number"]
+    for _ in range(2):
+        client.request("POST", "/", body=body, headers=headers)
+        response = client.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read()) == {"action": f"handled {number}"}
+        # answered by the dispatched job on the same connection
+        assert client.sock is client_sock
+
+    assert len(handled) == 2
+    threading.Event().wait(0.1)
+    assert pool.stats()["busy"] == 0
+    client.close()
+    sock.close()
+
+
+def test_keep_alive_in_test_server(server: WebhookTestServer) -> None:
+    server.start_handler(GithubWebHook, SETTINGS)
+
+    client = server.get_client()
+    for _ in range(2):
+        client.request("GET", "/")
+        response = client.getresponse()
+        assert response.status == 200
+        assert response.read() == b"ok"
+
+    server.wait_for_handler()
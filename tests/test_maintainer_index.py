@@ -0,0 +1,246 @@
+import json
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from conftest import FakeClock
+from test_git import git
+
+from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.nix.maintainer_index import (
+    EVALUATION_FAILED,
+    MISSING_PACKAGE,
+    Maintainer,
+    MaintainerIndex,
+    MaintainerList,
+    PackageMaintainers,
+)
+from nixpkgs_merge_bot.repo_manager import RepoManager
+
+
+class FakeNix:
+    """Reads package.nix files as JSON lists of maintainer handles."""
+
+    def __init__(self) -> None:
+        self.evaluated: list[list[str]] = []
+        # packages that make nix-instantiate fail
+        self.broken: set[str] = set()
+
+    def maintainer_list(self, nixpkgs: Path) -> MaintainerList:
+        entries = json.loads((nixpkgs / "maintainers/maintainer-list.nix").read_text())
+        return {handle: (entry[0], entry[1]) for handle, entry in entries.items()}
+
+    def packages(
+        self, nixpkgs: Path, names: list[str]
+    ) -> dict[str, PackageMaintainers]:
+        self.evaluated.append(names)
+        if self.broken & set(names):
+            raise subprocess.CalledProcessError(1, "nix-instantiate")
+        maintainer_list = self.maintainer_list(nixpkgs)
+        result = {}
+        for name in names:
+            package = nixpkgs / "pkgs/by-name" / name[:2] / name / "package.nix"
+            if not package.exists():
+                result[name] = PackageMaintainers([], MISSING_PACKAGE)
+                continue
+            result[name] = PackageMaintainers(
+                [
+                    Maintainer(*maintainer_list[handle])  # type: ignore[arg-type]
+                    for handle in json.loads(package.read_text())
+                ]
+            )
+        return result
+
+
+def write(origin: Path, files: dict[str, object]) -> None:
+    for name, content in files.items():
+        path = origin / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(content))
+    git(origin, "add", ".")
+    git(origin, "commit", "-q", "-m", "update")
+
+
+def wait_for_rebuild(maintainer_index: MaintainerIndex) -> None:
+    for _ in range(50):
+        if not maintainer_index.stats()["rebuilding"]:
+            return
+        time.sleep(0.1)
+    pytest.fail("the index was not rebuilt in time")
+
+
+@pytest.fixture
+def origin(tmp_path: Path) -> Path:
+    origin = tmp_path / "origin"
+    origin.mkdir()
+    git(origin, "init", "-q", "-b", "master")
+    write(
+        origin,
+        {
+            "maintainers/maintainer-list.nix": {
+                "mic92": [96200, "Mic92"],
+                "lassulus": [621759, "Lassulus"],
+            },
+            "maintainers/team-list.nix": {},
+            "pkgs/by-name/he/hello/package.nix": ["mic92"],
+            "pkgs/by-name/ni/nixos-anywhere/package.nix": ["mic92", "lassulus"],
+            "pkgs/by-name/ni/nixos-anywhere/patches/fix.patch": [],
+            "pkgs/by-name/zz/zzz/package.nix": ["lassulus"],
+        },
+    )
+    return origin
+
+
+@pytest.fixture
+def index(tmp_path: Path, origin: Path) -> tuple[MaintainerIndex, FakeNix, FakeClock]:
+    clone = tmp_path / "nixpkgs"
+    git(tmp_path, "clone", "-q", str(origin), str(clone))
+    nix = FakeNix()
+    clock = FakeClock()
+    index = MaintainerIndex(
+        Database(tmp_path / "nixpkgs_merge_bot.db"),
+        RepoManager(clone, fetch_interval=0),
+        nix.packages,
+        nix.maintainer_list,
+        rebuild_interval=3600,
+        clock=clock,
+    )
+    return index, nix, clock
+
+
+def test_lookup(index: tuple[MaintainerIndex, FakeNix, FakeClock]) -> None:
+    maintainer_index, nix, _ = index
+
+    packages = maintainer_index.lookup("master", ["nixos-anywhere", "new-package"])
+
+    assert packages == {
+        "nixos-anywhere": PackageMaintainers(
+            [Maintainer(96200, "Mic92"), Maintainer(621759, "Lassulus")]
+        ),
+        "new-package": PackageMaintainers([], MISSING_PACKAGE),
+    }
+    assert nix.evaluated == [["hello", "nixos-anywhere", "zzz"]]
+    # the branch did not move
+    maintainer_index.lookup("master", ["hello"])
+    assert len(nix.evaluated) == 1
+    assert maintainer_index.stats()["refs"]["master"]["packages"] == 3
+
+
+def test_changed_package_is_reevaluated(
+    origin: Path, index: tuple[MaintainerIndex, FakeNix, FakeClock]
+) -> None:
+    maintainer_index, nix, _ = index
+    maintainer_index.lookup("master", ["hello"])
+
+    write(origin, {"pkgs/by-name/he/hello/package.nix": ["lassulus"]})
+    sha = git(origin, "rev-parse", "HEAD")
+
+    # the index is refreshed before answering
+    assert maintainer_index.lookup("master", ["hello"]) == {
+        "hello": PackageMaintainers([Maintainer(621759, "Lassulus")])
+    }
+    assert nix.evaluated[1:] == [["hello"]]
+    assert maintainer_index.stats()["refs"]["master"]["sha"] == sha
+
+
+def test_changed_maintainer_is_reevaluated(
+    origin: Path, index: tuple[MaintainerIndex, FakeNix, FakeClock]
+) -> None:
+    maintainer_index, nix, _ = index
+    maintainer_index.lookup("master", ["hello"])
+
+    write(
+        origin,
+        {
+            "maintainers/maintainer-list.nix": {
+                "mic92": [96200, "Mic92"],
+                "lassulus": [621759, "lassulus-renamed"],
+            },
+        },
+    )
+
+    packages = maintainer_index.lookup("master", ["zzz"])
+    assert packages["zzz"].maintainers == [Maintainer(621759, "lassulus-renamed")]
+    assert nix.evaluated[1:] == [["nixos-anywhere", "zzz"]]
+    assert maintainer_index.stats()["incremental_updates"] == 1
+
+
+def test_full_rebuild(
+    origin: Path, index: tuple[MaintainerIndex, FakeNix, FakeClock]
+) -> None:
+    maintainer_index, nix, clock = index
+    maintainer_index.lookup("master", ["hello"])
+
+    # teams are not tracked, changing them rebuilds the index
+    write(origin, {"maintainers/team-list.nix": {"team": []}})
+    assert maintainer_index.update("master") == git(origin, "rev-parse", "HEAD")
+    wait_for_rebuild(maintainer_index)
+    assert maintainer_index.stats()["full_builds"] == 2
+
+    clock.now += 3600
+    write(origin, {"pkgs/by-name/he/hello/package.nix": []})
+    # answered from the incremental update, the rebuild runs in the background
+    assert maintainer_index.lookup("master", ["hello"])["hello"].maintainers == []
+    wait_for_rebuild(maintainer_index)
+    assert maintainer_index.stats()["full_builds"] == 3
+    assert nix.evaluated[2:] == [["hello"], ["hello", "nixos-anywhere", "zzz"]]
+
+
+def test_lookups_do_not_wait_for_a_rebuild(
+    origin: Path, index: tuple[MaintainerIndex, FakeNix, FakeClock]
+) -> None:
+    maintainer_index, nix, clock = index
+    maintainer_index.lookup("master", ["hello"])
+
+    release = threading.Event()
+    evaluate = nix.packages
+
+    def slow_full_builds(
+        nixpkgs: Path, names: list[str]
+    ) -> dict[str, PackageMaintainers]:
+        if len(names) > 1:
+            release.wait(timeout=5)
+        return evaluate(nixpkgs, names)
+
+    maintainer_index.evaluate_packages = slow_full_builds
+    clock.now += 3600
+    maintainer_index.rebuild_in_background("master")
+
+    write(origin, {"pkgs/by-name/he/hello/package.nix": ["lassulus"]})
+    assert maintainer_index.lookup("master", ["hello"])["hello"].maintainers == [
+        Maintainer(621759, "Lassulus")
+    ]
+    assert maintainer_index.stats()["rebuilding"] == 1
+
+    release.set()
+    wait_for_rebuild(maintainer_index)
+    # the rebuilt sha was brought up to the branch head again
+    assert maintainer_index.stats()["refs"]["master"]["sha"] == git(
+        origin, "rev-parse", "HEAD"
+    )
+    assert maintainer_index.lookup("master", ["hello"])["hello"].maintainers == [
+        Maintainer(621759, "Lassulus")
+    ]
+
+
+def test_broken_package_is_isolated(
+    index: tuple[MaintainerIndex, FakeNix, FakeClock],
+) -> None:
+    maintainer_index, nix, _ = index
+    nix.broken.add("nixos-anywhere")
+
+    packages = maintainer_index.lookup("master", ["hello", "nixos-anywhere"])
+
+    assert packages == {
+        "hello": PackageMaintainers([Maintainer(96200, "Mic92")]),
+        "nixos-anywhere": PackageMaintainers([], EVALUATION_FAILED),
+    }
+    assert nix.evaluated == [
+        ["hello", "nixos-anywhere", "zzz"],
+        ["hello"],
+        ["nixos-anywhere", "zzz"],
+        ["nixos-anywhere"],
+        ["zzz"],
+    ]
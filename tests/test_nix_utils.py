@@ -0,0 +1,48 @@
+import json
+from pathlib import Path
+
+from pytest_mock import MockerFixture
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.nix.nix_utils import (
+    Maintainer,
+    PackageMaintainers,
+    evaluate_maintainers,
+    get_package_maintainers,
+    package_name,
+)
+
+
+def test_maintainers_are_evaluated_at_once(mocker: MockerFixture) -> None:
+    names = []
+
+    def nix_eval(_expr: str, args: dict[str, str]) -> bytes:
+        assert args["nixpkgs"] == "/nixpkgs"
+        names.append(json.loads(Path(args["namesFile"]).read_text()))
+        return json.dumps(
+            {
+                "hello": {"maintainers": [{"github": "Mic92", "githubId": 96200}]},
+                "broken": {"error": "evaluation failed"},
+            }
+        ).encode()
+
+    mocker.patch("nixpkgs_merge_bot.nix.nix_utils.nix_eval", side_effect=nix_eval)
+
+    packages = evaluate_maintainers(Path("/nixpkgs"), ["broken", "hello"])
+
+    assert packages == {
+        "hello": PackageMaintainers([Maintainer(96200, "Mic92")]),
+        "broken": PackageMaintainers([], "evaluation failed"),
+    }
+    assert names == [["broken", "hello"]]
+
+
+def test_package_name() -> None:
+    assert package_name(Path("pkgs/by-name/he/hello/package.nix")) == "hello"
+    assert package_name(Path("pkgs/by-name/he/hello/patches/fix.patch")) == "hello"
+
+
+def test_no_packages_no_lookup(mocker: MockerFixture) -> None:
+    index = mocker.patch("nixpkgs_merge_bot.nix.nix_utils.get_maintainer_index")
+    assert get_package_maintainers(SETTINGS, []) == {}
+    index.assert_not_called()
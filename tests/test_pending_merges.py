@@ -0,0 +1,212 @@
+import dataclasses
+import json
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+from conftest import FakeClock
+from pytest_mock import MockerFixture
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.database import Database
+from nixpkgs_merge_bot.github.issue import IssueComment
+from nixpkgs_merge_bot.job_queue import get_job_queue
+from nixpkgs_merge_bot.pending_merges import PendingMerges, get_pending_merges
+from nixpkgs_merge_bot.settings import Settings
+from nixpkgs_merge_bot.webhook.check_run import (
+    check_run,
+    get_check_run_coalescer,
+    retry_coalesced,
+    retry_pending_merges,
+)
+from nixpkgs_merge_bot.webhook.handler import dispatch_event
+from nixpkgs_merge_bot.webhook.pull_request import pull_request
+from nixpkgs_merge_bot.webhook.utils.issue_response import issue_response
+
+
+def comment(number: int, comment_id: int) -> IssueComment:
+    return IssueComment(
+        commenter_id=96200,
+        commenter_login="Mic92",
+        text="@NixOS/nixpkgs-merge-bot merge",
+        action="created",
+        node_id=f"IC_{comment_id}",
+        comment_id=comment_id,
+        comment_type="issue_comment",
+        repo_owner="NixOS",
+        repo_name="nixpkgs",
+        issue_number=number,
+        is_bot=False,
+        title="nixos-anywhere: 1.0.0 -> 1.1.0",
+        state="open",
+    )
+
+
+def check_run_body(head_sha: str) -> dict[str, Any]:
+    return {
+        "check_run": {
+            "conclusion": "success",
+            "head_sha": head_sha,
+            "id": 1,
+            "node_id": "CR_1",
+            "pull_requests": [],
+            "status": "completed",
+            "name": "eval",
+            "started_at": "2024-02-20T16:12:33Z",
+            "check_suite": {"id": 1},
+            "app": {"id": 15368, "name": "GitHub Actions"},
+        },
+        "repository": {"name": "nixpkgs", "owner": {"login": "NixOS"}},
+    }
+
+
+@pytest.fixture
+def settings(tmp_path: Path) -> Settings:
+    return dataclasses.replace(
+        SETTINGS, database_path=str(tmp_path), check_run_window=0
+    )
+
+
+def test_take_newest_command_per_pull_request(tmp_path: Path) -> None:
+    clock = FakeClock()
+    pending = PendingMerges(Database(tmp_path / "db"), ttl=60, clock=clock)
+    pending.add(comment(1, 10), "aaa")
+    clock.now += 1
+    pending.add(comment(1, 11), "aaa")
+    pending.add(comment(2, 20), "bbb")
+
+    assert pending.take("aaa") == [comment(1, 11)]
+    assert pending.take("aaa") == []
+    assert pending.stats() == {"pending": 1}
+
+
+def test_expired_commands_are_dropped(tmp_path: Path) -> None:
+    clock = FakeClock()
+    pending = PendingMerges(Database(tmp_path / "db"), ttl=60, clock=clock)
+    pending.add(comment(1, 10), "aaa")
+    clock.now += 61
+    assert pending.take("aaa") == []
+
+
+def test_check_run_reruns_pending_merge(
+    settings: Settings, mocker: MockerFixture
+) -> None:
+    merge_command = mocker.patch(
+        "nixpkgs_merge_bot.webhook.check_run.merge_command",
+        return_value=issue_response("merged"),
+    )
+    get_pending_merges(settings).add(comment(1, 10), "aaa")
+    body = check_run_body("aaa")
+
+    assert check_run(body, settings) == issue_response("merged")
+    merge_command.assert_called_once_with(comment(1, 10), settings)
+    # taken for the retry
+    check_run(body, settings)
+    assert merge_command.call_count == 1
+
+
+def test_failed_retry_keeps_pending_merges(
+    settings: Settings, mocker: MockerFixture
+) -> None:
+    mocker.patch(
+        "nixpkgs_merge_bot.webhook.check_run.merge_command",
+        side_effect=RuntimeError("502 Bad Gateway"),
+    )
+    pending = get_pending_merges(settings)
+    pending.add(comment(1, 10), "aaa")
+    pending.add(comment(2, 20), "aaa")
+
+    with pytest.raises(RuntimeError):
+        retry_pending_merges("aaa", settings)
+
+    # the failed command and the one after it are retried next time
+    assert sorted(c.issue_number for c in pending.take("aaa")) == [1, 2]
+
+
+@pytest.mark.parametrize(
+    ("action", "remaining"),
+    [("closed", []), ("synchronize", ["bbb"]), ("edited", ["aaa", "bbb"])],
+)
+def test_pull_request_events_drop_pending_merges(
+    settings: Settings, action: str, remaining: list[str]
+) -> None:
+    pending = get_pending_merges(settings)
+    pending.add(comment(1, 10), "aaa")
+    pending.add(comment(1, 11), "bbb")
+    body = {
+        "action": action,
+        "pull_request": {"number": 1, "head": {"sha": "bbb"}},
+        "repository": {"name": "nixpkgs", "owner": {"login": "NixOS"}},
+    }
+
+    pull_request(body, settings)
+
+    assert [sha for sha in ("aaa", "bbb") if pending.take(sha)] == remaining
+
+
+def test_check_runs_of_a_commit_are_coalesced(
+    settings: Settings, mocker: MockerFixture
+) -> None:
+    settings = dataclasses.replace(settings, check_run_window=0.1)
+    retried: list[int] = []
+
+    def merge_command(issue_comment: IssueComment, _settings: Settings) -> Any:
+        retried.append(issue_comment.issue_number)
+        return issue_response("merged")
+
+    mocker.patch(
+        "nixpkgs_merge_bot.webhook.check_run.merge_command", side_effect=merge_command
+    )
+    pending = get_pending_merges(settings)
+    pending.add(comment(1, 10), "aaa")
+    pending.add(comment(2, 20), "aaa")
+
+    for _ in range(5):
+        assert check_run(check_run_body("aaa"), settings) == issue_response("coalesced")
+    # no pending merge, nothing to coalesce
+    assert check_run(check_run_body("bbb"), settings) == issue_response("success")
+
+    coalescer = get_check_run_coalescer(settings)
+    for _ in range(50):
+        if coalescer.stats()["runs"]:
+            break
+        time.sleep(0.1)
+    assert coalescer.stats() == {"waiting": 0, "events": 5, "runs": 1}
+    # the retries run on the webhook pool
+    for _ in range(50):
+        if len(retried) == 2:
+            break
+        time.sleep(0.1)
+    # every pending command of the commit is retried once
+    assert sorted(retried) == [1, 2]
+
+
+def test_coalesced_retries_are_queued_with_fast_ack(
+    settings: Settings, mocker: MockerFixture
+) -> None:
+    settings = dataclasses.replace(settings, fast_ack=True)
+    retried: list[IssueComment] = []
+
+    def merge_command(issue_comment: IssueComment, _settings: Settings) -> Any:
+        retried.append(issue_comment)
+        return issue_response("merged")
+
+    mocker.patch(
+        "nixpkgs_merge_bot.webhook.check_run.merge_command", side_effect=merge_command
+    )
+    get_pending_merges(settings).add(comment(1, 10), "aaa")
+
+    retry_coalesced("aaa", 3, settings)
+    # nothing runs on the coalescer thread
+    assert retried == []
+
+    job_queue = get_job_queue(settings)
+    job = job_queue.claim(timeout=0)
+    assert job is not None
+    # serialized with the deliveries for the pull request
+    assert job.key == "NixOS/nixpkgs#1"
+    assert dispatch_event(job.event_type, json.loads(job.body), settings) == (
+        issue_response("merged")
+    )
+    assert [(c.issue_number, c.comment_id) for c in retried] == [(1, 10)]
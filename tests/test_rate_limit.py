@@ -0,0 +1,114 @@
+import threading
+import time
+from email.message import Message
+
+from test_github_client import FakePool, make_response
+
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.github.rate_limit import Priority, RateLimiter, get_rate_limiter
+from nixpkgs_merge_bot.github.response_cache import ResponseCache
+
+
+def budget(remaining: int, reset_in: float) -> Message:
+    headers = Message()
+    headers["x-ratelimit-limit"] = "5000"
+    headers["x-ratelimit-remaining"] = str(remaining)
+    headers["x-ratelimit-reset"] = str(time.time() + reset_in)
+    return headers
+
+
+def test_exhausted_budget_waits_for_reset() -> None:
+    limiter = RateLimiter()
+    limiter.update(budget(0, 0.3))
+    start = time.monotonic()
+    limiter.acquire(Priority.HIGH)
+    assert time.monotonic() - start >= 0.2
+    assert limiter.state()["remaining"] == -1
+
+
+def test_reserve_is_kept_for_high_priority() -> None:
+    limiter = RateLimiter(reserve=10, max_wait=0.5)
+    limiter.update(budget(10, 3600))
+
+    start = time.monotonic()
+    limiter.acquire(Priority.HIGH)
+    assert time.monotonic() - start < 0.1
+
+    done = threading.Event()
+
+    def read() -> None:
+        limiter.acquire(Priority.LOW)
+        done.set()
+
+    threading.Thread(target=read).start()
+    # reads hold off until max_wait, then leave it to GitHub
+    assert not done.wait(0.3)
+    assert done.wait(1)
+
+
+def test_stale_headers_do_not_raise_budget() -> None:
+    limiter = RateLimiter()
+    reset = budget(100, 60)
+    limiter.update(reset)
+    reset.replace_header("x-ratelimit-remaining", "200")
+    limiter.update(reset)
+    assert limiter.state()["remaining"] == 100
+
+
+def test_retry_after() -> None:
+    pool = FakePool(
+        [
+            make_response(403, {"Retry-After": "0"}, {"message": "slow down"}),
+            make_response(200, {}, {"number": 1}),
+        ]
+    )
+    limiter = RateLimiter()
+    client = GithubClient(
+        "token", pool=pool, cache=ResponseCache(1024), rate_limiter=limiter
+    )
+    assert client.get("/repos/NixOS/nixpkgs/pulls/1").json() == {"number": 1}
+    assert len(pool.requests) == 2
+    assert limiter.state()["throttled"] == 1
+
+
+def test_secondary_rate_limit_blocks_requests() -> None:
+    limiter = RateLimiter()
+    body = b'{"message": "You have exceeded a secondary rate limit."}'
+    assert limiter.check_throttled(403, Message(), body)
+    assert limiter.state()["blocked_until"] > time.time() + 30
+    # a plain permission error is not retried
+    assert not limiter.check_throttled(403, Message(), b'{"message": "Forbidden"}')
+
+
+def test_graphql_has_its_own_budget() -> None:
+    installation_id = 1234
+    graphql = make_response(
+        200,
+        {
+            "x-ratelimit-resource": "graphql",
+            "x-ratelimit-remaining": "20",
+            "x-ratelimit-reset": str(time.time() + 3600),
+        },
+        {"data": {}},
+    )
+    core = make_response(
+        200,
+        {
+            "x-ratelimit-resource": "core",
+            "x-ratelimit-remaining": "4000",
+            "x-ratelimit-reset": str(time.time() + 60),
+        },
+        {"number": 1},
+    )
+    pool = FakePool([core, graphql])
+    client = GithubClient(
+        "token", pool=pool, cache=ResponseCache(1024), installation_id=installation_id
+    )
+    client.get("/repos/NixOS/nixpkgs/pulls/1")
+    client.graphql("query { viewer { login } }", {})
+
+    assert get_rate_limiter(installation_id, "core").state()["remaining"] == 4000
+    assert get_rate_limiter(installation_id, "graphql").state()["remaining"] == 20
+    start = time.monotonic()
+    get_rate_limiter(installation_id, "core").acquire(Priority.LOW)
+    assert time.monotonic() - start < 0.1
@@ -0,0 +1,112 @@
+import threading
+from pathlib import Path
+
+import pytest
+from conftest import FakeClock
+from pytest_mock import MockerFixture
+from test_git import git
+
+from nixpkgs_merge_bot import repo_manager
+from nixpkgs_merge_bot.repo_manager import RepoManager
+
+
+def commit(folder: Path, content: str) -> str:
+    (folder / "default.nix").write_text(content)
+    git(folder, "add", ".")
+    git(folder, "commit", "-q", "-m", content)
+    return git(folder, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def origin(tmp_path: Path) -> Path:
+    origin = tmp_path / "origin"
+    origin.mkdir()
+    git(origin, "init", "-q", "-b", "master")
+    commit(origin, "1")
+    git(origin, "branch", "staging")
+    return origin
+
+
+@pytest.fixture
+def clone(tmp_path: Path, origin: Path) -> Path:
+    clone = tmp_path / "nixpkgs"
+    git(tmp_path, "clone", "-q", str(origin), str(clone))
+    return clone
+
+
+def test_fetch_once_per_interval(
+    origin: Path, clone: Path, mocker: MockerFixture
+) -> None:
+    clock = FakeClock()
+    manager = RepoManager(clone, fetch_interval=60, clock=clock)
+    fetch = mocker.spy(repo_manager, "fetch")
+
+    manager.fetch()
+    sha = commit(origin, "2")
+    manager.fetch()
+    assert fetch.call_count == 1
+    assert manager.resolve("master") != sha
+
+    clock.now += 61
+    manager.fetch()
+    assert fetch.call_count == 2
+    assert manager.resolve("master") == sha
+
+
+def test_concurrent_callers_share_a_fetch(clone: Path, mocker: MockerFixture) -> None:
+    manager = RepoManager(clone)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_fetch(_folder: Path) -> None:
+        started.set()
+        release.wait(5)
+
+    fetch = mocker.patch.object(repo_manager, "fetch", side_effect=slow_fetch)
+    threads = [threading.Thread(target=manager.fetch) for _ in range(4)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert fetch.call_count == 1
+
+
+def test_worktrees_per_revision(origin: Path, clone: Path) -> None:
+    clock = FakeClock()
+    manager = RepoManager(clone, fetch_interval=60, max_worktrees=1, clock=clock)
+    git(origin, "checkout", "-q", "staging")
+    commit(origin, "staging")
+    git(origin, "checkout", "-q", "master")
+
+    with manager.worktree("master") as master, manager.worktree("staging") as staging:
+        assert (master / "default.nix").read_text() == "1"
+        assert (staging / "default.nix").read_text() == "staging"
+        assert master.parent == clone.parent / "nixpkgs-worktrees"
+    # the same revision is checked out only once
+    with manager.worktree("staging") as again:
+        assert again == staging
+    assert manager.stats()["created"] == 2
+    # only one unused worktree is kept, master was used least recently
+    assert not master.exists()
+    assert staging.exists()
+
+    commit(origin, "2")
+    clock.now += 61
+    with manager.worktree("master") as master:
+        assert (master / "default.nix").read_text() == "2"
+    assert not staging.exists()
+    assert manager.stats()["evicted"] == 2
+
+
+def test_leftover_worktrees_are_removed(clone: Path) -> None:
+    stale = clone.parent / "nixpkgs-worktrees" / "stale"
+    git(clone, "worktree", "add", "-q", "--detach", str(stale), "HEAD")
+
+    manager = RepoManager(clone)
+    with manager.worktree("master") as path:
+        assert path.exists()
+    assert not stale.exists()
+    assert git(clone, "worktree", "list").count("\n") == 1
@@ -0,0 +1,55 @@
+import hashlib
+import hmac
+import os
+from email.message import Message
+from pathlib import Path
+
+import pytest
+
+from nixpkgs_merge_bot.webhook.errors import HttpError
+from nixpkgs_merge_bot.webhook.secret import WebhookSecret
+
+
+def signed_headers(key: bytes, body: bytes, sha256: bool = True) -> Message:
+    headers = Message()
+    if sha256:
+        digest = hmac.new(key, body, hashlib.sha256).hexdigest()
+        headers["X-Hub-Signature-256"] = f"sha256={digest}"
+    digest = hmac.new(key, body, hashlib.sha1).hexdigest()
+    headers["X-Hub-Signature"] = f"sha1={digest}"
+    return headers
+
+
+def test_prefers_sha256(tmp_path: Path) -> None:
+    (tmp_path / "secret").write_text("foo\n")
+    secret = WebhookSecret(tmp_path / "secret")
+    headers = signed_headers(b"foo", b"body")
+    assert secret.validate_signature(b"body", headers)
+
+    # a valid sha1 signature does not help if the sha256 one is wrong
+    headers.replace_header("X-Hub-Signature-256", "sha256=" + "0" * 64)
+    assert not secret.validate_signature(b"body", headers)
+
+
+def test_sha1_fallback(tmp_path: Path) -> None:
+    (tmp_path / "secret").write_text("foo")
+    secret = WebhookSecret(tmp_path / "secret")
+    assert secret.validate_signature(b"body", signed_headers(b"foo", b"body", False))
+    assert not secret.validate_signature(
+        b"other", signed_headers(b"foo", b"body", False)
+    )
+    with pytest.raises(HttpError):
+        secret.validate_signature(b"body", Message())
+
+
+def test_reloads_changed_secret(tmp_path: Path) -> None:
+    path = tmp_path / "secret"
+    path.write_text("old")
+    secret = WebhookSecret(path)
+    assert secret.validate_signature(b"body", signed_headers(b"old", b"body"))
+
+    path.write_text("new")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert not secret.validate_signature(b"body", signed_headers(b"old", b"body"))
+    assert secret.validate_signature(b"body", signed_headers(b"new", b"body"))
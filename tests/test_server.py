@@ -54,6 +54,8 @@ class WebhookTestServer:
 
     def wait_for_handler(self, timeout: float = 5.0) -> None:
         """Wait for the handler thread to complete"""
+        # the handler keeps serving the connection until the client is done
+        self.client_sock.shutdown(socket.SHUT_WR)
         if self.server_thread:
             self.server_thread.join(timeout=timeout)
 
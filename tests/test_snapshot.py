@@ -0,0 +1,162 @@
+import dataclasses
+from pathlib import Path
+from typing import Any
+
+import pytest
+from pytest_mock import MockerFixture
+from test_webhook import SETTINGS
+
+from nixpkgs_merge_bot.commands.context import CommandContext
+from nixpkgs_merge_bot.github.github_client import GithubClient
+from nixpkgs_merge_bot.settings import Settings
+
+HEAD = "2b7e1d8a3c5f"
+
+
+def pull_request_node(files: list[str], has_next_page: bool) -> dict[str, Any]:
+    return {
+        "id": "PR_1",
+        "number": 1,
+        "title": "nixos-anywhere: 1.0.0 -> 1.1.0",
+        "body": "",
+        "state": "OPEN",
+        "baseRefName": "master",
+        "headRefOid": HEAD,
+        "author": {"login": "Mic92", "databaseId": 96200},
+        "files": {
+            "pageInfo": {"hasNextPage": has_next_page, "endCursor": "c1"},
+            "nodes": [{"path": path, "changeType": "MODIFIED"} for path in files],
+        },
+        "commits": {
+            "nodes": [
+                {
+                    "commit": {
+                        "checkSuites": {
+                            "pageInfo": {"hasNextPage": False},
+                            "nodes": [
+                                {
+                                    "databaseId": 7,
+                                    "app": {"databaseId": 15368, "name": "Actions"},
+                                    "checkRuns": {
+                                        "pageInfo": {"hasNextPage": False},
+                                        "nodes": [
+                                            {
+                                                "databaseId": 3,
+                                                "name": "eval",
+                                                "status": "COMPLETED",
+                                                "conclusion": "SUCCESS",
+                                                "startedAt": "2024-02-20T16:12:33Z",
+                                            }
+                                        ],
+                                    },
+                                }
+                            ],
+                        }
+                    }
+                }
+            ]
+        },
+    }
+
+
+class FakeGraphql:
+    def __init__(self) -> None:
+        self.queries: list[dict[str, Any]] = []
+
+    def __call__(self, query: str, variables: dict[str, Any]) -> dict[str, Any]:
+        self.queries.append(variables)
+        if "cursor" in variables:
+            return {
+                "repository": {
+                    "pullRequest": pull_request_node(
+                        ["pkgs/by-name/ni/nixos-anywhere/fix.patch"], False
+                    )
+                }
+            }
+        if "number" in variables:
+            return {
+                "repository": {
+                    "pullRequest": pull_request_node(
+                        ["pkgs/by-name/ni/nixos-anywhere/package.nix"], True
+                    )
+                }
+            }
+        assert "byteSize" in query
+        return {
+            "repository": {
+                "blob0": {"byteSize": 1234},
+                # removed at the head commit
+                "blob1": None,
+            },
+            "organization": {"team": {"members": {"nodes": [{"databaseId": 96200}]}}},
+        }
+
+
+@pytest.fixture
+def settings(tmp_path: Path) -> Settings:
+    return dataclasses.replace(
+        SETTINGS, database_path=str(tmp_path), graphql_snapshot=True
+    )
+
+
+def test_snapshot(mocker: MockerFixture) -> None:
+    graphql = FakeGraphql()
+    mocker.patch.object(GithubClient, "graphql", side_effect=graphql)
+
+    snapshot = GithubClient(None).pull_request_snapshot(
+        "NixOS", "nixpkgs", 1, "nixpkgs-committers"
+    )
+
+    assert snapshot.pull_request.head_sha == HEAD
+    assert snapshot.pull_request.user_login == "Mic92"
+    assert snapshot.pull_request.state == "open"
+    assert snapshot.files == [
+        {
+            "filename": "pkgs/by-name/ni/nixos-anywhere/package.nix",
+            "status": "modified",
+            "size": 1234,
+        },
+        {
+            "filename": "pkgs/by-name/ni/nixos-anywhere/fix.patch",
+            "status": "modified",
+            "size": 0,
+        },
+    ]
+    assert snapshot.check_runs == [
+        {
+            "id": 3,
+            "name": "eval",
+            "status": "completed",
+            "conclusion": "success",
+            "started_at": "2024-02-20T16:12:33Z",
+            "check_suite": {"id": 7},
+            "app": {"id": 15368, "name": "Actions"},
+        }
+    ]
+    assert snapshot.author_in_team
+    # pull request, second page of files, sizes and team
+    assert len(graphql.queries) == 3
+    assert graphql.queries[2]["path1"] == (
+        f"{HEAD}:pkgs/by-name/ni/nixos-anywhere/fix.patch"
+    )
+    assert graphql.queries[2]["login"] == "Mic92"
+
+
+def test_context_answers_from_snapshot(
+    settings: Settings, mocker: MockerFixture
+) -> None:
+    mocker.patch.object(GithubClient, "graphql", side_effect=FakeGraphql())
+    client = GithubClient(None)
+    for name in ("pull_request", "pull_request_files", "get_check_runs_for_commit"):
+        mocker.patch.object(client, name, side_effect=AssertionError(name))
+    context = CommandContext(client, settings)
+
+    pull_request = context.load_pull_request("NixOS", "nixpkgs", 1)
+
+    files = list(context.changed_files(pull_request))
+    assert [context.file_size(pull_request, file) for file in files] == [1234, 0]
+    assert [run["name"] for run in context.check_runs("NixOS", "nixpkgs", HEAD)] == [
+        "eval"
+    ]
+    assert context.is_team_member("NixOS", settings.committer_team_slug, "Mic92", 96200)
+    assert (context.calls, context.saved) == (1, 2)
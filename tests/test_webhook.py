@@ -1,4 +1,5 @@
 import json
+import tempfile
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
@@ -13,6 +14,8 @@ from nixpkgs_merge_bot.github.merge_result import (
     DirectMergeResult,
     QueuedMergeResult,
 )
+from nixpkgs_merge_bot.metrics import METRICS
+from nixpkgs_merge_bot.nix.nix_utils import PackageMaintainers, parse_maintainers
 from nixpkgs_merge_bot.settings import Settings
 from nixpkgs_merge_bot.webhook.handler import GithubWebHook
 
@@ -27,6 +30,7 @@ SETTINGS = Settings(
     github_app_login="nixpkgs-merge",
     github_app_private_key=TEST_DATA / "github_app_key.pem",
     repo_path=DUMMY_NIXPKGS,
+    database_path=tempfile.mkdtemp(prefix="nixpkgs-merge-bot-test-"),
 )
 
 
@@ -42,6 +46,20 @@ def test_get(server: WebhookTestServer) -> None:
     assert response.status == 200
 
 
+def test_get_metrics(server: WebhookTestServer) -> None:
+    server.start_handler(GithubWebHook, SETTINGS)
+
+    client = server.get_client()
+    client.request("GET", "/metrics")
+    response = client.getresponse()
+    response_body = json.loads(response.read().decode("utf-8"))
+
+    server.wait_for_handler()
+
+    assert response.status == 200
+    assert isinstance(response_body, dict)
+
+
 def test_post_no_merge(server: WebhookTestServer) -> None:
     server.start_handler(GithubWebHook, SETTINGS)
 
@@ -64,6 +82,33 @@ def test_post_no_merge(server: WebhookTestServer) -> None:
     assert response_body["action"] == "no-command"
 
 
+def test_post_no_mention_is_not_decoded(
+    server: WebhookTestServer, mocker: MockerFixture
+) -> None:
+    json_loads = mocker.spy(json, "loads")
+    prefiltered = METRICS.get("comment_deliveries_prefiltered")
+    server.start_handler(GithubWebHook, SETTINGS)
+
+    client = server.get_client()
+    create_event = (TEST_DATA / "issue_comment.no-merge.json").read_bytes()
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": "issue_comment",
+        "X-Hub-Signature-256": "sha256=286913f698705a38a157eb947acf716a32879c0eb8adf3a8e0155f2a6eb51960",
+    }
+
+    client.request("POST", "/", body=create_event, headers=headers)
+    response = client.getresponse()
+    response_body = response.read()
+
+    server.wait_for_handler()
+
+    assert response.status == 200
+    assert json_loads.call_count == 0
+    assert json.loads(response_body)["action"] == "no-command"
+    assert METRICS.get("comment_deliveries_prefiltered") == prefiltered + 1
+
+
 @dataclass
 class FakeHttpResponse:
     path: Path
@@ -76,6 +121,10 @@ class FakeHttpResponse:
         return self.fake_headers
 
 
+def maintainers(name: str) -> dict[str, PackageMaintainers]:
+    return parse_maintainers(json.loads((TEST_DATA / name).read_text()))
+
+
 def default_mocks() -> dict[str, Any]:
     return {
         "nixpkgs_merge_bot.github.github_client.GithubClient.app_installations": FakeHttpResponse(
@@ -93,10 +142,9 @@ def default_mocks() -> dict[str, Any]:
         "nixpkgs_merge_bot.github.github_client.GithubClient.pull_request_files": FakeHttpResponse(
             TEST_DATA / "pull_request_files.json"
         ),
-        "nixpkgs_merge_bot.nix.nix_utils.checkout_newest_master": "",
-        "nixpkgs_merge_bot.nix.nix_utils.nix_eval": (
-            TEST_DATA / "nix-eval.json"
-        ).read_bytes(),
+        "nixpkgs_merge_bot.commands.context.get_package_maintainers": maintainers(
+            "nix-eval.json"
+        ),
         "nixpkgs_merge_bot.github.github_client.GithubClient.get_check_suites_for_commit": FakeHttpResponse(
             TEST_DATA / "get_check_suites_for_commit.json"
         ),
@@ -115,6 +163,7 @@ def default_mocks() -> dict[str, Any]:
         "nixpkgs_merge_bot.github.github_client.GithubClient.get_team_members": json.loads(
             (TEST_DATA / "get_team_members.json").read_text()
         ),
+        "nixpkgs_merge_bot.github.github_client.GithubClient.is_team_member": False,
         "nixpkgs_merge_bot.github.github_client.GithubClient.get_user_info": FakeHttpResponse(
             TEST_DATA / "user_with_email_r-ryantm.json"
         ),
@@ -177,6 +226,16 @@ def test_post_merge(
         "nixpkgs_merge_bot.github.github_client.GithubClient.merge_pull_request",
         return_value=merge_result,
     )
+    mock_pull_request_files = mocker.patch(
+        "nixpkgs_merge_bot.github.github_client.GithubClient.pull_request_files",
+        return_value=FakeHttpResponse(TEST_DATA / "pull_request_files.json"),
+    )
+    mock_file_content = mocker.patch(
+        "nixpkgs_merge_bot.github.github_client.GithubClient.get_request_file_content",
+        return_value=FakeHttpResponse(
+            TEST_DATA / "pull_request_file_content.package.json"
+        ),
+    )
 
     # Spy on create_issue_comment
     mock_create_issue_comment = mocker.patch(
@@ -191,7 +250,7 @@ def test_post_merge(
         "Content-Type": "application/json",
         "X-GitHub-Event": "issue_comment",
         "X-Hub-Signature": "sha1=46879ac80229482672e9d7acde7b37834a49b8c3",
-        "X-Hub-Signature-256": "sha256=53e04dda8e5d322028f7111eb9b92dc0056c8bc0bcb084edec7c9b87d594a4bb",
+        "X-Hub-Signature-256": "sha256=c239c43899cc4df0f2bce9b5b25a1644255fbf6467f95d6acbe18c52dfe83cb6",
     }
     client.request("POST", "/", body=create_event, headers=headers)
     response = client.getresponse()
@@ -210,19 +269,28 @@ def test_post_merge(
         expected_comment,
     )
 
+    # every merging strategy looks at the files, they are fetched only once
+    mock_pull_request_files.assert_called_once()
+    mock_file_content.assert_called_once()
+
 
 @pytest.mark.parametrize(
     "mock_overrides",
     [
         {
-            "nixpkgs_merge_bot.nix.nix_utils.nix_eval": (
-                TEST_DATA / "nix-eval-no-maintainer.json"
-            ).read_bytes()
+            "nixpkgs_merge_bot.commands.context.get_package_maintainers": maintainers(
+                "nix-eval-no-maintainer.json"
+            )
         },
         {
-            "nixpkgs_merge_bot.nix.nix_utils.nix_eval": (
-                TEST_DATA / "nix-eval-wrong-maintainer.json"
-            ).read_bytes()
+            "nixpkgs_merge_bot.commands.context.get_package_maintainers": maintainers(
+                "nix-eval-wrong-maintainer.json"
+            )
+        },
+        {
+            "nixpkgs_merge_bot.commands.context.get_package_maintainers": maintainers(
+                "nix-eval-error.json"
+            )
         },
         {
             "nixpkgs_merge_bot.github.github_client.GithubClient.pull_request_files": FakeHttpResponse(
@@ -254,7 +322,7 @@ def test_post_merge_maintainer(
         "Content-Type": "application/json",
         "X-GitHub-Event": "issue_comment",
         "X-Hub-Signature": "sha1=46879ac80229482672e9d7acde7b37834a49b8c3",
-        "X-Hub-Signature-256": "sha256=53e04dda8e5d322028f7111eb9b92dc0056c8bc0bcb084edec7c9b87d594a4bb",
+        "X-Hub-Signature-256": "sha256=c239c43899cc4df0f2bce9b5b25a1644255fbf6467f95d6acbe18c52dfe83cb6",
     }
     client.request("POST", "/", body=create_event, headers=headers)
     response = client.getresponse()
@@ -270,14 +338,14 @@ def test_post_merge_maintainer(
     "mock_overrides",
     [
         {
-            "nixpkgs_merge_bot.nix.nix_utils.nix_eval": (
-                TEST_DATA / "nix-eval-no-maintainer.json"
-            ).read_bytes()
+            "nixpkgs_merge_bot.commands.context.get_package_maintainers": maintainers(
+                "nix-eval-no-maintainer.json"
+            )
         },
         {
-            "nixpkgs_merge_bot.nix.nix_utils.nix_eval": (
-                TEST_DATA / "nix-eval-wrong-maintainer.json"
-            ).read_bytes()
+            "nixpkgs_merge_bot.commands.context.get_package_maintainers": maintainers(
+                "nix-eval-wrong-maintainer.json"
+            )
         },
         {
             "nixpkgs_merge_bot.github.github_client.GithubClient.pull_request_files": FakeHttpResponse(
@@ -304,7 +372,7 @@ def test_post_merge_maintainer_multiline(
         "Content-Type": "application/json",
         "X-GitHub-Event": "issue_comment",
         "X-Hub-Signature": "sha1=eff1fea4ebf0cc443d53a499e2466904da8c3062",
-        "X-Hub-Signature-256": "sha256=53e04dda8e5d322028f7111eb9b92dc0056c8bc0bcb084edec7c9b87d594a4bb",
+        "X-Hub-Signature-256": "sha256=36f38dc98dcb7b692dcb6b8490878b69af06c473f39e70853a38bac57dfeb47a",
     }
     client.request("POST", "/", body=create_event, headers=headers)
     response = client.getresponse()
@@ -345,7 +413,7 @@ def test_post_merge_too_large_file(
         "Content-Type": "application/json",
         "X-GitHub-Event": "issue_comment",
         "X-Hub-Signature": "sha1=eff1fea4ebf0cc443d53a499e2466904da8c3062",
-        "X-Hub-Signature-256": "sha256=53e04dda8e5d322028f7111eb9b92dc0056c8bc0bcb084edec7c9b87d594a4bb",
+        "X-Hub-Signature-256": "sha256=36f38dc98dcb7b692dcb6b8490878b69af06c473f39e70853a38bac57dfeb47a",
     }
 
     client.request("POST", "/", body=create_event, headers=headers)
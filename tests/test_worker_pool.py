@@ -0,0 +1,78 @@
+import functools
+import threading
+import time
+
+from nixpkgs_merge_bot.worker_pool import KeyedDispatcher, WorkerPool
+
+
+def test_same_key_waits_without_a_worker() -> None:
+    dispatcher = KeyedDispatcher(WorkerPool(2))
+    order: list[int] = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def first() -> None:
+        started.set()
+        release.wait(5)
+        order.append(0)
+
+    dispatcher.submit("NixOS/nixpkgs#1", first, arrival=0)
+    assert started.wait(5)
+    # submitted out of order, e.g. because a later delivery was parsed first
+    for arrival in (3, 1, 2):
+        dispatcher.submit(
+            "NixOS/nixpkgs#1", functools.partial(order.append, arrival), arrival
+        )
+    assert dispatcher.stats() == {
+        "workers": 2,
+        "busy": 1,
+        "queued": 0,
+        "waiting_for_key": 3,
+    }
+    release.set()
+    for _ in range(50):
+        if len(order) == 4:
+            break
+        time.sleep(0.1)
+    dispatcher.pool.shutdown()
+
+    assert order == [0, 1, 2, 3]
+    assert dispatcher.waiting() == 0
+
+
+def test_different_keys_run_in_parallel() -> None:
+    dispatcher = KeyedDispatcher(WorkerPool(2))
+    inside = threading.Barrier(2, timeout=5)
+    done = threading.Event()
+    results: list[str] = []
+
+    def section(key: str) -> None:
+        # deadlocks unless both sections are entered at the same time
+        inside.wait()
+        results.append(key)
+        if len(results) == 2:
+            done.set()
+
+    dispatcher.submit("a", lambda: section("a"))
+    dispatcher.submit("b", lambda: section("b"))
+    assert done.wait(5)
+    dispatcher.pool.shutdown()
+    assert sorted(results) == ["a", "b"]
+
+
+def test_pool_stats() -> None:
+    pool = WorkerPool(1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    pool.submit(block)
+    pool.submit(lambda: None)
+    assert started.wait(5)
+    assert pool.stats() == {"workers": 1, "busy": 1, "queued": 1}
+    release.set()
+    pool.shutdown()
+    assert pool.stats() == {"workers": 1, "busy": 0, "queued": 0}